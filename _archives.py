@@ -0,0 +1,341 @@
+
+# _archives.py
+# Python One Way File System Hashing - archive member hashing
+# Author: L. Konate
+
+#################################################################
+# Hashes the members of ZIP, TAR and GZ archives for hash.py and
+# sys_file_hashing.py without extracting them to disk
+#
+# ArchiveType() MemberStat() class _ExpandedBudget class _ChargedReader class _ArchiveScanner
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import io #Python Standard Library - Core tools for working with streams
+import stat #Python Standard Library - functions for interpreting os results
+import time #Python Standard Library - Time access and conversions functions
+import zlib #Python Standard Library - Compression compatible with gzip
+import gzip #Python Standard Library - Support for gzip files
+import tarfile #Python Standard Library - Read and write tar archive files
+import zipfile #Python Standard Library - Work with ZIP archives
+import _pfish # p-fish shared hashing engine
+
+# Archive nesting levels opened, 1 hashes the members of the archives
+# found on disk but does not open archives inside them
+DEFAULT_ARCHIVE_DEPTH = 2
+
+# Decompressed bytes allowed for one archive on disk, including every
+# archive nested in it, before the rest of its members are skipped
+DEFAULT_MAX_EXPANDED = 4 * 1024 ** 3
+
+# A nested archive is held in memory to be opened, larger ones are
+# hashed as members but not opened
+NESTED_ARCHIVE_MEMORY = 64 * 1024 * 1024
+
+# Archive types read front to back as a stream, these are opened
+# from the same read that hashes the archive itself
+STREAM_TYPES = ('tar', 'gzip')
+
+# Archive types by name, longer suffixes are checked first so that
+# backup.tar.gz is a tar archive and not a gzip of one file
+ARCHIVE_SUFFIXES = [
+    ('.tar.gz', 'tar'), ('.tar.bz2', 'tar'), ('.tar.xz', 'tar'),
+    ('.tgz', 'tar'), ('.tbz', 'tar'), ('.tbz2', 'tar'), ('.txz', 'tar'), ('.tar', 'tar'),
+    ('.zip', 'zip'), ('.jar', 'zip'), ('.war', 'zip'), ('.apk', 'zip'), ('.docx', 'zip'),
+    ('.xlsx', 'zip'), ('.pptx', 'zip'), ('.odt', 'zip'), ('.ods', 'zip'), ('.odp', 'zip'),
+    ('.epub', 'zip'),
+    ('.gz', 'gzip'),
+]
+
+# Errors a damaged archive or member may raise while being read
+ARCHIVE_ERRORS = (IOError, OSError, EOFError, zlib.error, zipfile.BadZipFile, tarfile.TarError,
+                  RuntimeError, NotImplementedError)
+
+try:
+    import lzma #Python Standard Library - Compression using the LZMA algorithm
+    ARCHIVE_ERRORS += (lzma.LZMAError,)
+except ImportError:
+    pass
+
+
+def ArchiveType(name):
+    # returns 'zip', 'tar' or 'gzip' from a file name, or None
+    lowerName = name.lower()
+    for suffix, kind in ARCHIVE_SUFFIXES:
+        if lowerName.endswith(suffix):
+            return kind
+    return None
+
+
+def MemberStat(mode, size, mtime, uid, gid):
+    #
+    # Name: MemberStat() Function
+    #
+    # Desc: Builds the os.stat_result reported for an archive member from
+    # what the archive records about it. A member has no inode of its
+    # own, so it is given inode and device 0 and a single link
+    #
+    # Input: mode = permission bits, the regular file type is added
+    #        size = bytes the member expanded to
+    #        mtime = modified time in seconds since the epoch
+    #        uid, gid = owner and group
+    #
+    mode = stat.S_IFREG | stat.S_IMODE(mode)
+    mtimeNs = int(mtime * 1000000000)
+    return os.stat_result((mode, 0, 0, 1, uid, gid, size, mtime, mtime, mtime),
+                          {'st_atime_ns': mtimeNs, 'st_mtime_ns': mtimeNs, 'st_ctime_ns': mtimeNs})
+#End MemberStat =========================================
+
+
+class _ExpandedLimit(Exception):
+    # raised when an archive expands past its decompressed byte budget
+    pass
+
+
+class _ExpandedBudget:
+    #
+    # Class: _ExpandedBudget
+    #
+    # Desc: Counts the bytes decompressed from one archive on disk and
+    # stops the scan of it once they pass the limit, so a decompression
+    # bomb costs at most the limit in reads and hashing. Stands between
+    # a member stream and the hash engine, counting as it reads
+    #
+    # Methods:
+    # constructor: Sets the byte limit
+    # reader: Wraps a member stream
+    # readinto: Reads from the wrapped stream and charges the bytes
+    #
+    def __init__(self, limit):
+        self.limit = limit
+        self.remaining = limit
+        self.stream = None
+        self.bytesRead = 0
+
+    def reader(self, stream):
+        self.stream = stream
+        self.bytesRead = 0
+        return self
+
+    def readinto(self, buffer):
+        bytesRead = self.stream.readinto(buffer)
+        if bytesRead:
+            self.bytesRead += bytesRead
+            self.remaining -= bytesRead
+            if self.remaining < 0:
+                raise _ExpandedLimit()
+        return bytesRead
+
+#End _ExpandedBudget ====================================
+
+
+class _ChargedReader(io.RawIOBase):
+    #
+    # Class: _ChargedReader
+    #
+    # Desc: Seekable raw reader over an archive opened a second time to
+    # read its members, a ZIP archive, that charges every read to the
+    # governor as _pfish._HashEngine charges the reads that hash it
+    #
+    # Methods:
+    # constructor: Takes the open file and the governor
+    # readinto: Reads from the file into a buffer and charges the read
+    # seek, tell: Move about the file for the central directory
+    #
+    def __init__(self, f, governor):
+        super().__init__()
+        self.f = f
+        self.governor = governor
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.f.seek(offset, whence)
+
+    def tell(self):
+        return self.f.tell()
+
+    def readinto(self, buffer):
+        bytesRead = self.f.readinto(buffer)
+        self.governor.charge(bytesRead or 0)
+        return bytesRead
+
+#End _ChargedReader =====================================
+
+
+class _ArchiveScanner:
+    #
+    # Class: _ArchiveScanner
+    #
+    # Desc: Opens an archive found by the scan and hashes every regular
+    # member straight from the decompressing stream with the scan's own
+    # hash engine, so nothing is written to disk and each member is
+    # decompressed once. Members are reported as archive!/member/path,
+    # and archives inside archives are opened in turn, from memory, down
+    # to maxDepth.
+    # Tar and gzip archives are read as a stream from start to end. For
+    # these ScanFile() hands scan() the read that hashes the archive
+    # itself (_HashEngine.hashThrough()), so the archive is read from
+    # disk once. ZIP archives are read through their central directory,
+    # which needs random access, so a ZIP archive is read twice: once to
+    # hash it and once to open its members.
+    # The decompressed bytes of an archive on disk and everything nested
+    # in it are capped at maxExpanded. A member declaring more than what
+    # is left is skipped without being read, and when the bytes actually
+    # read pass the cap the rest of the archive is skipped
+    #
+    # Holds only settings, so one scanner is shared by threads and is
+    # handed to worker processes
+    #
+    # Methods:
+    # constructor: Sets the depth and size limits
+    # isArchive: True when a file name is an archive type
+    # streams: True when a file name is an archive read as a stream
+    # scan: Hashes the members of an archive
+    #
+    def __init__(self, maxDepth=DEFAULT_ARCHIVE_DEPTH, maxExpanded=DEFAULT_MAX_EXPANDED,
+                 nestedMemory=NESTED_ARCHIVE_MEMORY):
+        self.maxDepth = maxDepth
+        self.maxExpanded = maxExpanded
+        self.nestedMemory = nestedMemory
+
+    def isArchive(self, name):
+        return ArchiveType(name) is not None
+
+    def streams(self, name):
+        return ArchiveType(name) in STREAM_TYPES
+
+    def scan(self, theFile, hashEngine, reader=None):
+        # returns (member path, FileRecord, message) tuples sorted by
+        # member path, the record is None and message says why when a
+        # member could not be hashed. Messages about the archive as a
+        # whole have a member path of None and sort first.
+        # reader, when given, is the archive already open at its start
+        # and is read from instead of opening theFile again
+        results = []
+        budget = _ExpandedBudget(self.maxExpanded)
+        governor = hashEngine.governor
+        kind = ArchiveType(os.path.basename(theFile))
+        try:
+            if reader is not None:
+                self._scanArchive(reader, theFile, kind, os.fstat(reader.fileno()), 1,
+                                  hashEngine, budget, results)
+            else:
+                with open(theFile, 'rb', buffering=0) as f:
+                    st = os.fstat(f.fileno())
+                    archive = f
+                    if governor is not None:
+                        governor.opened(f.fileno())
+                        archive = io.BufferedReader(_ChargedReader(f, governor))
+                    try:
+                        self._scanArchive(archive, theFile, kind, st, 1, hashEngine, budget, results)
+                    finally:
+                        if governor is not None:
+                            governor.finished(f.fileno())
+        except _ExpandedLimit:
+            results.append((None, None, 'Archive Expanded Past '+ str(self.maxExpanded)
+                            +' Bytes, Remaining Members Skipped:'+ theFile))
+        except ARCHIVE_ERRORS as err:
+            results.append((None, None, 'Archive Unreadable:'+ theFile +' ('+ str(err) +')'))
+        results.sort(key=lambda result: result[0] or '')
+        return results
+
+    def _scanArchive(self, f, archivePath, kind, st, depth, hashEngine, budget, results):
+        # st is the stat result of the archive on disk, it supplies the
+        # owner of members whose archive format does not record one
+        prefix = archivePath + _pfish.MEMBER_SEPARATOR
+        if kind == 'zip':
+            with zipfile.ZipFile(f) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    memberPath = prefix + info.filename
+                    mode = info.external_attr >> 16
+                    if stat.S_ISLNK(mode):
+                        results.append((memberPath, None, repr(info.filename) +' is a Link NOT a File!'))
+                        continue
+                    if info.flag_bits & 0x1:
+                        results.append((memberPath, None, 'Encrypted Member Not Hashed:'+ memberPath))
+                        continue
+                    if info.file_size > budget.remaining:
+                        results.append((memberPath, None, 'Member Declares '+ str(info.file_size)
+                                        +' Bytes, Over The Expanded Size Limit:'+ memberPath))
+                        continue
+                    try:
+                        mtime = time.mktime(info.date_time + (0, 0, -1))
+                    except (OverflowError, ValueError):
+                        mtime = 0
+                    with archive.open(info) as stream:
+                        self._hashMember(stream, memberPath, mode or 0o644, mtime, st.st_uid, st.st_gid,
+                                         depth, hashEngine, budget, results)
+        elif kind == 'tar':
+            # a stream read, so compressed tars are never seeked backwards
+            with tarfile.open(fileobj=f, mode='r|*') as archive:
+                for info in archive:
+                    if not info.isreg():
+                        if info.issym() or info.islnk():
+                            results.append((prefix + info.name, None, repr(info.name) +' is a Link NOT a File!'))
+                        continue
+                    memberPath = prefix + info.name
+                    if info.size > budget.remaining:
+                        results.append((memberPath, None, 'Member Declares '+ str(info.size)
+                                        +' Bytes, Over The Expanded Size Limit:'+ memberPath))
+                        continue
+                    stream = archive.extractfile(info)
+                    self._hashMember(stream, memberPath, info.mode, info.mtime, info.uid, info.gid,
+                                     depth, hashEngine, budget, results)
+        else:
+            # a gzip file holds one member, named after the file
+            name = os.path.basename(archivePath)
+            name = name[:-3] if name.lower().endswith('.gz') else name
+            with gzip.GzipFile(fileobj=f, mode='rb') as stream:
+                self._hashMember(stream, prefix + name, st.st_mode, st.st_mtime, st.st_uid, st.st_gid,
+                                 depth, hashEngine, budget, results)
+
+    def _hashMember(self, stream, memberPath, mode, mtime, uid, gid, depth, hashEngine, budget, results):
+        name = memberPath.rsplit('/', 1)[-1]
+        nestedKind = ArchiveType(name) if depth < self.maxDepth else None
+        nested = None
+        if nestedKind is not None:
+            nested = io.BytesIO()
+
+            def Keep(chunk):
+                # holds the member for opening unless it is too large
+                if nested.tell() + len(chunk) <= self.nestedMemory:
+                    nested.write(chunk)
+                else:
+                    nested.truncate(0)
+                    nested.seek(self.nestedMemory + 1)
+
+        # the governor was charged for the archive's bytes as they were
+        # read from disk, charging the decompressed bytes again would let
+        # a small archive of a highly compressible member stall the scan
+        try:
+            hashValues = hashEngine.hashStream(budget.reader(stream), Keep if nested is not None else None,
+                                               charged=False)
+        except ARCHIVE_ERRORS as err:
+            # a budget overrun is not caught here, it ends the whole archive
+            results.append((memberPath, None, 'Read Failed:'+ memberPath +' ('+ str(err) +')'))
+            return
+        memberStat = MemberStat(mode, budget.bytesRead, mtime, uid, gid)
+        results.append((memberPath, _pfish.FileRecord(memberPath, name, memberStat, hashValues, None), None))
+        if nested is None:
+            return
+        if nested.tell() > self.nestedMemory:
+            results.append((None, None, 'Nested Archive Over '+ str(self.nestedMemory)
+                            +' Bytes Not Opened:'+ memberPath))
+            return
+        nested.seek(0)
+        try:
+            self._scanArchive(nested, memberPath, nestedKind, memberStat, depth + 1, hashEngine, budget, results)
+        except ARCHIVE_ERRORS as err:
+            results.append((None, None, 'Nested Archive Unreadable:'+ memberPath +' ('+ str(err) +')'))
+
+#End _ArchiveScanner ====================================
@@ -0,0 +1,245 @@
+
+# _baseline.py
+# Python One Way File System Hashing - baseline verification
+# Author: L. Konate
+
+#################################################################
+# Compares a running scan against an earlier fileSystemReport.csv
+# for hash.py and sys_file_hashing.py
+#
+# CheckBaseline() class _BaselineVerifier MergeVerifyReports()
+#################################################################
+
+import csv #Python Standard Library - reader and writer for csv files
+import collections #Python Standard Library - Container datatypes
+import _pfish # p-fish shared hashing engine
+import _report # p-fish report writer
+
+# Verification report written next to fileSystemReport.csv and named
+# after it, fileSystemReport.verify.csv or fileSystemReport.shard1of4.verify.csv
+VERIFY_SUFFIX = '.verify.csv'
+VERIFY_HEADER = ('Status', 'Path', 'Changed', 'Baseline', 'Current')
+
+# Report columns compared as metadata, the access time is left out
+# because hashing the file changes it
+METADATA_COLUMNS = ('Modified Time', 'Owner', 'Group', 'Mode')
+
+# Verification status of a file
+ADDED = 'Added'
+REMOVED = 'Removed'
+MODIFIED = 'Modified'
+METADATA_CHANGED = 'Metadata Changed'
+UNREADABLE = 'Unreadable'
+
+
+def CheckBaseline(baselineFile, hashTypes):
+    #
+    # Name: CheckBaseline() Function
+    #
+    # Desc: Checks a baseline report can verify a scan: it must have a
+    # Path column and a digest column of at least one of the scan's
+    # algorithms. Without a shared digest only size and metadata could
+    # be compared, and content changed at the same size with the times
+    # put back would pass as unchanged
+    #
+    # Input: baselineFile = the baseline report
+    #        hashTypes = the scan's algorithms, in report column order
+    #
+    # Actions:
+    # returns the algorithms both reports carry
+    # raises ValueError when the baseline cannot verify the scan
+    #
+    with _report.OpenReportText(baselineFile) as csvFile:
+        header = next(csv.reader(csvFile), [])
+    if 'Path' not in header:
+        raise ValueError('Baseline has no Path column: '+ baselineFile)
+    shared = [hashType for hashType in hashTypes if hashType in header]
+    if not shared:
+        baselineTypes = [hashType for option, hashType in _pfish.HASH_OPTIONS if hashType in header]
+        raise ValueError('Baseline shares no hash algorithm with the scan, it holds '+
+                         (', '.join(baselineTypes) or 'no digests') +': '+ baselineFile)
+    return shared
+#End CheckBaseline ======================================
+
+
+class _BaselineVerifier:
+    #
+    # Class: _BaselineVerifier
+    #
+    # Desc: Checks each scanned file against a baseline report while the
+    # scan runs and writes every difference to a verification report.
+    # A baseline written in walk order, which is how p-fish writes its
+    # reports, is merge-joined with the scan so only one baseline row is
+    # held in memory, archive member rows sorting right after their
+    # archive. Any other baseline is loaded into a path index holding
+    # just the compared columns.
+    # A shard of a sharded scan passes owns, a function telling the
+    # baseline paths of its own shard, so the files hashed by the other
+    # shards are not reported removed
+    #
+    # Methods:
+    # constructor: Opens the baseline and the verification report
+    # checkFile: Compares one scanned file with the baseline
+    # skipFile: Notes a file the scan could not hash
+    # close: Reports the baseline files never seen and closes the reports
+    #
+    def __init__(self, baselineFile, reportFile, hashTypes, owns=None):
+        self.baselineFile = baselineFile
+        self.owns = owns
+        with _report.OpenReportText(baselineFile) as csvFile:
+            rows = csv.reader(csvFile)
+            header = next(rows)
+            firstRow = next(rows, None)
+        # compare the digests both reports carry, then size and metadata
+        self.hashColumns = CheckBaseline(baselineFile, hashTypes)
+        self.pathColumn = header.index('Path')
+        self.hashIndexes = [hashTypes.index(hashType) for hashType in self.hashColumns]
+        self.compared = [name for name in self.hashColumns + ['Size'] + list(METADATA_COLUMNS) if name in header]
+        self.columns = [header.index(name) for name in self.compared]
+        # reports written with --raw-times hold integer nanoseconds
+        self.rawTimes = False
+        if firstRow is not None and 'Modified Time' in header:
+            self.rawTimes = firstRow[header.index('Modified Time')].isdigit()
+        self.counts = collections.OrderedDict((status, 0) for status in (ADDED, REMOVED, MODIFIED, METADATA_CHANGED, UNREADABLE))
+        self.unchanged = 0
+
+        self.sorted = self._isWalkOrdered()
+        self.index = None
+        self.rows = None
+        self.pending = None
+        if self.sorted:
+            self.csvFile = _report.OpenReportText(baselineFile)
+            self.rows = csv.reader(self.csvFile)
+            next(self.rows)
+            self._advance()
+        else:
+            self.csvFile = None
+            self.index = {}
+            with _report.OpenReportText(baselineFile) as csvFile:
+                rows = csv.reader(csvFile)
+                next(rows)
+                for row in rows:
+                    if owns is None or owns(row[self.pathColumn]):
+                        self.index[row[self.pathColumn]] = tuple(row[column] for column in self.columns)
+
+        self.reportFile = open(reportFile, 'w', newline='')
+        self.writer = csv.writer(self.reportFile, delimiter=',', quoting=csv.QUOTE_ALL)
+        self.writer.writerow(VERIFY_HEADER)
+
+    def _isWalkOrdered(self):
+        # one streaming pass over the baseline paths
+        with _report.OpenReportText(self.baselineFile) as csvFile:
+            rows = csv.reader(csvFile)
+            next(rows)
+            lastKey = None
+            for row in rows:
+                key = _pfish.WalkOrderKey(row[self.pathColumn], members=True)
+                if lastKey is not None and key <= lastKey:
+                    return False
+                lastKey = key
+        return True
+
+    def _advance(self):
+        row = next(self.rows, None)
+        if self.owns is not None:
+            while row is not None and not self.owns(row[self.pathColumn]):
+                row = next(self.rows, None)
+        if row is None:
+            self.pending = None
+        else:
+            path = row[self.pathColumn]
+            self.pending = (_pfish.WalkOrderKey(path, members=True), path, tuple(row[column] for column in self.columns))
+
+    def _baselineFor(self, theFile):
+        # returns the baseline values of theFile or None, in merge mode
+        # every baseline file passed over on the way is reported removed
+        if self.index is not None:
+            return self.index.pop(theFile, None)
+        key = _pfish.WalkOrderKey(theFile, members=True)
+        while self.pending is not None and self.pending[0] < key:
+            self._report(REMOVED, self.pending[1])
+            self._advance()
+        if self.pending is not None and self.pending[0] == key:
+            values = self.pending[2]
+            self._advance()
+            return values
+        return None
+
+    def _report(self, status, theFile, changed=(), baseline=(), current=()):
+        self.counts[status] += 1
+        self.writer.writerow((status, theFile, ';'.join(changed), ';'.join(baseline), ';'.join(current)))
+
+    def checkFile(self, record):
+        baseline = self._baselineFor(record.path)
+        if baseline is None:
+            self._report(ADDED, record.path)
+            return ADDED
+        (fileName, filePath, fileSize, allocSize, mTime, aTime, cTime,
+         hashVals, own, grp, mod) = _pfish.FormatRow(record, self.rawTimes)[:11]
+        values = dict(zip(self.hashColumns, [hashVals[index] for index in self.hashIndexes]))
+        values.update({'Size': fileSize, 'Modified Time': mTime, 'Owner': own, 'Group': grp, 'Mode': mod})
+        current = tuple(values[name] for name in self.compared)
+        if current == baseline:
+            self.unchanged += 1
+            return None
+        changed = [name for name, old, new in zip(self.compared, baseline, current) if old != new]
+        oldValues = [old for old, new in zip(baseline, current) if old != new]
+        newValues = [new for old, new in zip(baseline, current) if old != new]
+        if any(name in self.hashColumns or name == 'Size' for name in changed):
+            status = MODIFIED
+        else:
+            status = METADATA_CHANGED
+        self._report(status, record.path, changed, oldValues, newValues)
+        return status
+
+    def skipFile(self, theFile):
+        if self._baselineFor(theFile) is not None:
+            self._report(UNREADABLE, theFile)
+
+    def close(self):
+        if self.index is not None:
+            for theFile in sorted(self.index, key=lambda theFile: _pfish.WalkOrderKey(theFile, members=True)):
+                self._report(REMOVED, theFile)
+            self.index = None
+        else:
+            while self.pending is not None:
+                self._report(REMOVED, self.pending[1])
+                self._advance()
+            self.csvFile.close()
+        self.reportFile.close()
+
+#End _BaselineVerifier ==================================
+
+
+def MergeVerifyReports(reportFiles, mergedFile):
+    #
+    # Name: MergeVerifyReports() Function
+    #
+    # Desc: Joins the verification reports of a sharded scan into one,
+    # in walk order. A report holds only the differences, so the rows
+    # are sorted in memory
+    #
+    # Input: reportFiles = the verification reports of the shards
+    #        mergedFile = the report to write
+    #
+    # Actions:
+    # returns the status counts of the merged report, raises ValueError
+    # when a file is not a verification report
+    #
+    rows = []
+    for reportFile in reportFiles:
+        with open(reportFile, newline='') as csvFile:
+            reader = csv.reader(csvFile)
+            if tuple(next(reader, ())) != VERIFY_HEADER:
+                raise ValueError('not a verification report: '+ reportFile)
+            rows.extend(reader)
+    rows.sort(key=lambda row: _pfish.WalkOrderKey(row[1], members=True))
+    counts = collections.OrderedDict((status, 0) for status in (ADDED, REMOVED, MODIFIED, METADATA_CHANGED, UNREADABLE))
+    with open(mergedFile, 'w', newline='') as csvFile:
+        writer = csv.writer(csvFile, delimiter=',', quoting=csv.QUOTE_ALL)
+        writer.writerow(VERIFY_HEADER)
+        for row in rows:
+            counts[row[0]] = counts.get(row[0], 0) + 1
+            writer.writerow(row)
+    return counts
+#End MergeVerifyReports =================================
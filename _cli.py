@@ -0,0 +1,754 @@
+# _cli.py
+# Python One Way File System Hashing - command line and scan modes
+# Author: L. Konate
+
+#################################################################
+# The command line, its validation, the scan pipeline and the scan
+# modes shared by hash.py and sys_file_hashing.py. A script builds the
+# parser, adds its own options and hands the parsed arguments to a
+# _ScanSession with a report callable, which is all that differs
+# between the scripts: hash.py prints every message, sys_file_hashing.py
+# logs them and shows only the summary on the console
+#
+# BuildParser() ValidateDirectory() ValidateDirectoryWritable() class _ScanSession
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import sys # Python Library system specific parameters
+import copy #Python Standard Library - Shallow and deep copy operations
+import re #Python Standard Library - Regular expression operations
+import argparse #Python Standard Library - Parser for commandline options, arguments
+import logging #Python Standard Library - logging facility
+import sqlite3 #Python Standard Library - DB-API 2.0 interface for SQLite databases
+import _pfish # p-fish shared hashing engine
+import _hashCache # p-fish persistent hash cache
+import _duplicates # p-fish duplicate file finder
+import _pieceHash # p-fish piecewise block hashing
+import _baseline # p-fish baseline verification
+import _knownFiles # p-fish known file hash sets
+import _report # p-fish report writer
+import _governor # p-fish resource governed reads
+import _schedule # p-fish physical order scheduling
+import _filters # p-fish walk filters
+import _archives # p-fish archive member hashing
+import _shards # p-fish sharded scans
+import _stats # p-fish scan statistics
+import _profile # p-fish profiling hooks
+import _segments # p-fish segmented hashing of huge files
+
+# Levels a session hands to the report callable with each message, the
+# logging levels plus DETAIL, the per file progress shown only with
+# --verbose, and SUMMARY, the end of run figures that are logged and
+# also shown on the console
+DETAIL = logging.DEBUG
+SUMMARY = logging.INFO + 5
+
+
+def BuildParser():
+    #
+    # Name: BuildParser() Function
+    #
+    # Desc: Builds the command line shared by hash.py and
+    # sys_file_hashing.py, a script may add its own options to it.
+    # Options that depend on each other are checked by _ScanSession
+    #
+    # Input: none
+    #
+    # Actions:
+    # returns the argparse.ArgumentParser
+    #
+    parser = argparse.ArgumentParser('Python file system hashing ...')
+    parser.add_argument('-v','--verbose', help='allows progress messages to be displayed', action='store_true')
+    parser.add_argument('--estimate', help='count the files of rootPath on a background thread, a second walk of the tree, so the progress line shows a percentage and ETA. Sharded scans take these from the shard plan without it', action='store_true')
+    # setup a group of hash algorithms, any combination may be selected
+    # and every selected hash is computed from a single read of each file
+    group = parser.add_argument_group('hash algorithms', 'select one or more, each becomes a report column')
+    group.add_argument('--md5', help ='specifies MD5 algorithm', action='store_true')
+    group.add_argument('--sha256', help ='specifies SHA256 algorithm', action='store_true')
+    group.add_argument('--sha512', help ='specifies SHA512 algorithm', action='store_true')
+    group.add_argument('--blake2b', help ='specifies BLAKE2b algorithm', action='store_true')
+    group.add_argument('--sha3', help ='specifies SHA3-256 algorithm', action='store_true')
+    parser.add_argument('--benchmark', help='report the cost of each selected hash algorithm (all if none selected) on this machine and exit', action='store_true')
+    parser.add_argument('--chunk-size', type= _pfish.ValidateChunkSize, default=_pfish.DEFAULT_CHUNK_SIZE, help="size of the reusable read buffer, e.g. 64K or 4M (default 1M)")
+    parser.add_argument('--mmap-threshold', type= _pfish.ValidateSize, metavar='SIZE', help="hash local files of SIZE or more, e.g. 256M, from a read only memory map instead of copying them through the read buffer. Network mounts are always read. A file truncated while mapped ends the scan, so only use it on evidence that is not changing")
+    parser.add_argument('--workers', type= _pfish.ValidateWorkers, default=1, help="number of hashing processes, results are still reported in walk order (default 1)")
+    parser.add_argument('--threads', type= _pfish.ValidateWorkers, default=1, help="number of files opened and read at once by a thread pool, for network mounts with many small files (default 1)")
+    parser.add_argument('--physical-order', choices=_schedule.PHYSICAL_ORDERS, help="read each batch of files in inode order, or in on-disk order of their first extent, to cut seeks on spinning disks. The report keeps walk order")
+    parser.add_argument('--max-bytes-per-sec', type= _pfish.ValidateRate, metavar='RATE', help="limit the bytes read per second over all workers or threads, e.g. 50M")
+    parser.add_argument('--max-iops', type= _pfish.ValidateRate, metavar='COUNT', help="limit the reads issued per second over all workers or threads")
+    parser.add_argument('--drop-cache', help='release each file from the page cache once it is hashed, so the scan does not evict the working set of a live host', action='store_true')
+    parser.add_argument('--low-priority', help='run at the lowest CPU priority and the idle I/O class, like nice and ionice', action='store_true')
+    parser.add_argument('--incremental', help='reuse digests from the hash cache for files whose device, inode, size, mtime and ctime are unchanged', action='store_true')
+    parser.add_argument('--cache-file', help="hash cache database used by --incremental (default reportPath/"+ _hashCache.CACHE_FILE_NAME +")")
+    parser.add_argument('--verify-cache', type= _pfish.ValidatePercent, default=0.0, metavar='PERCENT', help="with --incremental, re-read this percentage of unchanged files at random and compare against the cache")
+    parser.add_argument('--find-duplicates', help='report groups of identical files to '+ _duplicates.DUPLICATE_REPORT_NAME +' instead of hashing every file', action='store_true')
+    parser.add_argument('--piecewise', help='also record a digest of every block, with the first selected algorithm, in reportPath/'+ _report.REPORT_NAME + _pieceHash.BLOCK_SUFFIX +' plus a Merkle root column', action='store_true')
+    parser.add_argument('--block-size', type= _pfish.ValidateBlockSize, default=_pieceHash.DEFAULT_BLOCK_SIZE, help="block size for --piecewise, e.g. 64K or 4M (default 1M)")
+    parser.add_argument('--verify-blocks', metavar='FILE', help='re-check FILE against the block digests in reportPath/'+ _report.REPORT_NAME + _pieceHash.BLOCK_SUFFIX +', or those of --shard, and exit')
+    parser.add_argument('--block-ranges', metavar='RANGES', help='with --verify-blocks, only check these byte ranges e.g. 0-1G,5G-6G (default the whole file)')
+    parser.add_argument('--report-format', choices=_report.REPORT_FORMATS, default='csv', help="report written to reportPath/"+ _report.REPORT_NAME +", csv, gzip compressed csv or an SQLite database (default csv)")
+    parser.add_argument('--raw-times', help='write file times as integer nanoseconds since the epoch instead of text', action='store_true')
+    parser.add_argument('--checkpoint', type= _pfish.ValidateSeconds, metavar='SECONDS', help='sync the report and save a checkpoint every SECONDS so an interrupted scan can be resumed')
+    parser.add_argument('--resume', help='continue an interrupted scan from its checkpoint in reportPath, appending to its report', action='store_true')
+    parser.add_argument('--verify', metavar='BASELINE', help='compare the scan against an earlier fileSystemReport.csv and write added, removed, modified and metadata changed files to reportPath/'+ _report.REPORT_NAME + _baseline.VERIFY_SUFFIX)
+    parser.add_argument('--known-good', action='append', metavar='SET', help='tag files found in this known set (built with --import-known), may be repeated')
+    parser.add_argument('--known-bad', action='append', metavar='SET', help='tag and warn about files found in this known set, may be repeated')
+    parser.add_argument('--suppress-known', help='leave known good files out of the report instead of tagging them', action='store_true')
+    parser.add_argument('--import-known', metavar='SET', help='build the known set SET from the --hash-list files, using the one selected algorithm, and exit')
+    parser.add_argument('--hash-list', action='append', metavar='FILE', help='with --import-known, a text hash list such as NSRLFile.txt or md5sum output, may be repeated')
+    # setup a group of walk filters, decided from names and the stat data
+    # the walk already has, so nothing filtered out is ever opened
+    walkGroup = parser.add_argument_group('walk filters', 'glob patterns holding a / match the path below rootPath, others match the name')
+    walkGroup.add_argument('--include', action='append', metavar='GLOB', help='only hash files matching GLOB, may be repeated')
+    walkGroup.add_argument('--exclude', action='append', metavar='GLOB', help='skip files and prune directories matching GLOB, may be repeated')
+    walkGroup.add_argument('--include-regex', action='append', metavar='REGEX', help='only hash files whose path below rootPath matches REGEX, may be repeated')
+    walkGroup.add_argument('--exclude-regex', action='append', metavar='REGEX', help='skip files and prune directories whose path below rootPath matches REGEX, may be repeated')
+    walkGroup.add_argument('--min-size', type= _pfish.ValidateSize, metavar='SIZE', help='skip files smaller than SIZE, e.g. 4K')
+    walkGroup.add_argument('--max-size', type= _pfish.ValidateSize, metavar='SIZE', help='skip files larger than SIZE, e.g. 2G')
+    walkGroup.add_argument('--newer-than', type= _pfish.ValidateTime, metavar='TIME', help='only hash files modified after TIME, a date such as 2019-10-01 or an age such as 7d')
+    walkGroup.add_argument('--older-than', type= _pfish.ValidateTime, metavar='TIME', help='only hash files modified before TIME')
+    walkGroup.add_argument('--max-depth', type=int, metavar='DEPTH', help='do not descend more than DEPTH directories below rootPath, 0 hashes rootPath itself only')
+    walkGroup.add_argument('--one-file-system', help='do not descend into directories on other file systems', action='store_true')
+    # setup a group of archive options, members are hashed from the
+    # decompressing stream and never extracted to disk
+    archiveGroup = parser.add_argument_group('archives', 'members are reported as archive.zip!/inner/path rows')
+    archiveGroup.add_argument('--archives', help='also hash the members of ZIP, TAR and GZ archives', action='store_true')
+    archiveGroup.add_argument('--archive-depth', type=int, default=_archives.DEFAULT_ARCHIVE_DEPTH, metavar='DEPTH', help='archive nesting levels opened, 1 does not open archives inside archives (default '+ str(_archives.DEFAULT_ARCHIVE_DEPTH) +')')
+    archiveGroup.add_argument('--archive-max-size', type= _pfish.ValidateSize, default=_archives.DEFAULT_MAX_EXPANDED, metavar='SIZE', help='stop hashing an archive once it has expanded to SIZE bytes, nested archives included, a guard against decompression bombs (default 4G)')
+    # setup a group of sharding options, every machine runs the same
+    # command with its own --shard and the partial reports are merged
+    shardGroup = parser.add_argument_group('sharding', 'split one rootPath between machines, each hashing its own share')
+    shardGroup.add_argument('--shard', type= _pfish.ValidateShard, metavar='I/N', help='hash only the I-th of N balanced shards of rootPath, into a partial report named for the shard')
+    shardGroup.add_argument('--shard-plan', metavar='FILE', help='shard plan written by --plan-shards, so every machine uses the same split (default each shard plans rootPath itself)')
+    shardGroup.add_argument('--plan-shards', type=int, metavar='N', help='split rootPath into N shards, write the plan to --shard-plan and exit')
+    shardGroup.add_argument('--merge-shards', action='append', metavar='PARTIAL', help='merge partial reports into one sorted, deduplicated reportPath/'+ _report.REPORT_NAME +' with a manifest, and exit. Give every partial, each with its own option')
+    # setup a group of profiling options, to see where a slow scan in
+    # the field spends its time without editing the scripts
+    profileGroup = parser.add_argument_group('profiling', 'profiles are written next to the report')
+    profileGroup.add_argument('--profile', help='run under cProfile and write reportPath/'+ _report.REPORT_NAME + _profile.PROFILE_SUFFIX +' and a summary of the hottest functions', action='store_true')
+    profileGroup.add_argument('--profile-top', type= _pfish.ValidateWorkers, default=_profile.DEFAULT_PROFILE_TOP, metavar='N', help='functions listed in the profile summary (default '+ str(_profile.DEFAULT_PROFILE_TOP) +')')
+    profileGroup.add_argument('--trace-slow-files', type= _profile.ValidateMilliseconds, metavar='MS', help='report every file that took longer than MS milliseconds to open, read and hash')
+    # setup a group of segmented hashing options, one huge file is
+    # split between every core instead of being read by one of them
+    segmentGroup = parser.add_argument_group('segmented hashing', 'segment digests are combined into a tree digest per algorithm, listed in reportPath/'+ _report.REPORT_NAME + _segments.SEGMENT_SUFFIX)
+    segmentGroup.add_argument('--segment-threshold', type= _pfish.ValidateSize, metavar='SIZE', help='hash files of SIZE or more, e.g. 4G, as segments read and hashed at once by a pool of processes')
+    segmentGroup.add_argument('--segment-size', type= _pfish.ValidateSize, default=_segments.DEFAULT_SEGMENT_SIZE, metavar='SIZE', help='bytes in each segment, the tree digest depends on it (default 64M)')
+    segmentGroup.add_argument('--segment-workers', type= _pfish.ValidateWorkers, metavar='N', help='processes hashing segments (default the number of CPUs)')
+    segmentGroup.add_argument('--segment-serial', help='also compute the conventional digest of each segmented file, one more read of the whole file, and report it instead of the tree digest', action='store_true')
+    parser.add_argument('-d','--rootPath', type= ValidateDirectory, help="specify the rootpath for hashing")
+    parser.add_argument('-r','--reportPath', type= ValidateDirectoryWritable, help="specify the path for reports")
+    return parser
+#End BuildParser ========================================
+
+
+def ValidateDirectory(theDir):
+    #
+    # Name: ValidateDirectory Function
+    #
+    # Desc: Function that will validate a directory path as
+    # existing and readable. Used for argument validation only
+    #
+    # Input: a directory path string
+    #
+    # Actions:
+    # if valid it will return the Directory String
+    # if invalid it will raise an ArgumentTypeError within argparse
+    # which will in turn be reported by argparse to the user
+    #
+    # Validate the path is a directory
+    if not os.path.isdir(theDir):
+        raise argparse.ArgumentTypeError('Directory does not exist!')
+    # Validate the path is readable
+    if os.access(theDir, os.R_OK):
+        return theDir
+    else:
+        raise argparse.ArgumentTypeError('Directory is not readable!')
+#End ValidateDirectory ==================================
+
+
+def ValidateDirectoryWritable(theDir):
+    #
+    # Name: ValidateDirectoryWritable Function
+    #
+    # Desc: Function that will validate a directory path as
+    # existing and writable. Used for argument validation only
+    #
+    # Input: a directory path string
+    #
+    # Actions:
+    # if valid will return the Directory String
+    # if invalid it will raise an ArgumentTypeError within argparse
+    # which will in turn be reported by argparse to the user
+    #
+    # Validate the path is a directory
+    if not os.path.isdir(theDir):
+        raise argparse.ArgumentTypeError('Directory does not exist!')
+    # Validate the path is writable
+    if os.access(theDir, os.W_OK):
+        return theDir
+    else:
+        raise argparse.ArgumentTypeError('Directory is not writable!')
+#End ValidateDirectoryWritable ==========================
+
+
+class _ScanSession:
+    #
+    # Class: _ScanSession
+    #
+    # Desc: One run of a p-fish script. The constructor checks the
+    # options that depend on each other, reporting a conflict with
+    # parser.error() as argparse reports a bad value, and sets up the
+    # hash engine, cache, filters and the rest of the scan pipeline.
+    # run() then carries out the mode the command line asked for.
+    # Every message goes through the script's report callable,
+    # report(message, level) with a logging level, DETAIL or SUMMARY
+    #
+    # Methods:
+    # constructor: Validates the arguments and sets up the pipeline
+    # run: Runs the selected mode and returns the files processed
+    # walkPath: Hashes the tree into the report
+    # hashFile: Hashes one file and reports it
+    # reportFile: Writes one hashed file, or reports why it was skipped
+    # reportMembers: Writes the members hashed from inside an archive
+    # findDuplicates: Reports groups of identical files
+    # verifyBlockFile: Re-checks a file against its block digests
+    # importKnownSet: Builds a known set from hash lists
+    # planShardScan: Saves a shard plan
+    # mergeShards: Merges the partial reports of a sharded scan
+    #
+    def __init__(self, parser, args, report):
+        self.args = args
+        self.report = report
+        self._checkOptions(parser)
+        self._setUpPipeline(parser)
+
+    def _checkOptions(self, parser):
+        # options that only make sense together, or not at all together,
+        # are reported as argparse reports a bad value
+        args = self.args
+        # collect the selected algorithms in report column order
+        self.hashTypes = [hashType for option, hashType in _pfish.HASH_OPTIONS if getattr(args, option)]
+        self.checkpoint = None
+        if args.benchmark:
+            if not self.hashTypes:
+                self.hashTypes = [hashType for option, hashType in _pfish.HASH_OPTIONS]
+        elif args.import_known:
+            # a known set holds the digests of exactly one algorithm
+            if len(self.hashTypes) != 1:
+                parser.error('--import-known needs exactly one hash algorithm')
+            if not args.hash_list:
+                parser.error('--import-known needs at least one --hash-list')
+        elif args.plan_shards is not None:
+            if args.plan_shards < 1:
+                parser.error('--plan-shards needs at least 1 shard')
+            if args.rootPath is None or args.shard_plan is None:
+                parser.error('--plan-shards needs -d/--rootPath and --shard-plan')
+        elif args.merge_shards:
+            if args.reportPath is None:
+                parser.error('--merge-shards needs -r/--reportPath, where the merged report is written')
+            mergedFile = os.path.abspath(_report.ReportFileName(args.reportPath, args.report_format))
+            for partialFile in args.merge_shards:
+                if not os.path.isfile(partialFile):
+                    parser.error('partial report not found: '+ partialFile)
+                if os.path.abspath(partialFile) == mergedFile:
+                    parser.error('the merged report would overwrite a partial, give a different report path')
+            try:
+                _shards.PartialSidecars(args.merge_shards)
+            except ValueError as err:
+                parser.error(str(err))
+        elif args.verify_blocks:
+            # the sidecar names its own algorithm and block size
+            if args.reportPath is None:
+                parser.error('--verify-blocks needs -r/--reportPath, the directory holding '+ _report.REPORT_NAME + _pieceHash.BLOCK_SUFFIX)
+            if not os.path.isfile(args.verify_blocks):
+                parser.error('file to verify not found: '+ args.verify_blocks)
+            blockFile = _report.SidecarFileName(args.reportPath, _pieceHash.BLOCK_SUFFIX, args.shard)
+            if not os.path.isfile(blockFile):
+                parser.error('no block digests found, '+ blockFile +' does not exist')
+            try:
+                _pieceHash.ParseRanges(args.block_ranges, 0)
+            except ValueError as err:
+                parser.error(str(err))
+        else:
+            if not self.hashTypes:
+                parser.error('at least one hash algorithm must be specified')
+            if args.rootPath is None or args.reportPath is None:
+                parser.error('the following arguments are required: -d/--rootPath, -r/--reportPath')
+            if args.workers > 1 and args.threads > 1:
+                parser.error('--workers and --threads cannot be combined')
+            if args.max_depth is not None and args.max_depth < 0:
+                parser.error('--max-depth cannot be negative')
+            if args.archive_depth < 1:
+                parser.error('--archive-depth must be at least 1')
+            if args.verify:
+                if not os.path.isfile(args.verify):
+                    parser.error('baseline report not found: '+ args.verify)
+                try:
+                    _baseline.CheckBaseline(args.verify, self.hashTypes)
+                except (IOError, OSError, ValueError) as err:
+                    parser.error(str(err))
+                # the new report must not overwrite the baseline being read
+                if os.path.abspath(args.verify) == os.path.abspath(_report.ReportFileName(args.reportPath, args.report_format, args.shard)):
+                    parser.error('the baseline would be overwritten, move it out of the report path first')
+            if args.checkpoint or args.resume:
+                if args.report_format not in _report.RESUMABLE_FORMATS:
+                    parser.error('checkpoints need a '+ ' or '.join(_report.RESUMABLE_FORMATS) +' report')
+                if args.resume and (args.verify or args.piecewise):
+                    parser.error('--resume cannot be combined with --verify or --piecewise')
+                # a checkpoint taken part way through an archive's members
+                # could not say which of them were still to be reported
+                if args.archives:
+                    parser.error('checkpoints cannot be combined with --archives')
+                # a checkpoint is only valid for a scan with the same settings
+                settings = {'rootPath': os.path.abspath(args.rootPath), 'hashTypes': self.hashTypes,
+                            'reportFormat': args.report_format, 'rawTimes': args.raw_times,
+                            'filters': [args.include, args.exclude, args.include_regex, args.exclude_regex,
+                                        args.min_size, args.max_size, args.max_depth, args.one_file_system],
+                            'shard': list(args.shard) if args.shard else None,
+                            'segments': [args.segment_threshold, args.segment_size, args.segment_serial]
+                                        if args.segment_threshold is not None else None}
+                self.checkpoint = _report._Checkpoint(_report.CheckpointFileName(args.reportPath, args.shard),
+                                                      args.checkpoint or _report.DEFAULT_CHECKPOINT_SECONDS, settings)
+                if args.resume:
+                    try:
+                        self.checkpoint.load()
+                    except ValueError as err:
+                        parser.error(str(err))
+
+        if args.profile and args.reportPath is None:
+            parser.error('--profile needs -r/--reportPath, where the profile is written')
+        if args.segment_threshold is not None:
+            if args.segment_size < 1:
+                parser.error('--segment-size must be at least 1 byte')
+            # block digests of consecutive segments must join up
+            if args.piecewise and args.segment_size % args.block_size:
+                parser.error('--segment-size must be a multiple of --block-size')
+            # segment workers read outside the governor's accounting
+            if args.max_bytes_per_sec or args.max_iops or args.drop_cache:
+                parser.error('--segment-threshold cannot be combined with --max-bytes-per-sec, --max-iops or --drop-cache')
+            # a tree digest is not a digest a known set or a baseline holds,
+            # only the serial digest can be looked up or compared
+            if not args.segment_serial and (args.known_good or args.known_bad or args.verify):
+                parser.error('--segment-threshold needs --segment-serial when combined with --known-good, --known-bad or --verify')
+
+    def _setUpPipeline(self, parser):
+        # the filters, engine, cache and sidecars the selected mode uses,
+        # a setting that cannot be opened is still a command line error
+        args = self.args
+        # the walk filter is only handed to WalkFiles when a filter is set
+        self.walkFilter = None
+        self.shardPlan = None
+        if args.rootPath is not None and not (args.benchmark or args.import_known or args.verify_blocks
+                                              or args.merge_shards):
+            filterArgs = (args.include, args.exclude, args.include_regex, args.exclude_regex,
+                          args.min_size, args.max_size, args.newer_than, args.older_than,
+                          args.max_depth, args.one_file_system)
+            try:
+                walkFilter = _filters._WalkFilter(args.rootPath, *filterArgs)
+            except re.error as err:
+                parser.error('invalid regular expression: '+ str(err))
+            if args.plan_shards is not None or args.shard:
+                # the tree is planned as the filters leave it
+                if args.shard_plan and args.plan_shards is None:
+                    try:
+                        self.shardPlan = _shards._ShardPlan.load(args.shard_plan)
+                    except ValueError as err:
+                        parser.error(str(err))
+                    if self.shardPlan.shardCount != args.shard[1]:
+                        parser.error('the shard plan is for '+ str(self.shardPlan.shardCount) +' shards, not '+ str(args.shard[1]))
+                else:
+                    self.shardPlan = _shards.PlanShards(args.rootPath, args.plan_shards or args.shard[1],
+                                                        walkFilter if walkFilter.active() else None)
+                if args.shard:
+                    walkFilter = _filters._WalkFilter(args.rootPath, *filterArgs, shardPlan=self.shardPlan,
+                                                      shardIndex=args.shard[0])
+            if walkFilter.active():
+                self.walkFilter = walkFilter
+
+        # one hash engine, and so one read buffer, for the whole run
+        self.blockSize = args.block_size if args.piecewise else None
+        self.governor = None
+        if args.max_bytes_per_sec or args.max_iops or args.drop_cache or args.low_priority:
+            self.governor = _governor._ReadGovernor(args.max_bytes_per_sec, args.max_iops, args.drop_cache)
+        if args.low_priority and not args.benchmark:
+            # before any pool starts, so workers and threads inherit it
+            for message in _governor.LowerPriority():
+                report(message)
+        # files over --segment-threshold are split between a pool of processes
+        self.segmenter = None
+        if args.segment_threshold is not None and not args.benchmark:
+            self.segmenter = _segments._SegmentHasher(args.segment_threshold, args.segment_size,
+                                                      args.segment_workers, args.segment_serial)
+        self.hashEngine = _pfish._HashEngine(self.hashTypes, args.chunk_size, self.blockSize, self.governor, self.segmenter, args.mmap_threshold)
+
+        # the block sidecar is opened by walkPath() for piecewise scans
+        self.blockWriter = None
+
+        # the baseline verifier is opened by walkPath() for --verify scans
+        self.verifier = None
+
+        # known sets are mapped, not loaded, so even NSRL sized sets open at once
+        self.knownFilter = None
+        if (args.known_good or args.known_bad) and not (args.benchmark or args.import_known):
+            try:
+                self.knownFilter = _knownFiles._KnownFilter(args.known_good, args.known_bad, self.hashTypes)
+            except (IOError, OSError, ValueError) as err:
+                parser.error(str(err))
+
+        # archives are opened by whichever process or thread hashes them
+        self.archiveScanner = None
+        # archive members hashed and members that could not be
+        self.memberCounts = [0, 0]
+        if args.archives:
+            self.archiveScanner = _archives._ArchiveScanner(args.archive_depth, args.archive_max_size)
+
+        # files over the --trace-slow-files threshold are reported as they are written
+        self.slowFiles = None
+        if args.trace_slow_files is not None:
+            self.slowFiles = _profile._SlowFileTracer(args.trace_slow_files,
+                                                      lambda message: report(message, logging.WARNING))
+
+        # hardlinked files are hashed once per inode
+        self.linkTracker = _pfish._LinkTracker()
+
+        # the hash cache is only opened for incremental scans
+        self.hashCache = None
+        if args.incremental and not args.benchmark:
+            cacheFile = args.cache_file or args.reportPath + _hashCache.CACHE_FILE_NAME
+            self.hashCache = _hashCache._HashCache(cacheFile, args.verify_cache)
+
+        # the report sidecars and statistics are opened by walkPath()
+        self.segmentWriter = None
+        self.scanStats = None
+
+    def run(self):
+        # runs the mode the command line selected, under the profiler
+        # with --profile, and returns the number of files processed
+        args = self.args
+        report = self.report
+        profiler = None
+        if args.profile:
+            profiler = _profile._Profiler(_report.SidecarFileName(args.reportPath, '', args.shard), args.profile_top)
+            profiler.start()
+        if args.find_duplicates:
+            filesProcessed = self.findDuplicates()
+        elif args.import_known:
+            filesProcessed = self.importKnownSet()
+        elif args.verify_blocks:
+            filesProcessed = self.verifyBlockFile()
+        elif args.plan_shards is not None:
+            filesProcessed = self.planShardScan()
+        elif args.merge_shards:
+            filesProcessed = self.mergeShards()
+        else:
+            filesProcessed = self.walkPath()
+        if profiler is not None:
+            statsFile, summaryFile = profiler.stop()
+            report('Profile:'+ statsFile +' Summary:'+ summaryFile)
+            for line in profiler.hotFunctions():
+                report('Hot: '+ line, SUMMARY)
+        return filesProcessed
+
+    def walkPath(self):
+        # Traverses the directory structure starting at the rootPath
+        # and hashes each file found into the report. With --workers or
+        # --threads the files are hashed on a pool of processes or
+        # threads and the results are written back here in walk order.
+        # Returns the number of files hashed
+        args = self.args
+        report = self.report
+        processCount = 0
+        errorCount = 0
+        if self.checkpoint is not None and not self.checkpoint.resumed:
+            # a fresh scan must never be resumed from an older scan's checkpoint
+            self.checkpoint.remove()
+        csvOut = _report._ReportWriter(_report.ReportFileName(args.reportPath, args.report_format, args.shard), self.hashTypes, args.report_format, args.raw_times, self.checkpoint)
+        if self.blockSize:
+            self.blockWriter = _pieceHash._BlockWriter(_report.SidecarFileName(args.reportPath, _pieceHash.BLOCK_SUFFIX, args.shard), self.blockSize, self.hashTypes[0])
+            report('Piecewise Block Size:'+ str(self.blockSize))
+        if args.verify:
+            self.verifier = _baseline._BaselineVerifier(args.verify, _report.SidecarFileName(args.reportPath, _baseline.VERIFY_SUFFIX, args.shard),
+                                                        self.hashTypes, self.walkFilter.inShard if args.shard else None)
+            report('Baseline:'+ args.verify +(' (merge join)' if self.verifier.sorted else ' (path index)'))
+        if self.segmenter is not None:
+            self.segmentWriter = _segments._SegmentWriter(_report.SidecarFileName(args.reportPath, _segments.SEGMENT_SUFFIX, args.shard), self.hashTypes, args.segment_serial, self.checkpoint.lastPath if self.checkpoint is not None and self.checkpoint.resumed else None)
+            report('Segment Threshold:'+ str(self.segmenter.threshold) +' Segment Size:'+ str(self.segmenter.segmentSize) +' Segment Workers:'+ str(self.segmenter.workers))
+        # Create a loop that processes all the files starting
+        # at the rootPath, all sub-directories will also be processed
+        report('Root Path:'+ args.rootPath)
+        resumeAfter = None
+        if self.checkpoint is not None and self.checkpoint.resumed:
+            resumeAfter = self.checkpoint.lastPath
+            report('Resuming After:'+ resumeAfter +' ('+ str(self.checkpoint.rows) +' files already reported)')
+        self.scanStats = _stats._ScanStats()
+        fileList = _pfish.WalkFiles(args.rootPath, resumeAfter, self.walkFilter, self.scanStats.phases)
+        fileList = self.scanStats.timedWalk(fileList)
+        if not args.verbose and sys.stderr.isatty():
+            # a live progress line in place of the per file messages, sized
+            # from a count made alongside the scan when asked for, else from
+            # the shard plan, less what a resumed scan had already reported
+            if args.estimate:
+                self.scanStats.progress = _stats._Progress(self.scanStats, estimate=_stats._TreeEstimate(args.rootPath, copy.copy(self.walkFilter), resumeAfter))
+            elif self.shardPlan is not None and not (resumeAfter is not None and self.checkpoint.files is None):
+                shardTotals = (self.shardPlan.plan['files'][args.shard[0]], self.shardPlan.plan['bytes'][args.shard[0]])
+                doneBefore = (self.checkpoint.files, self.checkpoint.bytes) if resumeAfter is not None else (0, 0)
+                self.scanStats.progress = _stats._Progress(self.scanStats, shardTotals, doneBefore=doneBefore)
+            else:
+                self.scanStats.progress = _stats._Progress(self.scanStats)
+        scheduler = None
+        if args.physical_order:
+            report('Physical Read Order:'+ args.physical_order)
+            scheduler = _schedule._PhysicalScheduler(fileList, args.physical_order)
+            fileList = scheduler.entries()
+        shareStats = None
+        if args.workers > 1:
+            report('Hashing Workers:'+ str(args.workers))
+            results = _pfish.ParallelScan(fileList, args.workers, self.hashTypes, args.chunk_size, self.hashCache, self.linkTracker, self.blockSize, self.governor, self.archiveScanner, self.segmenter, args.mmap_threshold)
+        elif args.threads > 1:
+            report('Hashing Threads:'+ str(args.threads))
+            shareStats = _pfish._ShareStats()
+            results = _pfish.ThreadedScan(fileList, args.threads, self.hashTypes, args.chunk_size, shareStats, self.hashCache, self.linkTracker, self.blockSize, self.governor, self.archiveScanner, self.segmenter, args.mmap_threshold)
+        elif scheduler is not None:
+            results = _pfish.SequentialScan(fileList, self.hashEngine, self.hashCache, self.linkTracker, self.archiveScanner)
+        else:
+            results = None
+        if scheduler is not None:
+            # report in walk order whatever order the files were read in
+            results = scheduler.restore(results)
+        if results is not None:
+            for fname, record, message in results:
+                result = self.reportFile(fname, record, message, csvOut)
+                if result is True:
+                    processCount += 1
+                else:
+                    errorCount += 1
+        else:
+            for fname, file, st in fileList:
+                result = self.hashFile(fname, file, csvOut, st)
+                # if hashing was successful then increment the ProcessCount
+                if result is True:
+                    processCount += 1
+                # if not successful, the increment the ErrorCount
+                else:
+                    errorCount += 1
+        csvOut.writerClose()
+        self.scanStats.phases['write'] = csvOut.writeSeconds
+        if self.scanStats.progress is not None:
+            self.scanStats.progress.finish()
+        statsFile = _report.SidecarFileName(args.reportPath, _stats.STATS_SUFFIX, args.shard)
+        self.scanStats.write(statsFile, {'rootPath': args.rootPath, 'hashTypes': self.hashTypes, 'workers': args.workers,
+                                         'threads': args.threads, 'chunkSize': args.chunk_size,
+                                         'mmapThreshold': args.mmap_threshold, 'reportFormat': args.report_format})
+        for line in self.scanStats.summary():
+            report(line, SUMMARY)
+        report('Statistics:'+ statsFile)
+        if self.slowFiles is not None:
+            report(self.slowFiles.summary(), SUMMARY)
+        if self.checkpoint is not None:
+            # the scan completed, there is nothing left to resume
+            self.checkpoint.remove()
+        if self.blockWriter is not None:
+            self.blockWriter.writerClose()
+        if self.segmenter is not None:
+            self.segmenter.close()
+            self.segmentWriter.writerClose()
+            report('Segmented Files:'+ str(self.segmenter.files) +' Bytes:'+ str(self.segmenter.bytesHashed))
+        if self.hashCache is not None:
+            self.hashCache.close()
+            report('Cache Hits:'+ str(self.hashCache.hits) +' Verified:'+ str(self.hashCache.verified) +' Mismatches:'+ str(self.hashCache.mismatches) +' Changed While Read:'+ str(self.hashCache.changed))
+        if self.linkTracker.reused:
+            report('Hardlinks Reused:'+ str(self.linkTracker.reused) +' Bytes Not Read:'+ str(self.linkTracker.bytesSaved))
+        if shareStats is not None:
+            for line in shareStats.summary():
+                report('Share '+ line, SUMMARY)
+        if self.archiveScanner is not None:
+            report('Archive Members:'+ str(self.memberCounts[0]) +' Not Hashed:'+ str(self.memberCounts[1]))
+        if self.walkFilter is not None:
+            report('Directories Pruned:'+ str(self.walkFilter.directoriesPruned) +' Files Filtered:'+ str(self.walkFilter.filesSkipped))
+            if self.shardPlan is not None:
+                report('Shard '+ str(args.shard[0] + 1) +'/'+ str(args.shard[1]) +' Files Left To Other Shards:'+ str(self.walkFilter.otherShardFiles))
+        if self.knownFilter is not None:
+            self.knownFilter.close()
+            report('Known Good:'+ str(self.knownFilter.counts[_knownFiles.KNOWN_GOOD]) +' Known Bad:'+ str(self.knownFilter.counts[_knownFiles.KNOWN_BAD]), SUMMARY)
+        if self.verifier is not None:
+            self.verifier.close()
+            report('Baseline '+ ' '.join(status +':'+ str(count) for status, count in self.verifier.counts.items()) +' Unchanged:'+ str(self.verifier.unchanged), SUMMARY)
+        return(processCount)
+
+    def hashFile(self, theFile, simpleName, o_result, st=None):
+        # Hashes a single file and extracts its metadata, then hands
+        # the result to reportFile()
+        # theFile = the full path of the file
+        # simpleName = just the filename itself
+        # o_result = _report._ReportWriter for the result
+        # st = lstat result already fetched by the walk, if any
+        record, message = _pfish.ScanFile(theFile, simpleName, self.hashEngine, self.hashCache, st, self.linkTracker, self.archiveScanner)
+        return self.reportFile(theFile, record, message, o_result)
+
+    def reportFile(self, theFile, record, message, o_result):
+        # Writes the result of hashing one file, or reports why it was
+        # skipped. record, message are the result of _pfish.ScanFile().
+        # Returns True when a record was written
+        report = self.report
+        if record is None:
+            self.scanStats.fileFailed()
+            report(message, logging.WARNING)
+            if self.verifier is not None:
+                self.verifier.skipFile(theFile)
+            return False
+        self.scanStats.fileDone(record)
+        if self.slowFiles is not None and record.timings is not None:
+            self.slowFiles.check(theFile, record.timings[3], _profile.TimingDetail(record.timings, record.stat.st_size))
+        report("Processing File: " + theFile, DETAIL)
+        if record.cacheStatus == _hashCache.CACHE_MISMATCH:
+            report('Cache Mismatch, contents changed but metadata did not:'+ theFile, logging.WARNING)
+        if record.cacheStatus == _hashCache.CACHE_CHANGED:
+            report('File changed while being hashed:'+ theFile, logging.WARNING)
+        # a tree digest is not cached, a later scan without the same
+        # segment settings would report it as a conventional digest
+        if self.hashCache is not None and record.linkOf is None and (record.segments is None or record.segments.serial is not None):
+            self.hashCache.update(record.stat, self.hashTypes, record.hashValues, record.cacheStatus)
+        if self.verifier is not None:
+            self.verifier.checkFile(record)
+        known = ''
+        if self.knownFilter is not None:
+            known = self.knownFilter.classify(record.hashValues)
+            if known == _knownFiles.KNOWN_BAD:
+                report('Known Bad File:'+ theFile, logging.WARNING)
+        report("============================", DETAIL)
+        # write one row to the output file
+        if self.blockWriter is not None and record.blocks is not None:
+            self.blockWriter.writeEntry(record.path, record.stat.st_size, record.blocks, record.merkleRoot)
+        if self.segmentWriter is not None and record.segments is not None:
+            self.segmentWriter.writeEntry(record)
+        if not (known == _knownFiles.KNOWN_GOOD and self.args.suppress_known):
+            o_result.writeRecord(record, known)
+        if record.members:
+            self.reportMembers(record.members, o_result)
+        return True
+
+    def reportMembers(self, members, o_result):
+        # Writes the members hashed from inside an archive, right after
+        # the archive's own row, or reports why a member was not hashed.
+        # members = (member path, record, message) tuples from the archive scan
+        report = self.report
+        for memberPath, record, message in members:
+            if record is None:
+                report(message, logging.WARNING)
+                self.memberCounts[1] += 1
+                if self.verifier is not None and memberPath is not None:
+                    self.verifier.skipFile(memberPath)
+                continue
+            self.memberCounts[0] += 1
+            report("Processing Member: " + memberPath, DETAIL)
+            if self.verifier is not None:
+                self.verifier.checkFile(record)
+            known = ''
+            if self.knownFilter is not None:
+                known = self.knownFilter.classify(record.hashValues)
+                if known == _knownFiles.KNOWN_BAD:
+                    report('Known Bad File:'+ memberPath, logging.WARNING)
+            if known == _knownFiles.KNOWN_GOOD and self.args.suppress_known:
+                continue
+            o_result.writeRecord(record, known)
+
+    def findDuplicates(self):
+        # Walks the rootPath like walkPath() but only looks for identical
+        # files. Sizes are compared first, then a hash of the head and
+        # tail of each file, and only files that still match are hashed
+        # in full. The groups found are written to duplicateReport.csv
+        args = self.args
+        report = self.report
+        report('Root Path:'+ args.rootPath)
+        report('Finding Duplicates')
+        fileList = _pfish.WalkFiles(args.rootPath, walkFilter=self.walkFilter)
+        groups, stats = _duplicates.FindDuplicates(fileList, self.hashEngine, lambda message: report(message, logging.WARNING))
+        wasted = _duplicates.WriteDuplicateReport(args.reportPath + _duplicates.DUPLICATE_REPORT_NAME, groups, self.hashTypes)
+        report('Duplicate Groups:'+ str(len(groups)) +' Wasted Bytes:'+ str(wasted), SUMMARY)
+        report('Bytes Read:'+ str(stats['bytesRead']) +' of '+ str(stats['bytesScanned']))
+        return(stats['filesScanned'])
+
+    def verifyBlockFile(self):
+        # Re-hashes the selected ranges of one file and compares them
+        # with the block digests recorded by an earlier --piecewise scan.
+        # A sidecar entry that does not match its Merkle root, or the root
+        # in the report, is refused before any block is read. With
+        # --workers the blocks are checked in parallel
+        args = self.args
+        report = self.report
+        theFile = args.verify_blocks
+        try:
+            entry = _pieceHash.ReadBlockEntry(_report.SidecarFileName(args.reportPath, _pieceHash.BLOCK_SUFFIX, args.shard), theFile)
+        except (IOError, OSError, ValueError) as err:
+            report(str(err), logging.ERROR)
+            return(0)
+        if entry is None:
+            report('No Block Digests Recorded For:'+ theFile, logging.ERROR)
+            return(0)
+        hashType, blockSize, size, digests, root = entry
+        try:
+            currentSize = os.path.getsize(theFile)
+            ranges = _pieceHash.ParseRanges(args.block_ranges, size)
+            reportedRoot = _report.ReportedValue(args.reportPath, theFile, 'Merkle Root', args.shard)
+            checked, bad = _pieceHash.VerifyBlocks(theFile, entry, ranges, args.workers, reportedRoot)
+        except ValueError as err:
+            report(str(err), logging.ERROR)
+            return(0)
+        except (IOError, OSError, sqlite3.Error) as err:
+            report('Verify Failed:'+ theFile +' '+ str(err), logging.ERROR)
+            return(0)
+        if currentSize != size:
+            report('Size Changed:'+ theFile +' was '+ str(size) +' now '+ str(currentSize), logging.WARNING)
+        report('Blocks Checked:'+ str(checked) +' ('+ hashType +', '+ str(blockSize) +' byte blocks)')
+        for block in bad:
+            report('Block Mismatch:'+ str(block) +' bytes '+ str(block * blockSize) +'-'+ str(min(size, (block + 1) * blockSize)), logging.WARNING)
+        if bad:
+            report('Blocks Mismatched:'+ str(len(bad)) +' of '+ str(checked), SUMMARY)
+        else:
+            report('Blocks Verified: no changes found', SUMMARY)
+        return(1)
+
+    def importKnownSet(self):
+        # Builds a known set from the --hash-list files for later use
+        # with --known-good or --known-bad
+        setFile = self.args.import_known
+        self.report('Importing Known Set:'+ setFile +' ('+ self.hashTypes[0] +')')
+        lineCount, digestCount = _knownFiles.ImportHashLists(self.args.hash_list, setFile, self.hashTypes[0])
+        self.report('Known Set:'+ setFile +' Lines Read:'+ str(lineCount) +' Digests Stored:'+ str(digestCount), SUMMARY)
+        return(digestCount)
+
+    def planShardScan(self):
+        # Saves the shard plan made from the command line to
+        # --shard-plan, for every machine of a sharded scan to use
+        self.shardPlan.save(self.args.shard_plan)
+        self.report('Shard Plan:'+ self.args.shard_plan)
+        for line in self.shardPlan.summary():
+            self.report(line, SUMMARY)
+        return(sum(self.shardPlan.plan['files']))
+
+    def mergeShards(self):
+        # Merges the partial reports of a sharded scan into one report
+        # in the report path, with a manifest of the partials
+        args = self.args
+        report = self.report
+        mergedFile = _report.ReportFileName(args.reportPath, args.report_format)
+        for partialFile in args.merge_shards:
+            report('Partial Report:'+ partialFile)
+        try:
+            rows, duplicates, conflicts, manifestDigest = _shards.MergeShardReports(args.merge_shards, mergedFile, args.report_format)
+        except ValueError as err:
+            report('Merge Failed: '+ str(err), logging.ERROR)
+            return(0)
+        report('Merged Report:'+ mergedFile +' Rows:'+ str(rows) +' Duplicates Dropped:'+ str(duplicates), SUMMARY)
+        if conflicts:
+            report('Duplicate Paths With Different Rows:'+ str(conflicts) +', the first partial given was kept', logging.WARNING)
+        report('Manifest:'+ os.path.join(args.reportPath, _shards.MERGE_MANIFEST_NAME) +' Digest:'+ manifestDigest)
+        # the block digests and verification reports of the shards, if any
+        try:
+            for sidecar in _shards.MergeShardSidecars(args.merge_shards, args.reportPath):
+                report('Merged Sidecar:'+ sidecar)
+        except (IOError, OSError, ValueError) as err:
+            report('Sidecar Merge Failed: '+ str(err), logging.ERROR)
+        return(rows)
+
+#End _ScanSession =======================================
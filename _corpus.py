@@ -0,0 +1,330 @@
+
+# _corpus.py
+# Python One Way File System Hashing - synthetic evidence trees
+# Author: L. Konate
+
+#################################################################
+# Builds the deterministic test corpus used by pfish_benchmark.py:
+# tiny files, huge files, sparse files, hardlinks, a deep tree and
+# JPEGs with and without GPS EXIF data
+#
+# CorpusSpec() CorpusPath() ExifSegment() JpegBytes() BuildCorpus()
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import json #Python Standard Library - JSON encoder and decoder
+import shutil #Python Standard Library - High-level file operations
+import random #Python Standard Library - Generate pseudo-random numbers
+import struct #Python Standard Library - Interpret bytes as packed binary data
+import hashlib #Python Standard Library - Secure hashes and message digests
+
+# Bumped whenever the layout or the contents generated change, so a
+# corpus built by an older generator is never reused for comparison
+CORPUS_VERSION = 1
+
+# Describes a finished corpus and sits next to it, outside the tree
+# being scanned. It is written last so a corpus whose build was
+# interrupted is never taken for a complete one
+CORPUS_MANIFEST_SUFFIX = '.json'
+
+DEFAULT_SEED = 2019
+
+# File times are spread over one year from this date (2019-01-01 UTC)
+# so reports of the same corpus are identical on every host
+BASE_MTIME = 1546300800
+
+# Counts and sizes at scale 1.0, about 300 MB on disk
+TINY_FILES = 5000
+TINY_DIRS = 50
+TINY_MAX_BYTES = 4096
+HUGE_FILES = 3
+HUGE_BYTES = 64 * 1024 ** 2
+SPARSE_FILES = 4
+SPARSE_BYTES = 256 * 1024 ** 2
+SPARSE_EXTENTS = 8
+SPARSE_EXTENT_BYTES = 64 * 1024
+LINK_FILES = 500
+DEEP_LEVELS = 100
+DEEP_FILE_BYTES = 1024
+GPS_JPEGS = 300
+EXIF_JPEGS = 200
+PLAIN_JPEGS = 200
+JPEG_PAD_BYTES = 128 * 1024
+
+# Bytes written to a large file at once
+WRITE_CHUNK_BYTES = 1024 * 1024
+
+# TIFF field types used in the EXIF block
+TIFF_BYTE = 1
+TIFF_ASCII = 2
+TIFF_LONG = 4
+TIFF_RATIONAL = 5
+
+# An 8x8 mid grey baseline JPEG: quantization table of ones, one
+# component, Huffman tables holding the single code 0 for a DC
+# difference of 0 and for end of block, and a scan of those two codes
+JPEG_SOI = b'\xff\xd8'
+JPEG_BODY = (b'\xff\xdb\x00\x43\x00' + b'\x01' * 64
+             + b'\xff\xc0\x00\x0b\x08\x00\x08\x00\x08\x01\x01\x11\x00'
+             + b'\xff\xc4\x00\x26'
+             + b'\x00' + b'\x01' + b'\x00' * 15 + b'\x00'
+             + b'\x10' + b'\x01' + b'\x00' * 15 + b'\x00'
+             + b'\xff\xda\x00\x08\x01\x01\x00\x00\x3f\x00'
+             + b'\x3f'
+             + b'\xff\xd9')
+
+CAMERAS = [(b'Canon', b'Canon EOS 5D Mark IV'), (b'NIKON CORPORATION', b'NIKON D750'),
+           (b'Apple', b'iPhone 8'), (b'samsung', b'SM-G960F'), (b'SONY', b'ILCE-7M3')]
+
+
+def CorpusSpec(scale=1.0):
+    #
+    # Name: CorpusSpec() Function
+    #
+    # Desc: The counts and sizes of every section of the corpus at a
+    # scale, each at least 1
+    #
+    # Input: scale = multiplier of the scale 1.0 counts and sizes
+    #
+    # Actions:
+    # returns a dictionary of section settings
+    #
+    def Scaled(value):
+        return max(1, int(round(value * scale)))
+
+    return {'tinyFiles': Scaled(TINY_FILES), 'tinyDirs': Scaled(TINY_DIRS), 'tinyMaxBytes': TINY_MAX_BYTES,
+            'hugeFiles': HUGE_FILES, 'hugeBytes': Scaled(HUGE_BYTES),
+            'sparseFiles': SPARSE_FILES, 'sparseBytes': Scaled(SPARSE_BYTES),
+            'sparseExtents': SPARSE_EXTENTS, 'sparseExtentBytes': SPARSE_EXTENT_BYTES,
+            'linkFiles': Scaled(LINK_FILES), 'deepLevels': DEEP_LEVELS, 'deepFileBytes': DEEP_FILE_BYTES,
+            'gpsJpegs': Scaled(GPS_JPEGS), 'exifJpegs': Scaled(EXIF_JPEGS), 'plainJpegs': Scaled(PLAIN_JPEGS),
+            'jpegPadBytes': JPEG_PAD_BYTES}
+#End CorpusSpec =========================================
+
+
+def CorpusPath(basePath, seed=DEFAULT_SEED, scale=1.0):
+    # each seed and scale gets its own directory below basePath
+    return os.path.join(basePath, 'corpus-v%d-seed%d-scale%g' % (CORPUS_VERSION, seed, scale))
+
+
+def _IfdBytes(entries, offset):
+    # one little endian IFD at offset, entries are (tag, type, count,
+    # value bytes) in tag order, values over 4 bytes follow the IFD
+    dataOffset = offset + 2 + 12 * len(entries) + 4
+    table = [struct.pack('<H', len(entries))]
+    data = []
+    for tag, fieldType, count, value in entries:
+        if len(value) <= 4:
+            table.append(struct.pack('<HHI', tag, fieldType, count) + value.ljust(4, b'\x00'))
+        else:
+            table.append(struct.pack('<HHII', tag, fieldType, count, dataOffset))
+            value = value + b'\x00' * (len(value) % 2)
+            data.append(value)
+            dataOffset += len(value)
+    table.append(struct.pack('<I', 0))
+    return b''.join(table + data)
+
+
+def _Ascii(text):
+    return (TIFF_ASCII, len(text) + 1, text + b'\x00')
+
+
+def _Rationals(*pairs):
+    return (TIFF_RATIONAL, len(pairs), b''.join(struct.pack('<II', numerator, denominator)
+                                                for numerator, denominator in pairs))
+
+
+def ExifSegment(make, model, taken, gps=None):
+    #
+    # Name: ExifSegment() Function
+    #
+    # Desc: Builds a JPEG APP1 EXIF segment holding the camera make and
+    # model, an Exif IFD with DateTimeOriginal and, when gps is given,
+    # a GPS IFD, which is what ExtractGPSDictionary() reads
+    #
+    # Input: make, model = camera name bytes
+    #        taken = DateTimeOriginal bytes, 'YYYY:MM:DD HH:MM:SS'
+    #        gps = optional (latitude, longitude, altitude) in degrees
+    #              and metres, negative for south and west
+    #
+    # Actions:
+    # returns the segment bytes, marker included
+    #
+    ifd0 = [(0x010f,) + _Ascii(make), (0x0110,) + _Ascii(model),
+            (0x8769, TIFF_LONG, 1, b'\x00' * 4)]
+    if gps is not None:
+        ifd0.append((0x8825, TIFF_LONG, 1, b'\x00' * 4))
+    exifIfd = [(0x9003,) + _Ascii(taken)]
+    exifOffset = 8 + len(_IfdBytes(ifd0, 8))
+    ifd0[2] = (0x8769, TIFF_LONG, 1, struct.pack('<I', exifOffset))
+    gpsBlock = b''
+    if gps is not None:
+        latitude, longitude, altitude = gps
+
+        def Dms(degrees):
+            degrees = abs(degrees)
+            whole = int(degrees)
+            minutes = int((degrees - whole) * 60)
+            seconds = int(round(((degrees - whole) * 60 - minutes) * 60 * 100))
+            return _Rationals((whole, 1), (minutes, 1), (seconds, 100))
+
+        gpsIfd = [(0x0000, TIFF_BYTE, 4, b'\x02\x02\x00\x00'),
+                  (0x0001,) + _Ascii(b'N' if latitude >= 0 else b'S'),
+                  (0x0002,) + Dms(latitude),
+                  (0x0003,) + _Ascii(b'E' if longitude >= 0 else b'W'),
+                  (0x0004,) + Dms(longitude),
+                  (0x0005, TIFF_BYTE, 1, b'\x00'),
+                  (0x0006,) + _Rationals((int(round(altitude * 10)), 10))]
+        gpsOffset = exifOffset + len(_IfdBytes(exifIfd, exifOffset))
+        ifd0[3] = (0x8825, TIFF_LONG, 1, struct.pack('<I', gpsOffset))
+        gpsBlock = _IfdBytes(gpsIfd, gpsOffset)
+    tiff = b'II' + struct.pack('<HI', 42, 8) + _IfdBytes(ifd0, 8) + _IfdBytes(exifIfd, exifOffset) + gpsBlock
+    payload = b'Exif\x00\x00' + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+#End ExifSegment ========================================
+
+
+def JpegBytes(rng, kind, padBytes):
+    #
+    # Name: JpegBytes() Function
+    #
+    # Desc: Builds one JPEG of a kind: 'gps' has EXIF with a GPS fix,
+    # 'exif' has EXIF without GPS and 'plain' has no EXIF at all. The
+    # image is followed by padBytes of random data, as the bulk of a
+    # real photograph would be, so hashing a JPEG costs about as much
+    #
+    # Input: rng = random.Random supplying every value
+    #        kind = 'gps', 'exif' or 'plain'
+    #        padBytes = bytes of data after the end of the image
+    #
+    segment = b''
+    if kind != 'plain':
+        make, model = CAMERAS[rng.randrange(len(CAMERAS))]
+        taken = ('%04d:%02d:%02d %02d:%02d:%02d' % (rng.randint(2010, 2019), rng.randint(1, 12), rng.randint(1, 28),
+                                                   rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))).encode()
+        gps = None
+        if kind == 'gps':
+            gps = (rng.uniform(-80.0, 80.0), rng.uniform(-179.0, 179.0), rng.uniform(0.0, 3000.0))
+        segment = ExifSegment(make, model, taken, gps)
+    return JPEG_SOI + segment + JPEG_BODY + rng.randbytes(padBytes)
+#End JpegBytes ==========================================
+
+
+def BuildCorpus(basePath, seed=DEFAULT_SEED, scale=1.0):
+    #
+    # Name: BuildCorpus() Function
+    #
+    # Desc: Builds the corpus for a seed and scale below basePath, or
+    # reuses the one already there. Every name, size, content byte and
+    # file time comes from one random.Random(seed), so the same seed and
+    # scale give the same tree, byte for byte, on every host. The tree
+    # is built under a temporary name and renamed once complete, and
+    # its manifest is written next to it
+    #
+    #   tiny/dNNN/     many files of 0 to 4K
+    #   huge/          a few large files
+    #   sparse/        large files that are mostly holes
+    #   links/         hardlinks to tiny files
+    #   deep/d000/...  one small file on each level of a deep chain
+    #   jpeg/          JPEGs with GPS EXIF, with EXIF only, and plain
+    #
+    # Input: basePath = directory holding the corpora
+    #        seed = random seed
+    #        scale = multiplier of the file counts and sizes
+    #
+    # Actions:
+    # returns (corpus path, manifest dictionary)
+    #
+    corpusPath = CorpusPath(basePath, seed, scale)
+    manifestFile = corpusPath + CORPUS_MANIFEST_SUFFIX
+    if os.path.exists(manifestFile) and os.path.isdir(corpusPath):
+        with open(manifestFile) as f:
+            return corpusPath, json.load(f)
+    spec = CorpusSpec(scale)
+    buildPath = corpusPath + '.partial'
+    for leftOver in (buildPath, corpusPath):
+        # left by an interrupted build
+        if os.path.isdir(leftOver):
+            shutil.rmtree(leftOver)
+    rng = random.Random(seed)
+    sections = {}
+    layout = []
+
+    def Stamp(path):
+        mtime = (BASE_MTIME + rng.randrange(365 * 86400)) * 1000000000
+        os.utime(path, ns=(mtime, mtime))
+
+    def Written(section, path, size):
+        entry = sections.setdefault(section, {'files': 0, 'bytes': 0})
+        entry['files'] += 1
+        entry['bytes'] += size
+        layout.append('%s %d\n' % (os.path.relpath(path, buildPath).replace(os.sep, '/'), size))
+
+    def WriteFile(section, path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+        Stamp(path)
+        Written(section, path, len(data))
+
+    tinyFiles = []
+    for directory in range(spec['tinyDirs']):
+        os.makedirs(os.path.join(buildPath, 'tiny', 'd%03d' % directory))
+    for index in range(spec['tinyFiles']):
+        path = os.path.join(buildPath, 'tiny', 'd%03d' % (index % spec['tinyDirs']), 'f%05d.bin' % index)
+        WriteFile('tiny', path, rng.randbytes(rng.randint(0, spec['tinyMaxBytes'])))
+        tinyFiles.append(path)
+
+    os.makedirs(os.path.join(buildPath, 'huge'))
+    for index in range(spec['hugeFiles']):
+        path = os.path.join(buildPath, 'huge', 'huge%02d.bin' % index)
+        with open(path, 'wb') as f:
+            remaining = spec['hugeBytes']
+            while remaining > 0:
+                chunk = min(remaining, WRITE_CHUNK_BYTES)
+                f.write(rng.randbytes(chunk))
+                remaining -= chunk
+        Stamp(path)
+        Written('huge', path, spec['hugeBytes'])
+
+    os.makedirs(os.path.join(buildPath, 'sparse'))
+    for index in range(spec['sparseFiles']):
+        path = os.path.join(buildPath, 'sparse', 'sparse%02d.img' % index)
+        extentBytes = min(spec['sparseExtentBytes'], spec['sparseBytes'])
+        slots = max(1, spec['sparseBytes'] // extentBytes)
+        with open(path, 'wb') as f:
+            for slot in sorted(rng.sample(range(slots), min(spec['sparseExtents'], slots))):
+                f.seek(slot * extentBytes)
+                f.write(rng.randbytes(extentBytes))
+            f.truncate(spec['sparseBytes'])
+        Stamp(path)
+        Written('sparse', path, spec['sparseBytes'])
+
+    os.makedirs(os.path.join(buildPath, 'links'))
+    for index, target in enumerate(rng.sample(tinyFiles, min(spec['linkFiles'], len(tinyFiles)))):
+        path = os.path.join(buildPath, 'links', 'link%05d.bin' % index)
+        os.link(target, path)
+        Written('links', path, os.path.getsize(path))
+
+    directory = os.path.join(buildPath, 'deep')
+    for level in range(spec['deepLevels']):
+        directory = os.path.join(directory, 'd%03d' % level)
+        os.makedirs(directory)
+        WriteFile('deep', os.path.join(directory, 'level%03d.txt' % level), rng.randbytes(spec['deepFileBytes']))
+
+    os.makedirs(os.path.join(buildPath, 'jpeg'))
+    kinds = ['gps'] * spec['gpsJpegs'] + ['exif'] * spec['exifJpegs'] + ['plain'] * spec['plainJpegs']
+    rng.shuffle(kinds)
+    for index, kind in enumerate(kinds):
+        path = os.path.join(buildPath, 'jpeg', 'IMG_%05d.jpg' % index)
+        WriteFile('jpeg', path, JpegBytes(rng, kind, spec['jpegPadBytes']))
+        sections['jpeg'][kind] = sections['jpeg'].get(kind, 0) + 1
+
+    manifest = {'version': CORPUS_VERSION, 'seed': seed, 'scale': scale, 'spec': spec, 'sections': sections,
+                'files': sum(entry['files'] for entry in sections.values()),
+                'bytes': sum(entry['bytes'] for entry in sections.values()),
+                'layoutDigest': hashlib.sha256(''.join(layout).encode('utf-8')).hexdigest()}
+    os.rename(buildPath, corpusPath)
+    with open(manifestFile, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return corpusPath, manifest
+#End BuildCorpus ========================================
@@ -0,0 +1,169 @@
+
+# _duplicates.py
+# Python One Way File System Hashing - duplicate file finder
+# Author: L. Konate
+
+#################################################################
+# Duplicate detection for hash.py and sys_file_hashing.py
+#
+# FindDuplicates() PartialHash() WriteDuplicateReport()
+#################################################################
+
+import stat #Python Standard Library - functions for interpreting os results
+import csv #Python Standard Library - reader and writer for csv files
+import hashlib #Python Standard Library - Secure hashes and message digests
+import collections #Python Standard Library - Container datatypes
+
+# Bytes read from the head and from the tail of each candidate
+# for the partial hash prefilter
+PARTIAL_BYTES = 4096
+
+# Default duplicate report name, written next to fileSystemReport.csv
+DUPLICATE_REPORT_NAME = 'duplicateReport.csv'
+
+
+def PartialHash(theFile, size, buffer):
+    #
+    # Name: PartialHash() Function
+    #
+    # Desc: Hashes the first and last PARTIAL_BYTES of a file. Files that
+    # differ almost always differ there, so only candidates whose partial
+    # hashes collide need to be read in full
+    #
+    # Inputs:
+    # theFile = the full path of the file
+    # size = the file size from the walk
+    # buffer = reusable bytearray of PARTIAL_BYTES
+    #
+    # Actions:
+    # returns (digest, bytes read), raises OSError if the file can't be read
+    #
+    hash = hashlib.blake2b(digest_size=16)
+    view = memoryview(buffer)
+    bytesRead = 0
+    offsets = [0]
+    if size > PARTIAL_BYTES:
+        offsets.append(max(PARTIAL_BYTES, size - PARTIAL_BYTES))
+    with open(theFile, 'rb', buffering=0) as f:
+        for offset in offsets:
+            f.seek(offset)
+            count = f.readinto(view) or 0
+            hash.update(view[:count])
+            bytesRead += count
+    return hash.digest(), bytesRead
+#End PartialHash ========================================
+
+
+def FindDuplicates(fileList, hashEngine, report=print):
+    #
+    # Name: FindDuplicates() Function
+    #
+    # Desc: Finds identical files in three narrowing passes
+    # 1. files are bucketed by size and unique sizes are dropped
+    # 2. remaining candidates get a head and tail partial hash and
+    #    unique partial hashes are dropped
+    # 3. files whose partial hashes collide are hashed in full with
+    #    the selected algorithms and grouped on the full digests
+    # Extra hardlinks to one inode share its storage, so only the
+    # first link found is considered. Empty files are ignored
+    #
+    # Inputs:
+    # fileList = iterable of WalkFiles() entries
+    # hashEngine = _HashEngine used for the full hashes
+    # report = function called with a message for unreadable files
+    #
+    # Actions:
+    # returns (groups, stats) where groups is a list of
+    # (size, digests, [paths]) sorted by wasted bytes, and stats is a
+    # dictionary of file and byte counts for each pass
+    #
+    stats = collections.OrderedDict([
+        ('filesScanned', 0), ('bytesScanned', 0), ('sizeCandidates', 0),
+        ('partialCandidates', 0), ('bytesRead', 0)])
+
+    # pass 1 - size buckets, one path per inode
+    bySize = collections.defaultdict(list)
+    seenInodes = set()
+    for theFile, simpleName, st in fileList:
+        if st is None or not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+            continue
+        if st.st_nlink > 1:
+            key = (st.st_dev, st.st_ino)
+            if key in seenInodes:
+                continue
+            seenInodes.add(key)
+        stats['filesScanned'] += 1
+        stats['bytesScanned'] += st.st_size
+        bySize[st.st_size].append(theFile)
+    seenInodes = None
+
+    # pass 2 - partial hashes of files that share a size
+    buffer = bytearray(PARTIAL_BYTES)
+    byPartial = collections.defaultdict(list)
+    for size in sorted(bySize):
+        paths = bySize[size]
+        if len(paths) < 2:
+            continue
+        stats['sizeCandidates'] += len(paths)
+        for theFile in paths:
+            try:
+                digest, bytesRead = PartialHash(theFile, size, buffer)
+            except OSError:
+                report('Read Failed:'+ theFile)
+                continue
+            stats['bytesRead'] += bytesRead
+            byPartial[(size, digest)].append(theFile)
+    bySize = None
+
+    # pass 3 - full hashes where the partial hashes collide
+    groups = []
+    for (size, partial), paths in byPartial.items():
+        if len(paths) < 2:
+            continue
+        stats['partialCandidates'] += len(paths)
+        byDigest = collections.defaultdict(list)
+        for theFile in paths:
+            try:
+                with open(theFile, 'rb', buffering=0) as f:
+                    digests = tuple(hashEngine.hashFile(f))
+            except (IOError, OSError):
+                report('Read Failed:'+ theFile)
+                continue
+            stats['bytesRead'] += size
+            byDigest[digests].append(theFile)
+        for digests, same in byDigest.items():
+            if len(same) > 1:
+                groups.append((size, digests, sorted(same)))
+
+    groups.sort(key=lambda group: (-group[0] * (len(group[2]) - 1), group[2][0]))
+    return groups, stats
+#End FindDuplicates =====================================
+
+
+def WriteDuplicateReport(fileName, groups, hashTypes):
+    #
+    # Name: WriteDuplicateReport() Function
+    #
+    # Desc: Writes one row per duplicate file, the rows of a group share
+    # a group number. Wasted bytes is the space that would be freed by
+    # keeping a single copy
+    #
+    # Inputs:
+    # fileName = full path of the csv report
+    # groups = the groups returned by FindDuplicates()
+    # hashTypes = names of the digest columns
+    #
+    # Actions:
+    # returns the total wasted bytes over all groups
+    #
+    totalWasted = 0
+    with open(fileName, 'w', newline='') as csvFile:
+        writer = csv.writer(csvFile, delimiter=',', quoting=csv.QUOTE_ALL)
+        writer.writerow(('Group','Size','Copies','Wasted Bytes','Path') + tuple(hashTypes))
+        for groupNumber, (size, digests, paths) in enumerate(groups, 1):
+            wasted = size * (len(paths) - 1)
+            totalWasted += wasted
+            for theFile in paths:
+                writer.writerow((groupNumber, size, len(paths), wasted, theFile) + digests)
+    return totalWasted
+#End WriteDuplicateReport ===============================
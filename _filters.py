@@ -0,0 +1,144 @@
+
+# _filters.py
+# Python One Way File System Hashing - walk filters
+# Author: L. Konate
+
+#################################################################
+# Path pruning and file predicates applied inside WalkFiles() for
+# hash.py and sys_file_hashing.py
+#
+# CompileGlobs() class _WalkFilter
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import re #Python Standard Library - Regular expression operations
+import fnmatch #Python Standard Library - Unix filename pattern matching
+import _pfish # p-fish shared hashing engine
+
+
+def CompileGlobs(patterns):
+    #
+    # Name: CompileGlobs() Function
+    #
+    # Desc: Compiles shell style patterns into two regular expressions,
+    # one for patterns holding a path separator, which are matched
+    # against the path below the root, and one for the rest, which are
+    # matched against the entry name alone
+    #
+    # Input: patterns = list of glob patterns, e.g. *.tmp or cache/*
+    #
+    # Actions:
+    # returns (name regex, path regex), either may be None
+    #
+    names = [fnmatch.translate(pattern) for pattern in patterns if '/' not in pattern and os.sep not in pattern]
+    paths = [fnmatch.translate(pattern.replace('/', os.sep)) for pattern in patterns
+             if '/' in pattern or os.sep in pattern]
+    return (re.compile('|'.join(names)) if names else None,
+            re.compile('|'.join(paths)) if paths else None)
+#End CompileGlobs =======================================
+
+
+class _WalkFilter:
+    #
+    # Class: _WalkFilter
+    #
+    # Desc: Decides, from names and the stat data the walk has already
+    # fetched, which directories WalkFiles() descends into and which
+    # files it yields. No file is opened and no extra stat is made,
+    # except one fstat per directory for oneFileSystem
+    #
+    # Directories are pruned when they match an exclude pattern, lie
+    # deeper than maxDepth (the root is depth 0) or, with oneFileSystem,
+    # sit on another device than the root. Files are dropped when they
+    # match an exclude pattern, match none of the include patterns
+    # (when some are given), or fail a size or modified time bound.
+    # With a shard plan, files of other shards are dropped as well, and
+    # directories holding none of this shard's files are pruned
+    #
+    # Methods:
+    # constructor: Compiles the patterns
+    # active: True when any filter is set
+    # keepDirectory: True when the walk should descend into a directory
+    # keepFile: True when the walk should yield a file
+    # inShard: True when a path from elsewhere, such as a baseline, is
+    #          this shard's to report
+    #
+    def __init__(self, rootPath, include=None, exclude=None, includeRegex=None, excludeRegex=None,
+                 minSize=None, maxSize=None, newerThan=None, olderThan=None, maxDepth=None,
+                 oneFileSystem=False, shardPlan=None, shardIndex=None):
+        self.rootPrefix = os.path.join(rootPath, '')
+        self.includeName, self.includePath = CompileGlobs(include or [])
+        self.excludeName, self.excludePath = CompileGlobs(exclude or [])
+        self.includeRegex = re.compile('|'.join('(?:%s)' % regex for regex in includeRegex)) if includeRegex else None
+        self.excludeRegex = re.compile('|'.join('(?:%s)' % regex for regex in excludeRegex)) if excludeRegex else None
+        self.hasIncludes = bool(include or includeRegex)
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.newerThan = newerThan
+        self.olderThan = olderThan
+        self.maxDepth = maxDepth
+        # WalkFiles() compares each directory's device with this one
+        self.rootDevice = os.stat(rootPath).st_dev if oneFileSystem else None
+        self.directoriesPruned = 0
+        self.filesSkipped = 0
+        # a _shards._ShardPlan and the 0 based shard this scan hashes
+        self.shardPlan = shardPlan
+        self.shardIndex = shardIndex
+        self.otherShardFiles = 0
+
+    def active(self):
+        return (self.hasIncludes or self.excludeName is not None or self.excludePath is not None
+                or self.excludeRegex is not None or self.minSize is not None or self.maxSize is not None
+                or self.newerThan is not None or self.olderThan is not None or self.maxDepth is not None
+                or self.rootDevice is not None or self.shardPlan is not None)
+
+    def _excluded(self, path, name):
+        relative = path[len(self.rootPrefix):]
+        return ((self.excludeName is not None and self.excludeName.match(name))
+                or (self.excludePath is not None and self.excludePath.match(relative))
+                or (self.excludeRegex is not None and self.excludeRegex.search(relative)))
+
+    def _included(self, path, name):
+        relative = path[len(self.rootPrefix):]
+        return ((self.includeName is not None and self.includeName.match(name))
+                or (self.includePath is not None and self.includePath.match(relative))
+                or (self.includeRegex is not None and self.includeRegex.search(relative)))
+
+    def keepDirectory(self, path, name, depth):
+        # include patterns never prune, matching files may lie below
+        if (self.maxDepth is not None and depth > self.maxDepth) or self._excluded(path, name):
+            self.directoriesPruned += 1
+            return False
+        if self.shardPlan is not None and not self.shardPlan.covers(path[len(self.rootPrefix):], self.shardIndex):
+            return False
+        return True
+
+    def keepFile(self, path, name, st):
+        keep = not self._excluded(path, name) and (not self.hasIncludes or self._included(path, name))
+        if keep and st is not None:
+            # an entry that vanished before its stat is left to the scan to report
+            keep = not ((self.minSize is not None and st.st_size < self.minSize)
+                        or (self.maxSize is not None and st.st_size > self.maxSize)
+                        or (self.newerThan is not None and st.st_mtime <= self.newerThan)
+                        or (self.olderThan is not None and st.st_mtime >= self.olderThan))
+        if not keep:
+            self.filesSkipped += 1
+        elif self.shardPlan is not None:
+            # filters first, so a plan made with the same filters matches
+            if self.shardPlan.shardOf(os.path.dirname(path[len(self.rootPrefix):]), name) != self.shardIndex:
+                self.otherShardFiles += 1
+                keep = False
+        return keep
+
+    def inShard(self, path):
+        # archive members go with their archive, and paths outside the
+        # root, which no shard walks, to the first shard
+        if self.shardPlan is None:
+            return True
+        path = path.split(_pfish.MEMBER_SEPARATOR, 1)[0]
+        if not path.startswith(self.rootPrefix):
+            return self.shardIndex == 0
+        relative = path[len(self.rootPrefix):]
+        return self.shardPlan.shardOf(os.path.dirname(relative), os.path.basename(relative)) == self.shardIndex
+
+#End _WalkFilter ========================================
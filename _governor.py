@@ -0,0 +1,150 @@
+
+# _governor.py
+# Python One Way File System Hashing - resource governed reads
+# Author: L. Konate
+
+#################################################################
+# Read throttling and cache friendly reads for hash.py and
+# sys_file_hashing.py, for scans of live production hosts
+#
+# class _TokenBucket class _ReadGovernor LowerPriority()
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import time #Python Standard Library - Time access and conversions functions
+import shutil #Python Standard Library - High-level file operations
+import threading #Python Standard Library - Thread-based parallelism
+import multiprocessing #Python Standard Library - Process-based parallelism
+import subprocess #Python Standard Library - Subprocess management
+
+# posix_fadvise() is only offered on some platforms (Linux, FreeBSD)
+FADVISE_SUPPORTED = hasattr(os, 'posix_fadvise')
+
+# Nice value used by --low-priority, the lowest CPU priority
+LOW_PRIORITY_NICE = 19
+
+
+class _TokenBucket:
+    #
+    # Class: _TokenBucket
+    #
+    # Desc: Limits a rate of units (bytes or reads) per second. The bucket
+    # holds up to one second of tokens, so short bursts run at full speed.
+    # A take larger than the tokens left puts the bucket in debt and the
+    # caller sleeps until the debt is paid, so chunks larger than the rate
+    # still average out to the rate. Safe to share between threads, and
+    # a shared bucket keeps its state in shared memory so one limit
+    # covers every process of a pool
+    #
+    # Methods:
+    # constructor: Starts with a full bucket
+    # take: Removes tokens, sleeping as long as the rate requires
+    #
+    def __init__(self, rate, shared=False):
+        self.rate = float(rate)
+        self.capacity = self.rate
+        # state holds the tokens left and the monotonic time they were
+        # counted at, the monotonic clock is system wide
+        if shared:
+            self.state = multiprocessing.RawArray('d', [self.capacity, time.monotonic()])
+            self.lock = multiprocessing.Lock()
+        else:
+            self.state = [self.capacity, time.monotonic()]
+            self.lock = threading.Lock()
+
+    def take(self, amount):
+        state = self.state
+        with self.lock:
+            now = time.monotonic()
+            tokens = min(self.capacity, state[0] + (now - state[1]) * self.rate) - amount
+            state[0] = tokens
+            state[1] = now
+            wait = -tokens / self.rate if tokens < 0 else 0.0
+        # sleep outside the lock, later callers see the debt and queue up
+        if wait > 0.0:
+            time.sleep(wait)
+
+#End _TokenBucket =======================================
+
+
+class _ReadGovernor:
+    #
+    # Class: _ReadGovernor
+    #
+    # Desc: Governs the reads of a _HashEngine. Each file is announced to
+    # the kernel as read sequentially, every read is charged against the
+    # byte and read rate limits, and with dropCache the file's pages are
+    # released once it is hashed so the scan does not push the working
+    # set of the host out of the page cache
+    #
+    # Methods:
+    # constructor: Sets the limits, None means unlimited
+    # forProcesses: Returns a governor whose limits hold across the
+    #               processes of a pool
+    # opened: Called before the first read of a file
+    # charge: Called after each read
+    # finished: Called once a file has been hashed
+    #
+    def __init__(self, maxBytesPerSec=None, maxIops=None, dropCache=False, shared=False):
+        self.maxBytesPerSec = maxBytesPerSec
+        self.maxIops = maxIops
+        self.dropCache = dropCache
+        self.bytesBucket = _TokenBucket(maxBytesPerSec, shared) if maxBytesPerSec else None
+        self.readsBucket = _TokenBucket(maxIops, shared) if maxIops else None
+
+    def forProcesses(self):
+        # the shared buckets can only be handed to processes as they start,
+        # e.g. as pool initializer arguments
+        return _ReadGovernor(self.maxBytesPerSec, self.maxIops, self.dropCache, shared=True)
+
+    def opened(self, fd):
+        if FADVISE_SUPPORTED:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def charge(self, bytesRead):
+        if self.readsBucket is not None:
+            self.readsBucket.take(1)
+        if self.bytesBucket is not None and bytesRead:
+            self.bytesBucket.take(bytesRead)
+
+    def finished(self, fd):
+        if self.dropCache and FADVISE_SUPPORTED:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+#End _ReadGovernor ======================================
+
+
+def LowerPriority():
+    #
+    # Name: LowerPriority() Function
+    #
+    # Desc: Drops the scan to the lowest CPU priority and, where the
+    # ionice tool is available, to the idle I/O scheduling class, so the
+    # disk only serves the scan when nothing else wants it. Must be
+    # called before any pool is started, worker processes and threads
+    # inherit both priorities
+    #
+    # Actions:
+    # returns a list of messages describing what was applied
+    #
+    messages = []
+    try:
+        if hasattr(os, 'setpriority'):
+            os.setpriority(os.PRIO_PROCESS, 0, LOW_PRIORITY_NICE)
+        else:
+            os.nice(LOW_PRIORITY_NICE)
+        messages.append('CPU Priority: nice '+ str(LOW_PRIORITY_NICE))
+    except (AttributeError, OSError) as err:
+        messages.append('CPU Priority unchanged: '+ str(err))
+    ionice = shutil.which('ionice')
+    if ionice is None:
+        messages.append('I/O Priority unchanged: ionice not available')
+        return messages
+    try:
+        subprocess.check_call([ionice, '-c', '3', '-p', str(os.getpid())],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        messages.append('I/O Priority: idle class')
+    except (OSError, subprocess.CalledProcessError) as err:
+        messages.append('I/O Priority unchanged: '+ str(err))
+    return messages
+#End LowerPriority ======================================
@@ -0,0 +1,178 @@
+
+# _hashCache.py
+# Python One Way File System Hashing - persistent hash cache
+# Author: L. Konate
+
+#################################################################
+# Incremental scan support for hash.py and sys_file_hashing.py
+#
+# CacheKey() Unchanged() class _HashCache
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import random #Python Standard Library - Generate pseudo-random numbers
+import sqlite3 #Python Standard Library - DB-API 2.0 interface for SQLite databases
+import threading #Python Standard Library - Thread-based parallelism
+import urllib.parse #Python Standard Library - Parse URLs into components
+
+# Default cache file name, written next to fileSystemReport.csv
+CACHE_FILE_NAME = 'pfishHashCache.db'
+
+# Number of stored files between commits of the cache database
+CACHE_COMMIT_INTERVAL = 1000
+
+# How a file's digests were obtained, None means freshly hashed
+# without any cache entry to compare against. Changed means the file's
+# size or times moved while it was read, so its digests may mix old
+# and new contents and are never stored
+CACHE_HIT = 'hit'
+CACHE_VERIFIED = 'verified'
+CACHE_MISMATCH = 'mismatch'
+CACHE_CHANGED = 'changed'
+
+
+def CacheKey(st):
+    #
+    # Name: CacheKey() Function
+    #
+    # Desc: Builds the cache key for a file from its os.stat() result.
+    # Any write, truncate, chmod or replacement of the file changes at
+    # least one of these values, so a matching key means the cached
+    # digests still describe the file
+    #
+    # Input: st = os.stat_result of the file
+    #
+    # Actions:
+    # returns (device, inode, size, mtime_ns, ctime_ns)
+    #
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+#End CacheKey ===========================================
+
+
+def Unchanged(before, after):
+    # True when two stat results of an open file show no write, truncate
+    # or metadata change between them
+    return CacheKey(before)[2:] == CacheKey(after)[2:]
+
+
+class _HashCache:
+    #
+    # Class: _HashCache
+    #
+    # Desc: On-disk SQLite cache of file digests keyed on CacheKey().
+    # Lookups may come from any thread, each thread gets its own
+    # connection and close() closes them all. Stores are made by the
+    # thread writing the report and committed in large batches. Pool
+    # workers open the database with SQLite's read only mode, so they
+    # can never write to it
+    #
+    # Methods:
+    # constructor: Opens or creates the cache database
+    # lookup: Returns cached digests for a file or None
+    # sampled: True when a cache hit should be re-read for verification
+    # store: Records the digests of a freshly hashed file
+    # update: Counts a scanned file and stores it when it was hashed
+    # close: Commits pending stores and closes the database
+    #
+    def __init__(self, fileName, verifyPercent=0.0, readOnly=False):
+        self.fileName = fileName
+        self.verifyRate = verifyPercent / 100.0
+        self.readOnly = readOnly
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.hits = 0
+        self.verified = 0
+        self.mismatches = 0
+        self.changed = 0
+        if not readOnly:
+            db = self._connection()
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS hashes ('
+                       'dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, ctime_ns INTEGER, '
+                       'hashType TEXT, digest TEXT, '
+                       'PRIMARY KEY (dev, ino, size, mtime_ns, ctime_ns, hashType)) WITHOUT ROWID')
+            db.commit()
+
+    def __getstate__(self):
+        # only the settings travel to pool workers, which open their own
+        # read only connections
+        return (self.fileName, self.verifyRate * 100.0)
+
+    def __setstate__(self, state):
+        self.__init__(state[0], state[1], readOnly=True)
+
+    def _connection(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            # each connection is only used by the thread that opened it,
+            # close() may be called from another
+            if self.readOnly:
+                uri = 'file:'+ urllib.parse.quote(os.path.abspath(self.fileName)) +'?mode=ro'
+                db = sqlite3.connect(uri, timeout=60, uri=True, check_same_thread=False)
+            else:
+                db = sqlite3.connect(self.fileName, timeout=60, check_same_thread=False)
+            self.local.db = db
+            with self.lock:
+                self.connections.append(db)
+        return db
+
+    def lookup(self, st, hashTypes):
+        # returns the digests in hashTypes order, or None unless every
+        # requested algorithm is cached for this exact file version
+        try:
+            cursor = self._connection().execute(
+                'SELECT hashType, digest FROM hashes WHERE dev=? AND ino=? AND size=? AND mtime_ns=? AND ctime_ns=?',
+                CacheKey(st))
+            cached = dict(cursor.fetchall())
+        except sqlite3.Error:
+            return None
+        try:
+            return [cached[hashType] for hashType in hashTypes]
+        except KeyError:
+            return None
+
+    def sampled(self):
+        return self.verifyRate > 0.0 and random.random() < self.verifyRate
+
+    def store(self, st, hashTypes, hashValues):
+        key = CacheKey(st)
+        db = self._connection()
+        # drop digests of older versions of this inode before adding the new ones
+        db.execute('DELETE FROM hashes WHERE dev=? AND ino=? AND NOT (size=? AND mtime_ns=? AND ctime_ns=?)',
+                   key)
+        db.executemany('INSERT OR REPLACE INTO hashes VALUES (?,?,?,?,?,?,?)',
+                       [key + (hashType, hashValue) for hashType, hashValue in zip(hashTypes, hashValues)])
+        self.pending += 1
+        if self.pending >= CACHE_COMMIT_INTERVAL:
+            db.commit()
+            self.pending = 0
+
+    def update(self, st, hashTypes, hashValues, status):
+        # status is the cache status the scan reported for the file
+        if status == CACHE_CHANGED:
+            self.changed += 1
+            return
+        if status == CACHE_HIT:
+            self.hits += 1
+            return
+        if status == CACHE_VERIFIED:
+            self.verified += 1
+            return
+        if status == CACHE_MISMATCH:
+            self.mismatches += 1
+        self.store(st, hashTypes, hashValues)
+
+    def close(self):
+        # the stores were all made on the calling thread's connection
+        db = getattr(self.local, 'db', None)
+        if db is not None and not self.readOnly:
+            db.commit()
+        with self.lock:
+            for db in self.connections:
+                db.close()
+            self.connections = []
+        self.local = threading.local()
+
+#End _HashCache =========================================
@@ -0,0 +1,228 @@
+
+# _knownFiles.py
+# Python One Way File System Hashing - known file hash sets
+# Author: L. Konate
+
+#################################################################
+# NSRL style reference sets for hash.py and sys_file_hashing.py
+#
+# ImportHashLists() class _KnownSet class _KnownFilter
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import re #Python Standard Library - Regular expression operations
+import math #Python Standard Library - Mathematical functions
+import mmap #Python Standard Library - Memory-mapped file support
+import heapq #Python Standard Library - Heap queue algorithm
+import struct #Python Standard Library - Interpret bytes as packed binary data
+import tempfile #Python Standard Library - Generate temporary files and directories
+import _pfish # p-fish shared hashing engine
+
+# Known set layout, all integers little endian
+#   header: magic, hash name, digest size, digest count, Bloom filter
+#           bits, Bloom filter probes
+#   then the Bloom filter bit array followed by the digests sorted
+#   in byte order with duplicates removed
+KNOWN_MAGIC = b'PFKNOWN1'
+HEADER_FORMAT = struct.Struct('<8s16sBQQB')
+
+# Bloom filter bits per digest, 10 bits with 7 probes gives about one
+# false positive in a hundred, 0 leaves the filter out
+DEFAULT_BLOOM_BITS = 10
+
+# Digests sorted in memory at once while importing, larger lists are
+# sorted in runs and merged from temporary files
+IMPORT_RUN_DIGESTS = 1024 * 1024
+
+# Report column values
+KNOWN_GOOD = 'Known Good'
+KNOWN_BAD = 'Known Bad'
+
+
+def _BloomProbes(digest, bloomBits, probes):
+    # digests are already uniformly distributed, so two 64 bit slices
+    # of the digest drive double hashing instead of extra hash functions
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:16], 'little') | 1
+    return [(h1 + i * h2) % bloomBits for i in range(probes)]
+
+
+def _ReadRun(fileName, digestSize):
+    with open(fileName, 'rb') as runFile:
+        while True:
+            digest = runFile.read(digestSize)
+            if len(digest) < digestSize:
+                return
+            yield digest
+
+
+def ImportHashLists(listFiles, setFile, hashType, bloomBitsPerDigest=DEFAULT_BLOOM_BITS):
+    #
+    # Name: ImportHashLists() Function
+    #
+    # Desc: Builds a known set from text hash lists such as the NSRL
+    # NSRLFile.txt, hashdeep or md5sum output. The first hex token of the
+    # algorithm's digest length on each line is taken, lines without one
+    # (headers, comments) are skipped. The digests are sorted in bounded
+    # runs and merged, so lists larger than memory can be imported
+    #
+    # Input: listFiles = text hash lists to read
+    #        setFile = the known set to write
+    #        hashType = report name of the algorithm, e.g. 'MD5'
+    #        bloomBitsPerDigest = Bloom filter size, 0 for none
+    #
+    # Actions:
+    # returns (lines read, digests stored)
+    #
+    digestSize = _pfish.NewHash(hashType).digest_size
+    hexLength = digestSize * 2
+    token = re.compile(rb'(?<![0-9A-Fa-f])[0-9A-Fa-f]{%d}(?![0-9A-Fa-f])' % hexLength)
+    lineCount = 0
+    total = 0
+    runFiles = []
+    run = []
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(setFile))) as runDir:
+
+        def FlushRun():
+            runName = os.path.join(runDir, 'run%d' % len(runFiles))
+            with open(runName, 'wb') as runFile:
+                runFile.write(b''.join(sorted(set(run))))
+            runFiles.append(runName)
+            del run[:]
+
+        for listFile in listFiles:
+            with open(listFile, 'rb') as lines:
+                for line in lines:
+                    lineCount += 1
+                    match = token.search(line)
+                    if match is None:
+                        continue
+                    run.append(bytes.fromhex(match.group().decode('ascii')))
+                    total += 1
+                    if len(run) >= IMPORT_RUN_DIGESTS:
+                        FlushRun()
+        if run:
+            FlushRun()
+
+        # size the filter for the digest count before duplicates are
+        # removed, the merge below is the only pass over the digests
+        bloomBits = 0
+        probes = 0
+        if bloomBitsPerDigest and total:
+            bloomBits = (total * bloomBitsPerDigest + 7) // 8 * 8
+            probes = max(1, int(round(bloomBitsPerDigest * math.log(2))))
+        bloom = bytearray(bloomBits // 8)
+        count = 0
+        with open(setFile, 'wb') as outFile:
+            outFile.seek(HEADER_FORMAT.size + len(bloom))
+            last = None
+            for digest in heapq.merge(*[_ReadRun(runName, digestSize) for runName in runFiles]):
+                if digest == last:
+                    continue
+                outFile.write(digest)
+                last = digest
+                count += 1
+                for bit in (_BloomProbes(digest, bloomBits, probes) if bloomBits else ()):
+                    bloom[bit >> 3] |= 1 << (bit & 7)
+            outFile.seek(0)
+            outFile.write(HEADER_FORMAT.pack(KNOWN_MAGIC, hashType.encode('ascii'), digestSize, count, bloomBits, probes))
+            outFile.write(bloom)
+    return lineCount, count
+#End ImportHashLists ====================================
+
+
+class _KnownSet:
+    #
+    # Class: _KnownSet
+    #
+    # Desc: A known set file mapped into memory. Membership is a Bloom
+    # filter check, which rejects most unknown files in a few byte reads,
+    # then a binary search over the sorted digests. Pages are loaded by
+    # the operating system as the searches touch them, so resident memory
+    # stays a small fraction of the set
+    #
+    # Methods:
+    # constructor: Maps the set and reads its header
+    # contains: True when the hex digest is in the set
+    # close: Unmaps the set
+    #
+    def __init__(self, fileName):
+        self.fileName = fileName
+        with open(fileName, 'rb') as setFile:
+            self.map = mmap.mmap(setFile.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER_FORMAT.size:
+            raise ValueError('Not a known set: '+ fileName)
+        magic, name, self.digestSize, self.count, self.bloomBits, self.probes = HEADER_FORMAT.unpack_from(self.map)
+        if magic != KNOWN_MAGIC:
+            raise ValueError('Not a known set: '+ fileName)
+        self.hashType = name.rstrip(b'\0').decode('ascii')
+        self.bloomOffset = HEADER_FORMAT.size
+        self.digestOffset = self.bloomOffset + self.bloomBits // 8
+
+    def contains(self, hexDigest):
+        digest = bytes.fromhex(hexDigest)
+        data = self.map
+        if self.bloomBits:
+            for bit in _BloomProbes(digest, self.bloomBits, self.probes):
+                if not data[self.bloomOffset + (bit >> 3)] & (1 << (bit & 7)):
+                    return False
+        size = self.digestSize
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = self.digestOffset + middle * size
+            found = data[offset:offset + size]
+            if found < digest:
+                low = middle + 1
+            elif found > digest:
+                high = middle
+            else:
+                return True
+        return False
+
+    def close(self):
+        self.map.close()
+
+#End _KnownSet ==========================================
+
+
+class _KnownFilter:
+    #
+    # Class: _KnownFilter
+    #
+    # Desc: Classifies scanned files against the known good and known bad
+    # sets given on the command line. Each set is checked with the
+    # report's digest of the set's own algorithm, a known bad match wins
+    #
+    # Methods:
+    # constructor: Opens the sets, raises ValueError when a set's
+    #              algorithm is not among the selected hashes
+    # classify: Returns KNOWN_BAD, KNOWN_GOOD or ''
+    # close: Closes the sets
+    #
+    def __init__(self, goodFiles, badFiles, hashTypes):
+        self.good = []
+        self.bad = []
+        self.counts = {KNOWN_GOOD: 0, KNOWN_BAD: 0}
+        for fileNames, sets in ((badFiles or [], self.bad), (goodFiles or [], self.good)):
+            for fileName in fileNames:
+                knownSet = _KnownSet(fileName)
+                if knownSet.hashType not in hashTypes:
+                    knownSet.close()
+                    raise ValueError(fileName +' holds '+ knownSet.hashType +' digests, select that algorithm too')
+                sets.append((knownSet, hashTypes.index(knownSet.hashType)))
+
+    def classify(self, hashValues):
+        for sets, status in ((self.bad, KNOWN_BAD), (self.good, KNOWN_GOOD)):
+            for knownSet, index in sets:
+                if knownSet.contains(hashValues[index]):
+                    self.counts[status] += 1
+                    return status
+        return ''
+
+    def close(self):
+        for knownSet, index in self.bad + self.good:
+            knownSet.close()
+
+#End _KnownFilter =======================================
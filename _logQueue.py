@@ -0,0 +1,183 @@
+
+# _logQueue.py
+# Python One Way File System Hashing - background logging
+# Author: L. Konate
+
+#################################################################
+# Queue based logging for sys_file_hashing.py and _ForensicLog, the
+# scan only queues each record and a background thread formats and
+# writes them in batches
+#
+# class _JSONFormatter class _BatchingFileHandler class _RecordQueueHandler class _QueueLogging
+#################################################################
+
+import time #Python Standard Library - Time access and conversions functions
+import json #Python Standard Library - JSON encoder and decoder
+import queue #Python Standard Library - A synchronized queue class
+import atexit #Python Standard Library - Exit handlers
+import logging #Python Standard Library - logging facility
+import logging.handlers #Python Standard Library - logging handlers
+
+# text is the classic 'time message' line, json is one compact JSON
+# object per line for machine parsing
+LOG_FORMATS = ('text', 'json')
+
+DEFAULT_TEXT_FORMAT = '%(asctime)s %(message)s'
+
+# The log file is flushed once this many records are buffered, once
+# this many seconds have passed since the last flush, or at once for
+# an error, so a crash loses at most one batch of routine records
+LOG_BATCH_RECORDS = 512
+LOG_FLUSH_SECONDS = 1.0
+LOG_FLUSH_LEVEL = logging.ERROR
+
+# Write buffer of the log file, large enough to hold a batch
+LOG_BUFFER_BYTES = 256 * 1024
+
+
+class _JSONFormatter(logging.Formatter):
+    #
+    # Class: _JSONFormatter
+    #
+    # Desc: Formats a record as one line of compact JSON holding its
+    # local time to the millisecond, level, logger and message
+    #
+    def format(self, record):
+        entry = {'time': '%s.%03d' % (time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)),
+                                      record.msecs),
+                 'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+        return json.dumps(entry, separators=(',', ':'))
+
+#End _JSONFormatter =====================================
+
+
+class _BatchingFileHandler(logging.FileHandler):
+    #
+    # Class: _BatchingFileHandler
+    #
+    # Desc: A FileHandler that leaves records in a large write buffer
+    # instead of flushing after every record, see LOG_BATCH_RECORDS
+    #
+    # Methods:
+    # constructor: Opens the log file for appending
+    # emit: Writes one record, flushing when the batch is due
+    #
+    def __init__(self, fileName):
+        self.pending = 0
+        self.lastFlush = time.monotonic()
+        logging.FileHandler.__init__(self, fileName, 'a', encoding='utf-8')
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=LOG_BUFFER_BYTES, encoding=self.encoding,
+                    errors=self.errors)
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            self.pending += 1
+            now = time.monotonic()
+            if (self.pending >= LOG_BATCH_RECORDS or now - self.lastFlush >= LOG_FLUSH_SECONDS
+                    or record.levelno >= LOG_FLUSH_LEVEL):
+                self.stream.flush()
+                self.pending = 0
+                self.lastFlush = now
+        except Exception:
+            self.handleError(record)
+
+#End _BatchingFileHandler ===============================
+
+
+class _RecordQueueHandler(logging.handlers.QueueHandler):
+    #
+    # Class: _RecordQueueHandler
+    #
+    # Desc: A QueueHandler that queues the record itself. The standard
+    # one formats every record and copies it on the logging thread,
+    # here only the message arguments are merged, so nothing they refer
+    # to can change before the writer thread formats the record
+    #
+    def prepare(self, record):
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            # a traceback holds frames, it is rendered here and dropped
+            record.msg = record.getMessage() +'\n'+ logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+#End _RecordQueueHandler ================================
+
+
+class _QueueLogging:
+    #
+    # Class: _QueueLogging
+    #
+    # Desc: Puts a QueueHandler on the root logger, so logging a record
+    # costs the scan no more than a put on an unbounded queue. A
+    # QueueListener thread takes the records off the queue and writes
+    # them through a _BatchingFileHandler. The handler is installed at
+    # once and the listener started later, so records logged before the
+    # log file and format are known wait in the queue rather than being
+    # lost. stop() is registered to run at exit as soon as the handler
+    # is installed, so the queue is drained however the program ends,
+    # even by an argparse error before start(). Records queued when
+    # start() never ran are written as text to fallbackFile, or to
+    # standard error when there is none
+    #
+    # Methods:
+    # constructor: Installs the queue handler on the root logger
+    # start: Opens the log file and starts the listener thread
+    # stop: Drains the queue, closes the log file and removes the handler
+    #
+    def __init__(self, level=logging.DEBUG, fallbackFile=None):
+        self.queue = queue.SimpleQueue()
+        self.queueHandler = _RecordQueueHandler(self.queue)
+        self.fileHandler = None
+        self.listener = None
+        self.fallbackFile = fallbackFile
+        root = logging.getLogger()
+        root.addHandler(self.queueHandler)
+        root.setLevel(level)
+        atexit.register(self.stop)
+
+    def start(self, fileName, logFormat='text', textFormat=DEFAULT_TEXT_FORMAT):
+        self.fileHandler = _BatchingFileHandler(fileName)
+        if logFormat == 'json':
+            self.fileHandler.setFormatter(_JSONFormatter())
+        else:
+            self.fileHandler.setFormatter(logging.Formatter(textFormat))
+        self.listener = logging.handlers.QueueListener(self.queue, self.fileHandler)
+        self.listener.start()
+
+    def stop(self):
+        # the queue handler goes first, nothing may be queued behind the drain
+        logging.getLogger().removeHandler(self.queueHandler)
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+            self.fileHandler.close()
+        else:
+            self._drainToFallback()
+
+    def _drainToFallback(self):
+        records = []
+        while True:
+            try:
+                records.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if not records:
+            return
+        if self.fallbackFile is not None:
+            handler = _BatchingFileHandler(self.fallbackFile)
+        else:
+            handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(DEFAULT_TEXT_FORMAT))
+        for record in records:
+            handler.handle(record)
+        handler.close()
+
+#End _QueueLogging ======================================
@@ -0,0 +1,1325 @@
+
+# _pfish.py
+# Python One Way File System Hashing - shared support module
+# Author: L. Konate
+
+#################################################################
+# p-fish engine functions shared by hash.py and sys_file_hashing.py
+#
+# NewHash() ParseSize() ValidateChunkSize() ValidateBlockSize() ValidateWorkers() ValidatePercent() ValidateSeconds() ValidateRate()
+# ValidateSize() ValidateTime() ValidateShard()
+# BenchmarkHashes() class _HashEngine class _HashedReader AllocatedSize() FileSystemType()
+# MountPoint() WalkFiles() WalkOrderKey() ScanDirectory() LinkGroup() class _LinkTracker ScanFile() FormatRow() SequentialScan() ParallelScan() ThreadedScan() class _ShareStats
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import stat #Python Standard Library - functions for interpreting os results
+import errno #Python Standard Library - Standard errno system symbols
+import time #Python Standard Library - Time access and conversions functions
+import mmap #Python Standard Library - Memory-mapped file support
+import io #Python Standard Library - Core tools for working with streams
+import hashlib #Python Standard Library - Secure hashes and message digests
+import argparse #Python Standard Library - Parser for commandline options, arguments
+import collections #Python Standard Library - Container datatypes
+import concurrent.futures #Python Standard Library - Launching parallel tasks
+import threading #Python Standard Library - Thread-based parallelism
+import _hashCache # p-fish persistent hash cache
+import _pieceHash # p-fish piecewise block hashing
+
+# Default size of the reusable read buffer, large enough to keep
+# the disk streaming and small enough to stay flat per worker
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Hash names as they appear in the report header mapped to
+# the hashlib constructor used to compute them
+HASH_ALGORITHMS = {
+    'MD5': hashlib.md5,
+    'SHA256': hashlib.sha256,
+    'SHA512': hashlib.sha512,
+    'BLAKE2B': hashlib.blake2b,
+    'SHA3_256': hashlib.sha3_256,
+}
+
+# Number of files handed to a pool worker in one task, and the number of
+# tasks each worker may have queued ahead of the report writer
+PARALLEL_BATCH_FILES = 32
+PARALLEL_TASKS_PER_WORKER = 4
+# Threads are for high latency storage, so hand them only a few
+# files at a time to keep the in-flight work spread across them
+THREADED_BATCH_FILES = 4
+
+# One scanned file: full path, simple name, os.stat_result, hex digests
+# in hash type order, how the cache supplied them (see _hashCache) and,
+# for a hardlink whose digests were reused, the path that was hashed.
+# Piecewise scans add the raw block digests, concatenated, and their
+# Merkle root. Archive scans add the members of an archive as
+# (member path, FileRecord, message) tuples. A file that was read
+# carries the seconds spent opening, reading and hashing it and in
+# all, for the scan statistics. A file hashed in segments carries its
+# _segments.SegmentDigests
+FileRecord = collections.namedtuple('FileRecord', 'path name stat hashValues cacheStatus linkOf blocks merkleRoot members timings segments')
+FileRecord.__new__.__defaults__ = (None, None, None, None, None, None)
+
+# Joins an archive's path and the path of a member inside it,
+# e.g. evidence.zip!/docs/letter.txt
+MEMBER_SEPARATOR = '!/'
+
+# SEEK_DATA/SEEK_HOLE are only offered by some platforms (Linux,
+# Solaris, FreeBSD). Without them sparse files are read in full
+SPARSE_SUPPORTED = hasattr(os, 'SEEK_DATA') and hasattr(os, 'SEEK_HOLE')
+
+# Files at or above the mmap threshold are hashed through a read only
+# mapping one window at a time, a multiple of every platform's mapping
+# granularity, so the address space and resident pages it takes stay
+# flat whatever the size of the file
+MMAP_WINDOW = 64 * 1024 ** 2
+
+# madvise() needs Python 3.8 and a Unix, without it the kernel's
+# default readahead is used
+MADV_SEQUENTIAL = getattr(mmap, 'MADV_SEQUENTIAL', None)
+
+# File systems whose files are always read, never mapped: a page fault
+# there is a network round trip, and a file truncated on the server
+# while mapped ends the process with SIGBUS
+NETWORK_FILE_SYSTEMS = frozenset(('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'afs', 'ceph', 'glusterfs',
+                                  'lustre', 'gpfs', 'davfs', 'fuse.sshfs', 'fuse.glusterfs', 'fuse.s3fs',
+                                  'fuse.rclone'))
+
+# Size suffixes accepted by ParseSize()
+SIZE_MULTIPLIERS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+# Command line switch for each algorithm, in report column order
+HASH_OPTIONS = [
+    ('md5', 'MD5'),
+    ('sha256', 'SHA256'),
+    ('sha512', 'SHA512'),
+    ('blake2b', 'BLAKE2B'),
+    ('sha3', 'SHA3_256'),
+]
+
+
+def NewHash(hashType):
+    #
+    # Name: NewHash() Function
+    #
+    # Desc: Creates a fresh hash object for the named algorithm
+    #
+    # Input: hashType = report name of the algorithm e.g. 'SHA256'
+    #
+    # Actions:
+    # returns a new hashlib object, raises ValueError for unknown names
+    #
+    try:
+        return HASH_ALGORITHMS[hashType]()
+    except KeyError:
+        raise ValueError('Unknown Hash Type: ' + repr(hashType))
+#End NewHash ============================================
+
+
+def ParseSize(theSize):
+    #
+    # Name: ParseSize() Function
+    #
+    # Desc: Converts a size given on the command line to bytes. A K, M,
+    # G or T suffix may be used, with or without a trailing B, e.g. 64K,
+    # 4MB or 2T
+    #
+    # Input: a size string
+    #
+    # Actions:
+    # returns the size in bytes as an integer
+    # raises ValueError when the text is not a size
+    #
+    text = theSize.strip().upper()
+    if text.endswith('B'):
+        text = text[:-1]
+    multiplier = 1
+    if text and text[-1] in SIZE_MULTIPLIERS:
+        multiplier = SIZE_MULTIPLIERS[text[-1]]
+        text = text[:-1]
+    return int(text) * multiplier
+#End ParseSize ==========================================
+
+
+def ValidateChunkSize(theSize):
+    #
+    # Name: ValidateChunkSize Function
+    #
+    # Desc: Function that will validate a read chunk size given on the
+    # command line. A size suffix may be used e.g. 64K or 4M, see ParseSize().
+    # Used for argument validation only
+    #
+    # Input: a size string
+    #
+    # Actions:
+    # if valid it will return the size in bytes as an integer
+    # if invalid it will raise an ArgumentTypeError within argparse
+    # which will in turn be reported by argparse to the user
+    #
+    try:
+        size = ParseSize(theSize)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Chunk size is not a valid size!')
+    if size < 4096:
+        raise argparse.ArgumentTypeError('Chunk size must be at least 4K!')
+    return size
+#End ValidateChunkSize ==================================
+
+
+def ValidateBlockSize(theSize):
+    #
+    # Name: ValidateBlockSize Function
+    #
+    # Desc: Function that will validate a piecewise block size given on
+    # the command line, a chunk size no larger than the block sidecar
+    # can record. Used for argument validation only
+    #
+    # Actions:
+    # if valid it will return the size in bytes as an integer
+    # if invalid it will raise an ArgumentTypeError within argparse
+    #
+    size = ValidateChunkSize(theSize)
+    if size > _pieceHash.MAX_BLOCK_SIZE:
+        raise argparse.ArgumentTypeError('Block size must be at most 1G!')
+    return size
+#End ValidateBlockSize ==================================
+
+
+def ValidateWorkers(theCount):
+    #
+    # Name: ValidateWorkers Function
+    #
+    # Desc: Function that will validate a worker count given on the
+    # command line. Used for argument validation only
+    #
+    # Input: a count string
+    #
+    # Actions:
+    # if valid it will return the count as an integer
+    # if invalid it will raise an ArgumentTypeError within argparse
+    #
+    try:
+        count = int(theCount)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Worker count is not a number!')
+    if count < 1:
+        raise argparse.ArgumentTypeError('Worker count must be at least 1!')
+    return count
+#End ValidateWorkers ====================================
+
+
+def ValidatePercent(thePercent):
+    #
+    # Name: ValidatePercent Function
+    #
+    # Desc: Function that will validate a percentage given on the
+    # command line. Used for argument validation only
+    #
+    # Input: a percentage string, 0 to 100
+    #
+    # Actions:
+    # if valid it will return the percentage as a float
+    # if invalid it will raise an ArgumentTypeError within argparse
+    #
+    try:
+        percent = float(thePercent)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Percentage is not a number!')
+    if percent < 0.0 or percent > 100.0:
+        raise argparse.ArgumentTypeError('Percentage must be between 0 and 100!')
+    return percent
+#End ValidatePercent ====================================
+
+
+def ValidateSeconds(theSeconds):
+    #
+    # Name: ValidateSeconds Function
+    #
+    # Desc: Function that will validate a time interval given on the
+    # command line. Used for argument validation only
+    #
+    # Input: a number of seconds string
+    #
+    # Actions:
+    # if valid it will return the seconds as a float
+    # if invalid it will raise an ArgumentTypeError within argparse
+    #
+    try:
+        seconds = float(theSeconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Interval is not a number!')
+    if seconds <= 0.0:
+        raise argparse.ArgumentTypeError('Interval must be more than 0 seconds!')
+    return seconds
+#End ValidateSeconds ====================================
+
+
+def ValidateRate(theRate):
+    #
+    # Name: ValidateRate Function
+    #
+    # Desc: Function that will validate a per second limit given on the
+    # command line. A size suffix may be used e.g. 50M, see ParseSize().
+    # Used for argument validation only
+    #
+    # Input: a rate string
+    #
+    # Actions:
+    # if valid it will return the rate as an integer
+    # if invalid it will raise an ArgumentTypeError within argparse
+    #
+    try:
+        rate = ParseSize(theRate)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Rate is not a valid number!')
+    if rate < 1:
+        raise argparse.ArgumentTypeError('Rate must be at least 1 per second!')
+    return rate
+#End ValidateRate =======================================
+
+
+def ValidateSize(theSize):
+    #
+    # Name: ValidateSize Function
+    #
+    # Desc: Function that will validate a file size given on the command
+    # line. A size suffix may be used e.g. 10M, see ParseSize().
+    # Used for argument validation only
+    #
+    # Input: a size string
+    #
+    # Actions:
+    # if valid it will return the size in bytes as an integer
+    # if invalid it will raise an ArgumentTypeError within argparse
+    #
+    try:
+        size = ParseSize(theSize)
+    except ValueError:
+        raise argparse.ArgumentTypeError('File size is not a valid size!')
+    if size < 0:
+        raise argparse.ArgumentTypeError('File size cannot be negative!')
+    return size
+#End ValidateSize =======================================
+
+
+def ValidateTime(theTime):
+    #
+    # Name: ValidateTime Function
+    #
+    # Desc: Function that will validate a point in time given on the
+    # command line, either a local date and time such as 2019-10-01 or
+    # 2019-10-01T13:30, or an age such as 90m, 12h, 7d or 2w
+    # Used for argument validation only
+    #
+    # Input: a time string
+    #
+    # Actions:
+    # if valid it will return the time in seconds since the epoch
+    # if invalid it will raise an ArgumentTypeError within argparse
+    #
+    units = {'S': 1, 'M': 60, 'H': 3600, 'D': 86400, 'W': 604800}
+    text = theTime.strip()
+    if text and text[-1].upper() in units and text[:-1].isdigit():
+        return time.time() - int(text[:-1]) * units[text[-1].upper()]
+    for timeFormat in ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return time.mktime(time.strptime(text, timeFormat))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('Time is not a date (YYYY-MM-DD[THH:MM[:SS]]) or an age (e.g. 12h, 7d)!')
+#End ValidateTime =======================================
+
+
+def ValidateShard(theShard):
+    #
+    # Name: ValidateShard Function
+    #
+    # Desc: Function that will validate a shard given on the command
+    # line as I/N, the I-th of N shards counting from 1 e.g. 2/4
+    # Used for argument validation only
+    #
+    # Input: a shard string
+    #
+    # Actions:
+    # if valid it will return (0 based shard index, shard count)
+    # if invalid it will raise an ArgumentTypeError within argparse
+    #
+    try:
+        index, count = [int(part) for part in theShard.strip().split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Shard is not of the form I/N e.g. 2/4!')
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError('Shard must be between 1/N and N/N!')
+    return index - 1, count
+#End ValidateShard ======================================
+
+
+def BenchmarkHashes(hashTypes, chunkSize=DEFAULT_CHUNK_SIZE, totalBytes=256 * 1024 * 1024):
+    #
+    # Name: BenchmarkHashes() Function
+    #
+    # Desc: Measures the cost of each hash algorithm on this machine
+    # by hashing an in-memory buffer, so disk speed does not skew it
+    #
+    # Input: hashTypes = list of report names of the algorithms
+    #        chunkSize = size of each update() call
+    #        totalBytes = amount of data to push through each algorithm
+    #
+    # Actions:
+    # returns a list of (hashType, seconds, MB per second) tuples
+    #
+    view = memoryview(os.urandom(chunkSize))
+    rounds = max(1, totalBytes // chunkSize)
+    results = []
+    for hashType in hashTypes:
+        hash = NewHash(hashType)
+        update = hash.update
+        startTime = time.perf_counter()
+        for i in range(rounds):
+            update(view)
+        hash.digest()
+        duration = time.perf_counter() - startTime
+        megaBytes = rounds * chunkSize / (1024.0 * 1024.0)
+        results.append((hashType, duration, megaBytes / duration if duration else 0.0))
+    return results
+#End BenchmarkHashes ====================================
+
+
+class _HashEngine:
+    #
+    # Class: _HashEngine
+    #
+    # Desc: Streams an open file through one or more hash objects using
+    # one preallocated read buffer. Each chunk is read straight into the
+    # buffer with readinto() and the same memoryview is handed to every
+    # selected hash, so the file is read once, no copy is made and memory
+    # use stays the same whatever the size of the file.
+    # Sparse files are walked extent by extent with SEEK_DATA/SEEK_HOLE,
+    # holes are fed to the hashes from a shared zero buffer instead of
+    # being read, giving the same digest as a full read
+    #
+    # With a blockSize the first hash type is also computed for every
+    # block of the file, from the same read, for piecewise hashing.
+    # With a _governor._ReadGovernor every read is throttled and the
+    # kernel is advised how the file is being read. The seconds spent
+    # reading and hashing are added up in readSeconds and hashSeconds.
+    # A _segments._SegmentHasher is kept for ScanFile(), which hands it
+    # the files large enough to be hashed in segments.
+    # With an mmapThreshold, local regular files of that size or more
+    # are hashed from a read only memory map: each hash is handed slices
+    # of the mapped page cache, so no byte is copied into the read
+    # buffer. Files on network file systems, and files that cannot be
+    # mapped, are read as usual. The bytes hashed this way are added up
+    # in mappedBytes
+    #
+    # Methods:
+    # constructor: Allocates the reusable read and zero buffers
+    # hashFile: Hashes an open binary file and returns the hex digests
+    # hashStream: Hashes a file like object with no descriptor, such as
+    #             an archive member, and returns the hex digests
+    # hashThrough: Hashes an open binary file while another reader, such
+    #              as an archive decompressor, reads the same bytes
+    #
+    def __init__(self, hashTypes, chunkSize=DEFAULT_CHUNK_SIZE, blockSize=None, governor=None, segmenter=None,
+                 mmapThreshold=None):
+        # fail early on an unknown algorithm
+        for hashType in hashTypes:
+            NewHash(hashType)
+        self.hashTypes = list(hashTypes)
+        self.chunkSize = chunkSize
+        self.blockSize = blockSize
+        self.governor = governor
+        self.segmenter = segmenter
+        self.mmapThreshold = mmapThreshold
+        self.buffer = bytearray(chunkSize)
+        self.view = memoryview(self.buffer)
+        self.zeros = None
+        self.readSeconds = 0.0
+        self.hashSeconds = 0.0
+        self.mappedBytes = 0
+
+    def hashFile(self, f, st=None, blocks=None):
+        # f should be opened unbuffered ('rb', buffering=0) so that
+        # readinto() fills our buffer directly from the kernel.
+        # st is the file's stat result, when it shows fewer allocated
+        # blocks than the size needs the file is hashed as sparse.
+        # When a blocks list is given and the engine has a block size,
+        # the raw block digests are appended to it.
+        # Returns one hex digest per hash type, in the same order
+        hashList = [NewHash(hashType) for hashType in self.hashTypes]
+        updates = [hash.update for hash in hashList]
+        blockHasher = None
+        if blocks is not None and self.blockSize:
+            blockHasher = _pieceHash._BlockHasher(self.blockSize, self.hashTypes[0])
+            updates.append(blockHasher.feed)
+        governor = self.governor
+        if governor is not None:
+            governor.opened(f.fileno())
+        if st is not None and SPARSE_SUPPORTED and AllocatedSize(st) < st.st_size:
+            self._hashSparse(f, st.st_size, updates)
+        elif self._mappable(st):
+            self._hashMapped(f, updates)
+        else:
+            self._hashRange(f, updates)
+        if governor is not None:
+            governor.finished(f.fileno())
+        if blockHasher is not None:
+            blocks.extend(blockHasher.finish())
+        return [hash.hexdigest() for hash in hashList]
+
+    def hashStream(self, f, feed=None, charged=True):
+        # f only needs readinto(), it is read to its end with the same
+        # buffer. feed, when given, is called with every chunk as well.
+        # Without charged the reads are not charged to the governor, for
+        # a stream such as a decompressor whose bytes on disk were
+        # already charged by whatever read them
+        hashList = [NewHash(hashType) for hashType in self.hashTypes]
+        updates = [hash.update for hash in hashList]
+        if feed is not None:
+            updates.append(feed)
+        self._hashRange(f, updates, charged=charged)
+        return [hash.hexdigest() for hash in hashList]
+
+    def hashThrough(self, f, consume, blocks=None):
+        # hashes f as hashFile() would while consume(reader) reads it
+        # through a buffered reader, so a file whose contents are also
+        # parsed is read from disk once. Whatever consume leaves unread
+        # is hashed afterwards. A read error on f is raised here even
+        # when consume caught it. Returns (hex digests, what consume
+        # returned)
+        hashList = [NewHash(hashType) for hashType in self.hashTypes]
+        updates = [hash.update for hash in hashList]
+        blockHasher = None
+        if blocks is not None and self.blockSize:
+            blockHasher = _pieceHash._BlockHasher(self.blockSize, self.hashTypes[0])
+            updates.append(blockHasher.feed)
+        governor = self.governor
+        if governor is not None:
+            governor.opened(f.fileno())
+        hashedReader = _HashedReader(f, updates, governor)
+        try:
+            result = consume(io.BufferedReader(hashedReader, self.chunkSize))
+            if hashedReader.error is None:
+                while hashedReader.readinto(self.view):
+                    pass
+        finally:
+            self.readSeconds += hashedReader.readSeconds
+            self.hashSeconds += hashedReader.hashSeconds
+        if hashedReader.error is not None:
+            raise hashedReader.error
+        if governor is not None:
+            governor.finished(f.fileno())
+        if blockHasher is not None:
+            blocks.extend(blockHasher.finish())
+        return [hash.hexdigest() for hash in hashList], result
+
+    def _hashRange(self, f, updates, length=None, charged=True):
+        # reads from the current position to end of file, or for
+        # length bytes, and feeds every chunk to each hash. With charged
+        # every read is charged to the governor
+        view = self.view
+        readinto = f.readinto
+        charge = self.governor.charge if charged and self.governor is not None else None
+        perf = time.perf_counter
+        readSeconds = 0.0
+        hashSeconds = 0.0
+        try:
+            while length is None or length > 0:
+                startTime = perf()
+                if length is None or length >= self.chunkSize:
+                    bytesRead = readinto(view)
+                else:
+                    bytesRead = readinto(view[:length])
+                readTime = perf()
+                readSeconds += readTime - startTime
+                if charge is not None:
+                    charge(bytesRead or 0)
+                if not bytesRead:
+                    break
+                chunk = view if bytesRead == self.chunkSize else view[:bytesRead]
+                for update in updates:
+                    update(chunk)
+                hashSeconds += perf() - readTime
+                if length is not None:
+                    length -= bytesRead
+        finally:
+            self.readSeconds += readSeconds
+            self.hashSeconds += hashSeconds
+
+    def _mappable(self, st):
+        return (self.mmapThreshold is not None and st is not None and stat.S_ISREG(st.st_mode)
+                and st.st_size >= self.mmapThreshold and FileSystemType(st) not in NETWORK_FILE_SYSTEMS)
+
+    def _hashMapped(self, f, updates):
+        # maps the file one MMAP_WINDOW at a time and feeds chunkSize
+        # slices of each window to every hash. Should a window fail to
+        # map, the rest of the file is read instead
+        fd = f.fileno()
+        size = os.fstat(fd).st_size
+        chunkSize = self.chunkSize
+        charge = self.governor.charge if self.governor is not None else None
+        perf = time.perf_counter
+        position = 0
+        while position < size:
+            length = min(MMAP_WINDOW, size - position)
+            try:
+                mapping = mmap.mmap(fd, length, access=mmap.ACCESS_READ, offset=position)
+            except (OSError, ValueError):
+                break
+            startTime = perf()
+            try:
+                if MADV_SEQUENTIAL is not None:
+                    mapping.madvise(MADV_SEQUENTIAL)
+                # every view is released before the window is unmapped
+                with memoryview(mapping) as view:
+                    for start in range(0, length, chunkSize):
+                        with view[start:start + chunkSize] as chunk:
+                            for update in updates:
+                                update(chunk)
+                            if charge is not None:
+                                charge(len(chunk))
+            finally:
+                mapping.close()
+                # page faults happen inside update(), so it is all hashing
+                self.hashSeconds += perf() - startTime
+            position += length
+            self.mappedBytes += length
+        # read whatever was not mapped, and anything appended since
+        f.seek(position)
+        self._hashRange(f, updates)
+
+    def _hashZeros(self, updates, length):
+        # feeds length zero bytes to each hash without reading them
+        if self.zeros is None:
+            self.zeros = memoryview(bytes(self.chunkSize))
+        startTime = time.perf_counter()
+        while length > 0:
+            chunk = self.zeros if length >= self.chunkSize else self.zeros[:length]
+            for update in updates:
+                update(chunk)
+            length -= len(chunk)
+        self.hashSeconds += time.perf_counter() - startTime
+
+    def _hashSparse(self, f, size, updates):
+        fd = f.fileno()
+        position = 0
+        while position < size:
+            try:
+                dataStart = os.lseek(fd, position, os.SEEK_DATA)
+            except OSError as err:
+                if err.errno != errno.ENXIO:
+                    raise
+                # no more data, the rest of the file is a hole
+                dataStart = size
+            dataStart = min(dataStart, size)
+            self._hashZeros(updates, dataStart - position)
+            if dataStart >= size:
+                break
+            dataEnd = min(os.lseek(fd, dataStart, os.SEEK_HOLE), size)
+            f.seek(dataStart)
+            self._hashRange(f, updates, dataEnd - dataStart)
+            position = dataEnd
+        # pick up anything appended since the file was stat'ed
+        f.seek(size)
+        self._hashRange(f, updates)
+
+#End _HashEngine ========================================
+
+
+class _HashedReader(io.RawIOBase):
+    #
+    # Class: _HashedReader
+    #
+    # Desc: Raw reader over an open file that hands every chunk it reads
+    # to a list of hash updates, for _HashEngine.hashThrough(). Whoever
+    # reads through it sees the file unchanged, while the hashes see each
+    # byte once in file order. The first read error is kept in error, so
+    # it still fails the file when the reader's caller catches it
+    #
+    # Methods:
+    # constructor: Takes the open file, the updates and the governor
+    # readinto: Reads from the file into a buffer and hashes the bytes
+    #
+    def __init__(self, f, updates, governor=None):
+        super().__init__()
+        self.f = f
+        self.updates = updates
+        self.charge = governor.charge if governor is not None else None
+        self.error = None
+        self.readSeconds = 0.0
+        self.hashSeconds = 0.0
+
+    def readable(self):
+        return True
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def readinto(self, buffer):
+        startTime = time.perf_counter()
+        try:
+            bytesRead = self.f.readinto(buffer)
+        except (IOError, OSError) as err:
+            self.error = err
+            raise
+        readTime = time.perf_counter()
+        self.readSeconds += readTime - startTime
+        if self.charge is not None:
+            self.charge(bytesRead or 0)
+        if bytesRead:
+            with memoryview(buffer) as view:
+                chunk = view[:bytesRead]
+                for update in self.updates:
+                    update(chunk)
+                chunk.release()
+        self.hashSeconds += time.perf_counter() - readTime
+        return bytesRead
+
+#End _HashedReader ======================================
+
+
+def AllocatedSize(st):
+    #
+    # Name: AllocatedSize() Function
+    #
+    # Desc: Returns the bytes actually allocated on disk for a file,
+    # which is less than its logical size for a sparse file. Falls back
+    # to the logical size where st_blocks is not available (Windows)
+    #
+    # Input: st = os.stat_result of the file
+    #
+    blocks = getattr(st, 'st_blocks', None)
+    if blocks is None:
+        return st.st_size
+    return blocks * 512
+#End AllocatedSize ======================================
+
+
+# Characters the kernel escapes in a mount point, backslash last
+MOUNT_ESCAPES = (('\\040', ' '), ('\\011', '\t'), ('\\012', '\n'), ('\\134', '\\'))
+
+# device number to (file system type, mount point), read once from
+# /proc/self/mountinfo
+_mountTable = None
+
+def _MountTable():
+    # the first mount of each device wins, a bind mount of it later
+    # in the table names the same file system
+    global _mountTable
+    if _mountTable is None:
+        mountTable = {}
+        try:
+            with open('/proc/self/mountinfo') as mountInfo:
+                for line in mountInfo:
+                    # major:minor is the third field, the mount point the
+                    # fifth and the type follows the - separator
+                    fields = line.split()
+                    major, minor = fields[2].split(':')
+                    mountPoint = fields[4]
+                    for escape, character in MOUNT_ESCAPES:
+                        mountPoint = mountPoint.replace(escape, character)
+                    mountTable.setdefault(os.makedev(int(major), int(minor)),
+                                          (fields[fields.index('-') + 1], mountPoint))
+        except (OSError, ValueError, IndexError):
+            pass
+        _mountTable = mountTable
+    return _mountTable
+
+
+def FileSystemType(st):
+    #
+    # Name: FileSystemType() Function
+    #
+    # Desc: Returns the type of the file system holding a file, such as
+    # ext4 or nfs4, from its device number and the mount table, or None
+    # where that cannot be told (a platform without /proc, a device
+    # mounted after the first call)
+    #
+    # Input: st = os.stat_result of the file
+    #
+    mount = _MountTable().get(st.st_dev)
+    return mount[0] if mount is not None else None
+#End FileSystemType =====================================
+
+
+def MountPoint(st):
+    #
+    # Name: MountPoint() Function
+    #
+    # Desc: Returns where the file system holding a file is mounted,
+    # from its device number and the mount table, so no path is
+    # stat'ed. Where the mount table cannot tell, the device number
+    # is returned as major:minor
+    #
+    # Input: st = os.stat_result of the file
+    #
+    mount = _MountTable().get(st.st_dev)
+    if mount is None:
+        return 'device %d:%d' % (os.major(st.st_dev), os.minor(st.st_dev))
+    return mount[1]
+#End MountPoint =========================================
+
+
+def WalkFiles(rootPath, resumeAfter=None, walkFilter=None, phases=None):
+    #
+    # Name: WalkFiles() Function
+    #
+    # Desc: Walks the directory structure starting at rootPath with
+    # os.scandir and yields every non-directory entry found. The entry
+    # type comes from the directory listing itself and each entry is
+    # stat'ed relative to an open directory descriptor, so a file costs
+    # one short fstatat() rather than several full path lookups.
+    # Directories and files are visited in sorted order so two scans
+    # of the same tree report the same order
+    #
+    # Input: rootPath = directory to start from
+    #        resumeAfter = path of the last file already handled by an
+    #                      interrupted scan, the walk skips every file
+    #                      up to it and every directory before it
+    #        walkFilter = optional _filters._WalkFilter, pruned
+    #                     directories are never listed and filtered
+    #                     files are never yielded, both decided from
+    #                     the names and stat data the walk already has
+    #        phases = optional dictionary, the seconds spent stat'ing
+    #                 files are added to its 'stat' entry
+    #
+    # Actions:
+    # yields (full path, simple file name, lstat result) tuples, the
+    # lstat result is None if the entry vanished before it was stat'ed
+    #
+    resumeKey = WalkOrderKey(resumeAfter) if resumeAfter else None
+    useDirFd = os.scandir in os.supports_fd
+    rootDevice = walkFilter.rootDevice if walkFilter is not None else None
+    pending = [(rootPath, 0)]
+    while pending:
+        directory, depth = pending.pop()
+        try:
+            if useDirFd:
+                dirFd = os.open(directory, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+                try:
+                    if rootDevice is not None and os.fstat(dirFd).st_dev != rootDevice:
+                        walkFilter.directoriesPruned += 1
+                        continue
+                    entries = ScanDirectory(os.scandir(dirFd), phases)
+                finally:
+                    os.close(dirFd)
+            else:
+                if rootDevice is not None and os.stat(directory).st_dev != rootDevice:
+                    walkFilter.directoriesPruned += 1
+                    continue
+                entries = ScanDirectory(os.scandir(directory), phases)
+        except OSError:
+            # unreadable directories are skipped, as os.walk() does
+            continue
+        subDirs = []
+        for name, isDir, st in entries:
+            if isDir:
+                subDir = os.path.join(directory, name)
+                if walkFilter is None or walkFilter.keepDirectory(subDir, name, depth + 1):
+                    subDirs.append((subDir, depth + 1))
+                continue
+            theFile = os.path.join(directory, name)
+            if walkFilter is not None and not walkFilter.keepFile(theFile, name, st):
+                continue
+            if resumeKey is not None:
+                if WalkOrderKey(theFile) <= resumeKey:
+                    continue
+                # the walk order is monotonic, everything from here on is new
+                resumeKey = None
+            yield theFile, name, st
+        if resumeKey is not None:
+            # drop sub-directories that lie wholly before the resume point
+            subDirs = [subDir for subDir in subDirs if not _DirectoryBefore(subDir[0], resumeKey)]
+        # visit sub-directories in sorted order, depth first
+        pending.extend(reversed(subDirs))
+
+
+def WalkOrderKey(theFile, members=False):
+    # Sort key that puts file paths in the order WalkFiles() yields
+    # them, the files of a directory by name first, then each
+    # sub-directory by name. With members, an archive member path
+    # sorts right after its archive, members by path
+    member = None
+    if members and MEMBER_SEPARATOR in theFile:
+        theFile, member = theFile.split(MEMBER_SEPARATOR, 1)
+    parts = theFile.split(os.sep)
+    key = [(1, part) for part in parts[:-1]] + [(0, parts[-1])]
+    if member is not None:
+        key.append((2, member))
+    return key
+
+
+def _DirectoryBefore(directory, fileKey):
+    # True when every file below directory sorts before fileKey
+    dirKey = [(1, part) for part in directory.split(os.sep)]
+    return fileKey[:len(dirKey)] != dirKey and dirKey < fileKey
+
+
+def ScanDirectory(iterator, phases=None):
+    # Reads one os.scandir() listing and returns sorted
+    # (name, is directory, lstat result) tuples. Files are stat'ed
+    # here, while the directory descriptor is still open
+    entries = []
+    perf = time.perf_counter
+    statSeconds = 0.0
+    with iterator:
+        for entry in iterator:
+            try:
+                isDir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                isDir = False
+            st = None
+            if not isDir:
+                startTime = perf()
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    pass
+                statSeconds += perf() - startTime
+            entries.append((entry.name, isDir, st))
+    entries.sort()
+    if phases is not None:
+        phases['stat'] += statSeconds
+    return entries
+#End WalkFiles ==========================================
+
+
+def LinkGroup(st):
+    #
+    # Name: LinkGroup() Function
+    #
+    # Desc: Names the hardlink group of a file as device:inode, every
+    # link to the same inode gets the same name. Files with a single
+    # link are not in a group and get an empty string
+    #
+    # Input: st = os.stat_result of the file
+    #
+    if st.st_nlink > 1:
+        return str(st.st_dev) +':'+ str(st.st_ino)
+    return ''
+#End LinkGroup ==========================================
+
+
+class _LinkTracker:
+    #
+    # Class: _LinkTracker
+    #
+    # Desc: Remembers the digests of files with more than one hardlink,
+    # keyed on (device, inode), so every further link to the inode is
+    # reported with those digests instead of being read and hashed again
+    #
+    # Methods:
+    # constructor: Initializes the map and counters
+    # repeated: True when another link to this inode was already seen
+    # remember: Records the digests of the first link that was hashed
+    # alias: Returns a FileRecord reusing the first link's digests or None
+    #
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seen = set()
+        self.groups = {}
+        self.reused = 0
+        self.bytesSaved = 0
+
+    def repeated(self, st):
+        if st is None or st.st_nlink < 2 or not stat.S_ISREG(st.st_mode):
+            return False
+        key = (st.st_dev, st.st_ino)
+        with self.lock:
+            if key in self.seen:
+                return True
+            self.seen.add(key)
+            return False
+
+    def remember(self, record):
+        st = record.stat
+        if st.st_nlink > 1 and record.linkOf is None:
+            with self.lock:
+                self.groups.setdefault((st.st_dev, st.st_ino), (record.path, record.hashValues))
+
+    def alias(self, theFile, simpleName, st):
+        if st.st_nlink < 2:
+            return None
+        with self.lock:
+            first = self.groups.get((st.st_dev, st.st_ino))
+            if first is None:
+                return None
+            self.reused += 1
+            self.bytesSaved += st.st_size
+        return FileRecord(theFile, simpleName, st, first[1], None, first[0])
+
+#End _LinkTracker =======================================
+
+
+def ScanFile(theFile, simpleName, hashEngine, hashCache=None, st=None, linkTracker=None, archiveScanner=None):
+    #
+    # Name: ScanFile() Function
+    #
+    # Desc: Hashes a single file and extracts its metadata
+    #
+    # Inputs:
+    # theFile = the full path of the file
+    # simpleName = just the filename itself
+    # hashEngine = _HashEngine used to read and hash the file
+    # hashCache = optional _HashCache, unchanged files are not read
+    # st = lstat result from WalkFiles(), the file is lstat'ed if omitted
+    # linkTracker = optional _LinkTracker, a hardlink to an inode that
+    # was already hashed reuses its digests instead of being read
+    # archiveScanner = optional _archives._ArchiveScanner, the members
+    # of an archive are hashed too and returned in the record. A tar or
+    # gzip archive is opened from the read that hashes it, and its
+    # timings then include its members
+    #
+    # Actions:
+    # returns (FileRecord, None), or (None, message) when the file
+    # is skipped
+    #
+    # Verify that the path is valid
+    if st is None:
+        try:
+            st = os.lstat(theFile)
+        except OSError:
+            return None, repr(simpleName) +' is NOT an existing Path!'
+    # Verify that the path is not a symbolic link
+    if stat.S_ISLNK(st.st_mode):
+        return None, repr(simpleName) +' is a Link NOT a File!'
+    # Verify that the file is real
+    if not stat.S_ISREG(st.st_mode):
+        return None, repr(simpleName) +' is NOT a File!'
+    if linkTracker is not None:
+        record = linkTracker.alias(theFile, simpleName, st)
+        if record is not None:
+            return record, None
+    cachedValues = None
+    # a cache hit has no block digests, so piecewise scans read every file
+    if hashCache is not None and not hashEngine.blockSize:
+        # an unchanged file is answered from the cache, unless it was
+        # picked for verification in which case it is read again
+        cachedValues = hashCache.lookup(st, hashEngine.hashTypes)
+        if cachedValues is not None and not hashCache.sampled():
+            record = FileRecord(theFile, simpleName, st, cachedValues, _hashCache.CACHE_HIT)
+            if linkTracker is not None:
+                linkTracker.remember(record)
+            # members are not cached, so an archive is still opened
+            if archiveScanner is not None and archiveScanner.isArchive(simpleName):
+                record = record._replace(members=archiveScanner.scan(theFile, hashEngine))
+            return record, None
+    startTime = time.perf_counter()
+    try:
+        # Attempt to open the file, unbuffered so reads go
+        # straight into the hash engine's buffer
+        f = open(theFile, 'rb', buffering=0)
+    except IOError:
+        return None, 'Open Failed:'+ theFile
+    openTime = time.perf_counter() - startTime
+    readSeconds = hashEngine.readSeconds
+    hashSeconds = hashEngine.hashSeconds
+    try:
+        # the file as it was before the read, to tell if it changed during it
+        openSt = os.fstat(f.fileno())
+        # Attempt to read and hash the file chunk by chunk
+        blocks = [] if hashEngine.blockSize else None
+        segments = None
+        members = None
+        if hashEngine.segmenter is not None and hashEngine.segmenter.wants(st):
+            hashValues, segments = hashEngine.segmenter.hashFile(f, st, hashEngine, blocks)
+        elif archiveScanner is not None and archiveScanner.streams(simpleName):
+            hashValues, members = hashEngine.hashThrough(
+                f, lambda reader: archiveScanner.scan(theFile, hashEngine, reader), blocks)
+        else:
+            hashValues = hashEngine.hashFile(f, st, blocks)
+        # On read success, obtain the file's stats
+        st = os.fstat(f.fileno())
+    except IOError:
+        return None, 'Read Failed:'+ theFile
+    finally:
+        f.close()
+    timings = (openTime, hashEngine.readSeconds - readSeconds, hashEngine.hashSeconds - hashSeconds,
+               time.perf_counter() - startTime)
+    cacheStatus = None
+    if not _hashCache.Unchanged(openSt, st):
+        # the digests may cover a mix of old and new contents
+        cacheStatus = _hashCache.CACHE_CHANGED
+    # a tree digest cannot be checked against the cached serial one
+    elif cachedValues is not None and (segments is None or segments.serial is not None):
+        if cachedValues == hashValues:
+            cacheStatus = _hashCache.CACHE_VERIFIED
+        else:
+            cacheStatus = _hashCache.CACHE_MISMATCH
+    record = FileRecord(theFile, simpleName, st, hashValues, cacheStatus, timings=timings, segments=segments)
+    if blocks is not None:
+        record = record._replace(blocks=b''.join(blocks),
+                                 merkleRoot=_pieceHash.MerkleRoot(blocks, hashEngine.hashTypes[0]))
+    if linkTracker is not None:
+        linkTracker.remember(record)
+    if members is None and archiveScanner is not None and archiveScanner.isArchive(simpleName):
+        members = archiveScanner.scan(theFile, hashEngine)
+    if members is not None:
+        record = record._replace(members=members)
+    return record, None
+#End ScanFile ===========================================
+
+
+def FormatRow(record, rawTimes=False):
+    #
+    # Name: FormatRow() Function
+    #
+    # Desc: Converts a FileRecord into the report values
+    #
+    # Input: record = FileRecord returned by ScanFile()
+    #        rawTimes = give the times as integer nanoseconds since the
+    #                   epoch instead of time.ctime() text
+    #
+    # Actions:
+    # returns the values in report column order, with the digests
+    # as one list
+    #
+    st = record.stat
+    if rawTimes:
+        times = (str(st.st_mtime_ns), str(st.st_atime_ns), str(st.st_ctime_ns))
+    else:
+        times = (time.ctime(st.st_mtime), time.ctime(st.st_atime), time.ctime(st.st_ctime))
+    return (record.name, record.path, str(st.st_size), str(AllocatedSize(st))) + times + (
+            record.hashValues, str(st.st_uid), str(st.st_gid), bin(st.st_mode),
+            str(st.st_nlink), LinkGroup(st), record.linkOf or '',
+            record.merkleRoot.hex() if record.merkleRoot else '')
+#End FormatRow ==========================================
+
+
+# hash engine owned by each pool worker process
+_workerEngine = None
+
+_workerCache = None
+
+_workerArchives = None
+
+def _InitWorker(hashTypes, chunkSize, hashCache, blockSize, governor, archiveScanner, mmapThreshold):
+    # runs once in each pool worker, so every worker allocates
+    # its own read buffer exactly once
+    global _workerEngine
+    global _workerCache
+    global _workerArchives
+    _workerEngine = _HashEngine(hashTypes, chunkSize, blockSize, governor, None, mmapThreshold)
+    _workerCache = hashCache
+    _workerArchives = archiveScanner
+
+def _ScanBatch(batch):
+    # runs in a pool worker, hashes a batch of WalkFiles() entries
+    return [ScanFile(theFile, simpleName, _workerEngine, _workerCache, st, None, _workerArchives)
+            for theFile, simpleName, st in batch]
+
+
+# marks an entry _OrderedResults() scans itself instead of the pool
+_IN_PLACE = object()
+
+def _OrderedResults(pool, task, fileList, batchFiles, maxInFlight, linkTracker=None, inPlace=None):
+    # Submits fileList to pool in batches of batchFiles and yields
+    # (full path, record, message) in the order of fileList. At most
+    # maxInFlight batches are queued, the oldest is waited on first.
+    # A repeat hardlink is not sent to the pool, it is queued in place
+    # and given the digests of the first link when its turn comes.
+    # inPlace, when given, is (wants, scan): an entry whose lstat result
+    # wants() accepts is also queued in place, and scanned with
+    # scan(theFile, simpleName, st) in this process when its turn comes
+    pending = collections.deque()
+
+    def Collect():
+        batch, future = pending.popleft()
+        if future is _IN_PLACE:
+            theFile, simpleName, st = batch
+            record, message = inPlace[1](theFile, simpleName, st)
+            if linkTracker is not None and record is not None:
+                linkTracker.remember(record)
+            yield theFile, record, message
+            return
+        if future is None:
+            # a repeat hardlink, the first link was reported before it
+            theFile, simpleName, st = batch
+            record = linkTracker.alias(theFile, simpleName, st)
+            if record is not None:
+                yield theFile, record, None
+                return
+            # the first link could not be hashed, so hash this one
+            future = pool.submit(task, [batch])
+            batch = [batch]
+        for (theFile, simpleName, st), (record, message) in zip(batch, future.result()):
+            if linkTracker is not None and record is not None:
+                linkTracker.remember(record)
+            yield theFile, record, message
+
+    batch = []
+    for entry in fileList:
+        if linkTracker is not None and linkTracker.repeated(entry[2]):
+            if batch:
+                pending.append((batch, pool.submit(task, batch)))
+                batch = []
+            pending.append((entry, None))
+        elif inPlace is not None and inPlace[0](entry[2]):
+            if batch:
+                pending.append((batch, pool.submit(task, batch)))
+                batch = []
+            pending.append((entry, _IN_PLACE))
+        else:
+            batch.append(entry)
+            if len(batch) == batchFiles:
+                pending.append((batch, pool.submit(task, batch)))
+                batch = []
+        # backpressure, wait on the oldest batch before walking further
+        while len(pending) >= maxInFlight:
+            yield from Collect()
+    if batch:
+        pending.append((batch, pool.submit(task, batch)))
+    while pending:
+        yield from Collect()
+
+
+def SequentialScan(fileList, hashEngine, hashCache=None, linkTracker=None, archiveScanner=None):
+    # Hashes files one at a time in this process, for callers that want
+    # the same results iterator ParallelScan() and ThreadedScan() give.
+    # yields (full path, record, message) in the order of fileList
+    for theFile, simpleName, st in fileList:
+        record, message = ScanFile(theFile, simpleName, hashEngine, hashCache, st, linkTracker, archiveScanner)
+        yield theFile, record, message
+
+
+def ParallelScan(fileList, workers, hashTypes, chunkSize=DEFAULT_CHUNK_SIZE, hashCache=None, linkTracker=None,
+                 blockSize=None, governor=None, archiveScanner=None, segmenter=None, mmapThreshold=None):
+    #
+    # Name: ParallelScan() Function
+    #
+    # Desc: Hashes files on a pool of worker processes while the
+    # caller writes the report from this process
+    #
+    # Inputs:
+    # fileList = iterable of WalkFiles() entries
+    # workers = number of hashing processes
+    # hashTypes, chunkSize = passed to each worker's _HashEngine
+    # hashCache = optional _HashCache, each worker opens it read only
+    # linkTracker = optional _LinkTracker, each inode is hashed once
+    # blockSize = piecewise block size, None for whole file digests only
+    # governor = optional _ReadGovernor, its limits hold over all of
+    #            the workers together
+    # archiveScanner = optional _archives._ArchiveScanner, archives are
+    #                  opened and their members hashed on the workers
+    # segmenter = optional _segments._SegmentHasher, the files it wants
+    #             are hashed from this process on its own pool, which
+    #             already spreads one file over every core
+    # mmapThreshold = size from which files are hashed from a memory map
+    #
+    # Actions:
+    # Files are sent to the pool in batches. Only a bounded number of
+    # batches are in flight, so the walk never runs far ahead of the
+    # writer. Results are yielded in the order of fileList, not the
+    # order they complete, so the report is the same on every run.
+    # yields (full path, record, message) as ScanFile() would return
+    #
+    inPlace = None
+    if segmenter is not None:
+        engine = _HashEngine(hashTypes, chunkSize, blockSize, None, segmenter, mmapThreshold)
+        inPlace = (segmenter.wants, lambda theFile, simpleName, st: ScanFile(theFile, simpleName, engine, hashCache,
+                                                                             st, None, archiveScanner))
+    if governor is not None:
+        governor = governor.forProcesses()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_InitWorker,
+                                                initargs=(list(hashTypes), chunkSize, hashCache, blockSize,
+                                                          governor, archiveScanner, mmapThreshold)) as pool:
+        yield from _OrderedResults(pool, _ScanBatch, fileList, PARALLEL_BATCH_FILES,
+                                   workers * PARALLEL_TASKS_PER_WORKER, linkTracker, inPlace)
+#End ParallelScan =======================================
+
+
+class _ShareStats:
+    #
+    # Class: _ShareStats
+    #
+    # Desc: Collects per-share throughput for threaded scans. A share
+    # is the mount point a file lives on, found from the device number
+    # already in its stat result, so each NFS/SMB mount gets its own
+    # files per second and bytes per second figures without a further
+    # round trip to the server
+    #
+    # Methods:
+    # constructor: Initializes the counters
+    # record: Adds one file that was read, safe to call from any thread
+    # summary: Returns one line of figures per share
+    #
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.shares = {}
+
+    def record(self, st, bytesRead, startTime, endTime):
+        share = MountPoint(st)
+        with self.lock:
+            entry = self.shares.get(share)
+            if entry is None:
+                # files, bytes, first start, last end
+                entry = self.shares[share] = [0, 0, startTime, endTime]
+            entry[0] += 1
+            entry[1] += bytesRead
+            entry[2] = min(entry[2], startTime)
+            entry[3] = max(entry[3], endTime)
+
+    def summary(self):
+        lines = []
+        for share in sorted(self.shares):
+            files, bytesRead, firstStart, lastEnd = self.shares[share]
+            duration = max(lastEnd - firstStart, 1e-9)
+            lines.append('%s: %d files, %d bytes, %.1f files/s, %.2f MB/s'
+                         % (share, files, bytesRead, files / duration, bytesRead / duration / (1024.0 * 1024.0)))
+        return lines
+
+#End _ShareStats ========================================
+
+
+def ThreadedScan(fileList, threads, hashTypes, chunkSize=DEFAULT_CHUNK_SIZE, shareStats=None, hashCache=None,
+                 linkTracker=None, blockSize=None, governor=None, archiveScanner=None, segmenter=None,
+                 mmapThreshold=None):
+    #
+    # Name: ThreadedScan() Function
+    #
+    # Desc: Hashes files on a pool of threads so that many opens and
+    # reads are waiting on the storage at the same time. Meant for
+    # network mounts holding many small files, where the time goes on
+    # round trips rather than hashing. hashlib releases the GIL while
+    # hashing large buffers so threads are enough
+    #
+    # Inputs:
+    # fileList = iterable of WalkFiles() entries
+    # threads = number of opens and reads kept in flight
+    # hashTypes, chunkSize = passed to each thread's _HashEngine
+    # shareStats = optional _ShareStats to collect throughput in
+    # hashCache = optional _HashCache shared by the threads
+    # linkTracker = optional _LinkTracker, each inode is hashed once
+    # blockSize = piecewise block size, None for whole file digests only
+    # governor = optional _ReadGovernor, its limits are shared by all
+    #            of the threads
+    # archiveScanner = optional _archives._ArchiveScanner, archives are
+    #                  opened and their members hashed on the threads
+    # segmenter = optional _segments._SegmentHasher shared by the threads
+    # mmapThreshold = size from which files are hashed from a memory map
+    #
+    # Actions:
+    # yields (full path, record, message) in the order of fileList
+    #
+    local = threading.local()
+
+    def ScanThreadBatch(batch):
+        # each thread lazily allocates its own read buffer
+        engine = getattr(local, 'engine', None)
+        if engine is None:
+            engine = local.engine = _HashEngine(hashTypes, chunkSize, blockSize, governor, segmenter, mmapThreshold)
+        results = []
+        for theFile, simpleName, st in batch:
+            startTime = time.perf_counter()
+            record, message = ScanFile(theFile, simpleName, engine, hashCache, st, None, archiveScanner)
+            # cache hits and reused hardlinks were not read, so they
+            # would only inflate the share's throughput
+            if shareStats is not None and record is not None and record.timings is not None:
+                shareStats.record(record.stat, record.stat.st_size, startTime, time.perf_counter())
+            results.append((record, message))
+        return results
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        yield from _OrderedResults(pool, ScanThreadBatch, fileList, THREADED_BATCH_FILES,
+                                   threads * PARALLEL_TASKS_PER_WORKER, linkTracker)
+#End ThreadedScan =======================================
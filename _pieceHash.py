@@ -0,0 +1,386 @@
+
+# _pieceHash.py
+# Python One Way File System Hashing - piecewise block hashing
+# Author: L. Konate
+
+#################################################################
+# Block digests, Merkle roots and the binary block sidecar used by
+# hash.py and sys_file_hashing.py
+#
+# MerkleRoot() class _BlockHasher class _BlockWriter ReadBlockEntry()
+# MergeBlockFiles() ParseRanges() HashBlocks() VerifyBlocks()
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import shutil #Python Standard Library - High-level file operations
+import struct #Python Standard Library - Interpret bytes as packed binary data
+import hashlib #Python Standard Library - Secure hashes and message digests
+import concurrent.futures #Python Standard Library - Launching parallel tasks
+import _pfish # p-fish shared hashing engine
+
+# Default block size for piecewise hashing
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# Sidecar written next to fileSystemReport.csv and named after it,
+# fileSystemReport.blocks or fileSystemReport.shard1of4.blocks
+BLOCK_SUFFIX = '.blocks'
+
+# Sidecar layout, all integers little endian
+#   header: magic, block size, hash name length, hash name, digest size
+#   entry:  path length, file size, block count, path (os.fsencode),
+#           block digests, Merkle root
+# Version 1 sidecars held roots without domain separation, see
+# MerkleRoot(), and are refused rather than verified against
+BLOCK_MAGIC = b'PFBLOCK2'
+BLOCK_MAGIC_V1 = b'PFBLOCK1'
+HEADER_FORMAT = struct.Struct('<IB')
+ENTRY_FORMAT = struct.Struct('<IQQ')
+
+# Largest --block-size, the header holds it in 32 bits and
+# --verify-blocks holds a whole block in memory
+MAX_BLOCK_SIZE = 1024 ** 3
+
+# Merkle node prefixes, as in RFC 6962, so a leaf can never be taken
+# for an interior node
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+# Number of blocks checked by one verify task
+VERIFY_TASK_BLOCKS = 256
+
+
+def NewBlockHash(hashType):
+    # report names (MD5, SHA256, SHA3_256 ...) are hashlib names in upper case
+    return hashlib.new(hashType.lower())
+
+
+def MerkleRoot(digests, hashType):
+    #
+    # Name: MerkleRoot() Function
+    #
+    # Desc: Computes the Merkle root over a list of block digests. Each
+    # leaf is the hash of LEAF_PREFIX and a block digest, each level
+    # above hashes NODE_PREFIX and the concatenation of adjacent pairs,
+    # an odd node at the end of a level is carried up unchanged. The
+    # prefixes keep a root over several blocks from ever equalling the
+    # root of other data (the second preimage of RFC 6962), and carrying
+    # rather than duplicating the odd node keeps [a,b,c] and [a,b,c,c]
+    # apart. A file with no blocks has the digest of no data
+    #
+    # Input: digests = list of raw block digests in file order
+    #        hashType = report name of the algorithm
+    #
+    # Actions:
+    # returns the raw root digest
+    #
+    if not digests:
+        return NewBlockHash(hashType).digest()
+    level = []
+    for digest in digests:
+        leaf = NewBlockHash(hashType)
+        leaf.update(LEAF_PREFIX)
+        leaf.update(digest)
+        level.append(leaf.digest())
+    while len(level) > 1:
+        parents = []
+        for i in range(0, len(level) - 1, 2):
+            node = NewBlockHash(hashType)
+            node.update(NODE_PREFIX)
+            node.update(level[i])
+            node.update(level[i + 1])
+            parents.append(node.digest())
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+    return level[0]
+#End MerkleRoot =========================================
+
+
+class _BlockHasher:
+    #
+    # Class: _BlockHasher
+    #
+    # Desc: Splits the stream of chunks read by the hash engine at
+    # block boundaries and keeps one digest per block, so block digests
+    # come from the same single read as the whole file digests
+    #
+    # Methods:
+    # constructor: Starts the first block
+    # feed: Adds a chunk of file data
+    # finish: Closes the last partial block and returns the digests
+    #
+    def __init__(self, blockSize, hashType):
+        self.blockSize = blockSize
+        self.hashType = hashType
+        self.hash = NewBlockHash(hashType)
+        self.filled = 0
+        self.digests = []
+
+    def feed(self, chunk):
+        while len(chunk):
+            take = min(len(chunk), self.blockSize - self.filled)
+            self.hash.update(chunk[:take])
+            self.filled += take
+            chunk = chunk[take:]
+            if self.filled == self.blockSize:
+                self.digests.append(self.hash.digest())
+                self.hash = NewBlockHash(self.hashType)
+                self.filled = 0
+
+    def finish(self):
+        if self.filled:
+            self.digests.append(self.hash.digest())
+            self.filled = 0
+        return self.digests
+
+#End _BlockHasher =======================================
+
+
+class _BlockWriter:
+    #
+    # Class: _BlockWriter
+    #
+    # Desc: Writes the binary block sidecar, one entry per hashed file
+    #
+    # Methods:
+    # constructor: Creates the sidecar and writes its header
+    # writeEntry: Appends the block digests and root of one file
+    # writerClose: Closes the sidecar
+    #
+    def __init__(self, fileName, blockSize, hashType):
+        self.digestSize = NewBlockHash(hashType).digest_size
+        self.blockFile = open(fileName, 'wb')
+        name = hashType.encode('ascii')
+        self.blockFile.write(BLOCK_MAGIC + HEADER_FORMAT.pack(blockSize, len(name)) + name
+                             + struct.pack('<B', self.digestSize))
+
+    def writeEntry(self, theFile, size, blocks, root):
+        # blocks is the concatenation of the raw block digests
+        path = os.fsencode(theFile)
+        blockCount = len(blocks) // self.digestSize
+        self.blockFile.write(ENTRY_FORMAT.pack(len(path), size, blockCount) + path)
+        self.blockFile.write(blocks)
+        self.blockFile.write(root)
+
+    def writerClose(self):
+        self.blockFile.close()
+
+#End _BlockWriter =======================================
+
+
+def ReadBlockEntry(fileName, theFile):
+    #
+    # Name: ReadBlockEntry() Function
+    #
+    # Desc: Finds the entry of one file in a block sidecar. Entries are
+    # skipped over by their recorded lengths, so only the matching
+    # file's digests are loaded
+    #
+    # Input: fileName = the sidecar path
+    #        theFile = the file path as it was written to the report
+    #
+    # Actions:
+    # returns (hashType, blockSize, size, [digests], root) or None
+    #
+    wanted = os.fsencode(theFile)
+    with open(fileName, 'rb') as blockFile:
+        blockSize, hashType, digestSize = _ReadBlockHeader(blockFile, fileName)[1:]
+        while True:
+            header = blockFile.read(ENTRY_FORMAT.size)
+            if len(header) < ENTRY_FORMAT.size:
+                return None
+            pathLength, size, blockCount = ENTRY_FORMAT.unpack(header)
+            path = blockFile.read(pathLength)
+            if path != wanted:
+                blockFile.seek((blockCount + 1) * digestSize, os.SEEK_CUR)
+                continue
+            data = blockFile.read(blockCount * digestSize)
+            digests = [data[i:i + digestSize] for i in range(0, len(data), digestSize)]
+            root = blockFile.read(digestSize)
+            return hashType, blockSize, size, digests, root
+#End ReadBlockEntry =====================================
+
+
+def _ReadBlockHeader(blockFile, fileName):
+    # reads the sidecar header, returns (raw header, block size, hash
+    # name, digest size) and leaves blockFile at the first entry
+    magic = blockFile.read(len(BLOCK_MAGIC))
+    if magic == BLOCK_MAGIC_V1:
+        raise ValueError('Block sidecar written by an older p-fish, hash the files again with --piecewise: '+ fileName)
+    if magic != BLOCK_MAGIC:
+        raise ValueError('Not a block sidecar: '+ fileName)
+    fields = blockFile.read(HEADER_FORMAT.size)
+    blockSize, nameLength = HEADER_FORMAT.unpack(fields)
+    name = blockFile.read(nameLength)
+    digestSize = blockFile.read(1)
+    return magic + fields + name + digestSize, blockSize, name.decode('ascii'), struct.unpack('<B', digestSize)[0]
+
+
+def MergeBlockFiles(blockFiles, mergedFile):
+    #
+    # Name: MergeBlockFiles() Function
+    #
+    # Desc: Joins the block sidecars of a sharded scan into one. Their
+    # entries are copied as they are, in the order the sidecars are
+    # given, so where a path is in more than one ReadBlockEntry() finds
+    # the one of the first, as the merged report keeps its row
+    #
+    # Input: blockFiles = the sidecars of the partial reports
+    #        mergedFile = the sidecar to write
+    #
+    # Actions:
+    # raises ValueError when the sidecars differ in algorithm or block
+    # size
+    #
+    header = None
+    for blockFile in blockFiles:
+        with open(blockFile, 'rb') as sidecar:
+            partialHeader = _ReadBlockHeader(sidecar, blockFile)[0]
+        if header is not None and partialHeader != header:
+            raise ValueError('block sidecar has a different algorithm or block size: '+ blockFile)
+        header = partialHeader
+    with open(mergedFile, 'wb') as merged:
+        merged.write(header)
+        for blockFile in blockFiles:
+            with open(blockFile, 'rb') as sidecar:
+                sidecar.seek(len(header))
+                shutil.copyfileobj(sidecar, merged)
+#End MergeBlockFiles ====================================
+
+
+def ParseRanges(theRanges, size):
+    #
+    # Name: ParseRanges() Function
+    #
+    # Desc: Parses byte ranges such as "0-1G,5G-6G,10M" into
+    # (start, end) pairs, end exclusive. A single offset selects the
+    # block holding it. Offsets take the suffixes of _pfish.ParseSize()
+    #
+    # Input: theRanges = range string, empty or None means the whole file
+    #        size = file size used to clip the ranges
+    #
+    # Actions:
+    # returns the list of (start, end) pairs
+    # raises ValueError naming the part that is not a valid range
+    #
+    def Offset(text, part):
+        try:
+            offset = _pfish.ParseSize(text)
+        except ValueError:
+            raise ValueError('Invalid byte range: '+ repr(part))
+        if offset < 0:
+            raise ValueError('Invalid byte range: '+ repr(part))
+        return offset
+
+    if not theRanges:
+        return [(0, size)]
+    ranges = []
+    for part in theRanges.split(','):
+        if '-' in part:
+            start, end = part.split('-', 1)
+            start = Offset(start, part)
+            end = Offset(end, part)
+            if end <= start:
+                raise ValueError('Invalid byte range, the end is not after the start: '+ repr(part))
+            ranges.append((start, min(end, size)))
+        else:
+            start = Offset(part, part)
+            ranges.append((start, start + 1))
+    return ranges
+#End ParseRanges ========================================
+
+
+def HashBlocks(theFile, hashType, blockSize, firstBlock, lastBlock):
+    #
+    # Name: HashBlocks() Function
+    #
+    # Desc: Hashes blocks firstBlock up to lastBlock (exclusive) of a
+    # file with positioned reads, so many calls can run on one file at
+    # once in separate processes
+    #
+    # Actions:
+    # returns the list of raw block digests
+    #
+    digests = []
+    buffer = bytearray(blockSize)
+    view = memoryview(buffer)
+    fd = os.open(theFile, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        for block in range(firstBlock, lastBlock):
+            offset = block * blockSize
+            filled = 0
+            while filled < blockSize:
+                if hasattr(os, 'preadv'):
+                    # read straight into the buffer
+                    count = os.preadv(fd, [view[filled:]], offset + filled)
+                else:
+                    data = os.pread(fd, blockSize - filled, offset + filled)
+                    count = len(data)
+                    view[filled:filled + count] = data
+                if not count:
+                    break
+                filled += count
+            hash = NewBlockHash(hashType)
+            hash.update(view[:filled])
+            digests.append(hash.digest())
+    finally:
+        os.close(fd)
+    return digests
+#End HashBlocks =========================================
+
+
+def VerifyBlocks(theFile, entry, ranges, workers=1, reportedRoot=None):
+    #
+    # Name: VerifyBlocks() Function
+    #
+    # Desc: Re-hashes only the blocks covering the selected byte ranges
+    # and compares them against a sidecar entry. The entry's digests are
+    # first checked against its Merkle root, and against the root in the
+    # report when one is given, so an edited sidecar is refused rather
+    # than trusted. The blocks are split into runs that are checked in
+    # parallel worker processes
+    #
+    # Input: theFile = path of the file to check
+    #        entry = the ReadBlockEntry() result for it
+    #        ranges = (start, end) byte ranges from ParseRanges()
+    #        workers = number of processes
+    #        reportedRoot = hex Merkle root of the file in the report, if any
+    #
+    # Actions:
+    # returns (blocks checked, [mismatched block numbers])
+    # raises ValueError when the digests do not match the root
+    #
+    hashType, blockSize, size, digests, root = entry
+    if MerkleRoot(digests, hashType) != root:
+        raise ValueError('Sidecar entry does not match its Merkle root: '+ theFile)
+    if reportedRoot is not None and reportedRoot.lower() != root.hex():
+        raise ValueError('Sidecar entry does not match the Merkle root in the report: '+ theFile)
+    selected = set()
+    for start, end in ranges:
+        start = max(0, start)
+        end = min(end, size)
+        if end <= start:
+            continue
+        selected.update(range(start // blockSize, (end - 1) // blockSize + 1))
+    selected = sorted(block for block in selected if block < len(digests))
+    # group the selected blocks into contiguous runs of bounded length
+    runs = []
+    for block in selected:
+        if runs and runs[-1][1] == block and block - runs[-1][0] < VERIFY_TASK_BLOCKS:
+            runs[-1][1] = block + 1
+        else:
+            runs.append([block, block + 1])
+    bad = []
+    if workers > 1 and len(runs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [(first, pool.submit(HashBlocks, theFile, hashType, blockSize, first, last))
+                       for first, last in runs]
+            results = [(first, future.result()) for first, future in futures]
+    else:
+        results = [(first, HashBlocks(theFile, hashType, blockSize, first, last)) for first, last in runs]
+    for first, found in results:
+        for offset, digest in enumerate(found):
+            if digest != digests[first + offset]:
+                bad.append(first + offset)
+    return len(selected), bad
+#End VerifyBlocks =======================================
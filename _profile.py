@@ -0,0 +1,140 @@
+
+# _profile.py
+# Python One Way File System Hashing - profiling hooks
+# Author: L. Konate
+
+#################################################################
+# Opt-in profiling for hash.py, sys_file_hashing.py,
+# evidence_extraction.py and metageo.py: a cProfile of the run and
+# a trace of the files slower than a threshold
+#
+# ValidateMilliseconds() TimingDetail() class _Profiler class _SlowFileTracer
+#################################################################
+
+import io #Python Standard Library - Core tools for working with streams
+import pstats #Python Standard Library - Statistics for the Python profilers
+import cProfile #Python Standard Library - Deterministic profiler
+import argparse #Python Standard Library - Parser for commandline options, arguments
+
+# Profile files, named after the report they sit next to
+PROFILE_SUFFIX = '.pstats'
+PROFILE_SUMMARY_SUFFIX = '.profile.txt'
+
+# Functions listed in the summary, and on the console at the end
+DEFAULT_PROFILE_TOP = 25
+CONSOLE_PROFILE_TOP = 5
+
+
+def ValidateMilliseconds(theMilliseconds):
+    #
+    # Name: ValidateMilliseconds Function
+    #
+    # Desc: Function that will validate a time threshold in milliseconds
+    # given on the command line. Used for argument validation only
+    #
+    # Input: a millisecond string e.g. 250 or 12.5
+    #
+    # Actions:
+    # if valid it will return the threshold as a float
+    # if invalid it will raise an ArgumentTypeError within argparse
+    #
+    try:
+        milliseconds = float(theMilliseconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Milliseconds is not a number!')
+    if milliseconds < 0.0:
+        raise argparse.ArgumentTypeError('Milliseconds must not be negative!')
+    return milliseconds
+#End ValidateMilliseconds ===============================
+
+
+def TimingDetail(timings, size):
+    # the open, read and hash split of a FileRecord's timings, in
+    # milliseconds, for a slow file message
+    openTime, readTime, hashTime, totalTime = timings
+    return ' (open %.1f ms, read %.1f ms, hash %.1f ms, %d bytes)' % (openTime * 1000.0, readTime * 1000.0,
+                                                                      hashTime * 1000.0, size)
+
+
+class _Profiler:
+    #
+    # Class: _Profiler
+    #
+    # Desc: Runs cProfile over the part of a run between start() and
+    # stop(), then writes the raw statistics as a .pstats file, which
+    # python -m pstats or snakeviz can open, and a text summary of the
+    # top functions by cumulative time and by own time. cProfile sees
+    # the thread that started it, so with --workers or --threads the
+    # profile shows the walk, the ordering of results and the report
+    # writing, and the hashing shows up as time waiting on the pool
+    #
+    # Methods:
+    # constructor: Takes the file name both outputs start with
+    # start: Starts profiling
+    # stop: Stops profiling and writes both files
+    # hotFunctions: The functions with the most own time, as text lines
+    #
+    def __init__(self, baseName, top=DEFAULT_PROFILE_TOP):
+        self.baseName = baseName
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.statsFile = baseName + PROFILE_SUFFIX
+        self.summaryFile = baseName + PROFILE_SUMMARY_SUFFIX
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.profile.dump_stats(self.statsFile)
+        with open(self.summaryFile, 'w') as summary:
+            stats = pstats.Stats(self.profile, stream=summary)
+            stats.sort_stats('cumulative').print_stats(self.top)
+            stats.sort_stats('tottime').print_stats(self.top)
+        return self.statsFile, self.summaryFile
+
+    def hotFunctions(self, count=CONSOLE_PROFILE_TOP):
+        stats = pstats.Stats(self.profile, stream=io.StringIO())
+        lines = []
+        for function, (primitiveCalls, calls, ownTime, cumulativeTime, callers) in sorted(
+                stats.stats.items(), key=lambda item: -item[1][2])[:count]:
+            fileName, line, name = function
+            lines.append('%8.3fs own %8.3fs total %9d calls  %s (%s:%d)' % (ownTime, cumulativeTime, calls, name,
+                                                                            fileName, line))
+        return lines
+
+#End _Profiler ==========================================
+
+
+class _SlowFileTracer:
+    #
+    # Class: _SlowFileTracer
+    #
+    # Desc: Reports every file whose processing took longer than a
+    # threshold, through the calling script's own log or console, and
+    # counts them for the end of run summary
+    #
+    # Methods:
+    # constructor: Takes the threshold and the function reporting a file
+    # check: Reports a file when its time is over the threshold
+    # summary: The count of slow files as a line of text
+    #
+    def __init__(self, thresholdMs, report):
+        self.thresholdMs = thresholdMs
+        self.threshold = thresholdMs / 1000.0
+        self.report = report
+        self.count = 0
+        self.slowest = 0.0
+
+    def check(self, theFile, seconds, detail=''):
+        if seconds < self.threshold:
+            return False
+        self.count += 1
+        self.slowest = max(self.slowest, seconds)
+        self.report('Slow File: %.1f ms %s%s' % (seconds * 1000.0, theFile, detail))
+        return True
+
+    def summary(self):
+        return 'Slow Files:%d over %g ms, slowest %.1f ms' % (self.count, self.thresholdMs, self.slowest * 1000.0)
+
+#End _SlowFileTracer ====================================
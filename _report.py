@@ -0,0 +1,449 @@
+
+# _report.py
+# Python One Way File System Hashing - report writer
+# Author: L. Konate
+
+#################################################################
+# Background report writing for hash.py and sys_file_hashing.py
+#
+# ReportHeader() ReportFileName() SidecarFileName() CheckpointFileName() OpenReportText()
+# ReportRows() ReportedValue()
+# class _CSVSink class _SQLiteSink class _Checkpoint class _ReportWriter
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import csv #Python Standard Library - reader and writer for csv files
+import gzip #Python Standard Library - Support for gzip files
+import json #Python Standard Library - JSON encoder and decoder
+import time #Python Standard Library - Time access and conversions functions
+import queue #Python Standard Library - A synchronized queue class
+import sqlite3 #Python Standard Library - DB-API 2.0 interface for SQLite databases
+import threading #Python Standard Library - Thread-based parallelism
+import _pfish # p-fish shared hashing engine
+
+# Report name in the report path, the extension follows the format
+REPORT_NAME = 'fileSystemReport'
+
+# Report formats and the extension each one is written with
+REPORT_FORMATS = ('csv', 'csv.gz', 'sqlite')
+REPORT_EXTENSIONS = {'csv': '.csv', 'csv.gz': '.csv.gz', 'sqlite': '.db'}
+
+# Rows handed to the writer thread at once, and the number of batches
+# that may wait for it before the scan is held back
+REPORT_BATCH_ROWS = 1000
+REPORT_QUEUE_BATCHES = 64
+
+# Batches written to SQLite in one transaction
+SQLITE_COMMIT_BATCHES = 100
+
+# Checkpoint of an interrupted scan, written next to the report, and
+# the default number of seconds between checkpoints
+CHECKPOINT_FILE_NAME = 'fileSystemReport.checkpoint'
+DEFAULT_CHECKPOINT_SECONDS = 60
+
+# Report formats a scan can be resumed into, a gzip stream cannot be
+# cut back to the last checkpoint
+RESUMABLE_FORMATS = ('csv', 'sqlite')
+
+# Report columns holding integers, typed as such in SQLite
+INTEGER_COLUMNS = ('Size', 'Allocated Size', 'Owner', 'Group', 'Links')
+TIME_COLUMNS = ('Modified Time', 'Access Time', 'Created Time')
+
+
+def ReportHeader(hashTypes):
+    # report column names, one digest column per selected algorithm
+    return (('File', 'Path', 'Size', 'Allocated Size', 'Modified Time', 'Access Time', 'Created Time')
+            + tuple(hashTypes)
+            + ('Owner', 'Group', 'Mode', 'Links', 'Link Group', 'Hashed As', 'Merkle Root', 'Known'))
+
+
+def _ShardSuffix(shard):
+    # shards of one scan may share a report path, so each names its own
+    # files, e.g. fileSystemReport.shard2of4.csv
+    if shard is None:
+        return ''
+    return '.shard%dof%d' % (shard[0] + 1, shard[1])
+
+
+def ReportFileName(reportPath, reportFormat='csv', shard=None):
+    # shard is the (0 based index, count) of a sharded scan, if any
+    return os.path.join(reportPath, REPORT_NAME + _ShardSuffix(shard) + REPORT_EXTENSIONS[reportFormat])
+
+
+def SidecarFileName(reportPath, suffix, shard=None):
+    # a file kept next to the report and named after it
+    return os.path.join(reportPath, REPORT_NAME + _ShardSuffix(shard) + suffix)
+
+
+def CheckpointFileName(reportPath, shard=None):
+    if shard is None:
+        return os.path.join(reportPath, CHECKPOINT_FILE_NAME)
+    return SidecarFileName(reportPath, '.checkpoint', shard)
+
+
+def OpenReportText(fileName):
+    #
+    # Name: OpenReportText() Function
+    #
+    # Desc: Opens a csv report for reading, gzip compressed reports are
+    # decompressed as they are read
+    #
+    if fileName.endswith('.gz'):
+        return gzip.open(fileName, 'rt', newline='')
+    return open(fileName, newline='')
+#End OpenReportText =====================================
+
+
+def ReportRows(fileName):
+    # yields the header, then each row, of a report in any of the
+    # report formats
+    if fileName.endswith(REPORT_EXTENSIONS['sqlite']):
+        db = sqlite3.connect('file:'+ fileName +'?mode=ro', uri=True)
+        try:
+            cursor = db.execute('SELECT * FROM files ORDER BY rowid')
+            yield tuple(column[0] for column in cursor.description)
+            for row in cursor:
+                yield tuple('' if value is None else str(value) for value in row)
+        finally:
+            db.close()
+    else:
+        with OpenReportText(fileName) as csvFile:
+            for row in csv.reader(csvFile):
+                yield tuple(row)
+
+
+def ReportedValue(reportPath, theFile, column, shard=None):
+    #
+    # Name: ReportedValue() Function
+    #
+    # Desc: Looks up one column of a file's row in the report kept in
+    # reportPath, whichever format it was written in
+    #
+    # Input: reportPath = the report path of the scan
+    #        theFile = the Path of the row, as it was reported
+    #        column = the report column to read
+    #        shard = (0 based index, count) of a sharded scan, if any
+    #
+    # Actions:
+    # returns the value, or None when there is no report, no such
+    # column, no row for the file or the column is empty for it
+    #
+    for reportFormat in REPORT_FORMATS:
+        fileName = ReportFileName(reportPath, reportFormat, shard)
+        if not os.path.isfile(fileName):
+            continue
+        rows = ReportRows(fileName)
+        header = next(rows, ())
+        if 'Path' not in header or column not in header:
+            return None
+        pathColumn = header.index('Path')
+        valueColumn = header.index(column)
+        for row in rows:
+            if len(row) > max(pathColumn, valueColumn) and row[pathColumn] == theFile:
+                rows.close()
+                return row[valueColumn] or None
+        return None
+    return None
+#End ReportedValue ======================================
+
+
+class _CSVSink:
+    #
+    # Class: _CSVSink
+    #
+    # Desc: Writes report batches as quoted csv rows, plain or gzip
+    # compressed
+    #
+    # Methods:
+    # constructor: Creates the file and writes the header row, or cuts
+    #              a resumed report back to its checkpoint
+    # writeRows: Writes a batch of rows
+    # sync: Forces the rows to disk and returns the file size
+    # close: Closes the file
+    #
+    def __init__(self, fileName, header, compressed=False, resumeOffset=None):
+        if resumeOffset is not None:
+            # rows written after the checkpoint are dropped and written again
+            with open(fileName, 'r+b') as csvFile:
+                if os.fstat(csvFile.fileno()).st_size < resumeOffset:
+                    raise ValueError('report is shorter than its checkpoint: '+ fileName)
+                csvFile.truncate(resumeOffset)
+            self.csvFile = open(fileName, 'a', newline='')
+            header = None
+        elif compressed:
+            self.csvFile = gzip.open(fileName, 'wt', newline='', compresslevel=6)
+        else:
+            self.csvFile = open(fileName, 'w', newline='')
+        self.writer = csv.writer(self.csvFile, delimiter=',', quoting=csv.QUOTE_ALL)
+        if header is not None:
+            self.writer.writerow(header)
+
+    def writeRows(self, rows):
+        self.writer.writerows(rows)
+
+    def sync(self):
+        self.csvFile.flush()
+        os.fsync(self.csvFile.fileno())
+        return os.fstat(self.csvFile.fileno()).st_size
+
+    def close(self):
+        self.csvFile.close()
+
+#End _CSVSink ===========================================
+
+
+class _SQLiteSink:
+    #
+    # Class: _SQLiteSink
+    #
+    # Desc: Writes report batches into a files table, one column per
+    # report column named as in the csv header. Batches go in with
+    # executemany and are committed SQLITE_COMMIT_BATCHES at a time
+    #
+    # Methods:
+    # constructor: Creates the database and the files table, or cuts a
+    #              resumed report back to its checkpoint
+    # writeRows: Inserts a batch of rows
+    # sync: Commits the rows written so far
+    # close: Commits and closes the database
+    #
+    def __init__(self, fileName, header, resumeRows=None):
+        if resumeRows is None and os.path.exists(fileName):
+            os.remove(fileName)
+        # the writer thread creates the sink, so the connection is its own
+        self.db = sqlite3.connect(fileName)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # commits are rare, so make each one durable
+        self.db.execute('PRAGMA synchronous=FULL')
+        if resumeRows is not None:
+            # rows are inserted in walk order, so rowid is the row number
+            self.db.execute('DELETE FROM files WHERE rowid > ?', (resumeRows,))
+            self.db.commit()
+        else:
+            columns = []
+            for name in header:
+                if name in INTEGER_COLUMNS or name in TIME_COLUMNS:
+                    columns.append('"%s" INTEGER' % name)
+                else:
+                    columns.append('"%s" TEXT' % name)
+            self.db.execute('CREATE TABLE files (%s)' % ', '.join(columns))
+        self.insert = 'INSERT INTO files VALUES (%s)' % ','.join('?' * len(header))
+        self.pending = 0
+
+    def writeRows(self, rows):
+        self.db.executemany(self.insert, rows)
+        self.pending += 1
+        if self.pending >= SQLITE_COMMIT_BATCHES:
+            self.db.commit()
+            self.pending = 0
+
+    def sync(self):
+        self.db.commit()
+        self.pending = 0
+        return None
+
+    def close(self):
+        self.db.commit()
+        self.db.execute('CREATE INDEX IF NOT EXISTS files_path ON files ("Path")')
+        self.db.commit()
+        self.db.close()
+
+#End _SQLiteSink ========================================
+
+
+class _Checkpoint:
+    #
+    # Class: _Checkpoint
+    #
+    # Desc: Journal of a scan in progress. Files are reported in walk
+    # order, so the path of the last row on disk, the row count and the
+    # report size are enough to resume. The files and bytes of the walk
+    # reported so far, archive members left out, are kept too so the
+    # progress line of a resumed scan can count them as done. Each checkpoint is written to a
+    # temporary file, synced and renamed over the previous one, so a
+    # crash leaves either the old or the new checkpoint intact
+    #
+    # Methods:
+    # constructor: Sets the checkpoint file, interval and scan settings
+    # load: Reads the checkpoint of an interrupted scan, raises
+    #       ValueError when there is none or the settings differ
+    # save: Records the position of the last row synced to disk
+    # remove: Deletes the checkpoint once the scan has completed
+    #
+    def __init__(self, fileName, interval, settings):
+        self.fileName = fileName
+        self.interval = interval
+        self.settings = settings
+        self.lastPath = None
+        self.rows = 0
+        self.offset = None
+        self.files = 0
+        self.bytes = 0
+        self.resumed = False
+
+    def load(self):
+        try:
+            with open(self.fileName) as checkpointFile:
+                state = json.load(checkpointFile)
+        except (IOError, OSError, ValueError):
+            raise ValueError('no usable checkpoint found at '+ self.fileName)
+        if state['settings'] != self.settings:
+            raise ValueError('the checkpoint was written by a scan with different settings: '+ json.dumps(state['settings']))
+        self.lastPath = state['lastPath']
+        self.rows = state['rows']
+        self.offset = state['offset']
+        # None when the checkpoint did not record them
+        self.files = state.get('files')
+        self.bytes = state.get('bytes')
+        self.resumed = True
+
+    def save(self, lastPath, rows, offset, files=None, totalBytes=None):
+        state = {'settings': self.settings, 'lastPath': lastPath, 'rows': rows, 'offset': offset,
+                 'files': files, 'bytes': totalBytes, 'saved': time.strftime('%Y-%m-%d %H:%M:%S')}
+        tempName = self.fileName + '.tmp'
+        with open(tempName, 'w') as checkpointFile:
+            json.dump(state, checkpointFile)
+            checkpointFile.flush()
+            os.fsync(checkpointFile.fileno())
+        os.replace(tempName, self.fileName)
+        if hasattr(os, 'O_DIRECTORY'):
+            # make the rename itself durable
+            dirFd = os.open(os.path.dirname(os.path.abspath(self.fileName)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dirFd)
+            finally:
+                os.close(dirFd)
+        self.lastPath = lastPath
+        self.rows = rows
+        self.offset = offset
+        self.files = files
+        self.bytes = totalBytes
+
+    def remove(self):
+        if os.path.exists(self.fileName):
+            os.remove(self.fileName)
+
+#End _Checkpoint ========================================
+
+
+class _ReportWriter:
+    #
+    # Class: _ReportWriter
+    #
+    # Desc: Writes the file system report on a background thread. The
+    # scan hands over FileRecords, which are collected into batches and
+    # passed through a bounded queue. Formatting the rows (including the
+    # time conversions) and writing them happens on the writer thread,
+    # so the scan only waits when the queue is full. With a checkpoint
+    # the writer thread syncs the report and saves a checkpoint at most
+    # every checkpoint interval, and a resumed checkpoint reopens the
+    # report where it left off. The seconds the writer thread spends
+    # formatting and writing rows are added up in writeSeconds
+    #
+    # Methods:
+    # constructor: Starts the writer thread and its sink
+    # writeRecord: Adds one file to the report
+    # writerClose: Flushes the last batch, stops the thread and closes
+    #              the sink, raising any error the thread hit
+    #
+    def __init__(self, fileName, hashTypes, reportFormat='csv', rawTimes=False, checkpoint=None):
+        self.fileName = fileName
+        self.checkpoint = checkpoint
+        self.lastFlush = time.monotonic()
+        self.header = ReportHeader(hashTypes)
+        self.reportFormat = reportFormat
+        # SQLite columns are typed, so times are always stored as integers
+        self.rawTimes = rawTimes or reportFormat == 'sqlite'
+        self.batch = []
+        self.rowCount = 0
+        self.writeSeconds = 0.0
+        self.error = None
+        self.queue = queue.Queue(REPORT_QUEUE_BATCHES)
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='ReportWriter', daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        self._checkError()
+
+    def _openSink(self):
+        resumed = self.checkpoint is not None and self.checkpoint.resumed
+        if self.reportFormat == 'sqlite':
+            return _SQLiteSink(self.fileName, self.header, self.checkpoint.rows if resumed else None)
+        return _CSVSink(self.fileName, self.header, compressed=self.reportFormat == 'csv.gz',
+                        resumeOffset=self.checkpoint.offset if resumed else None)
+
+    def _run(self):
+        try:
+            sink = self._openSink()
+        except Exception as err:
+            self.error = err
+            self.ready.set()
+            return
+        self.ready.set()
+        checkpoint = self.checkpoint
+        rowsWritten = checkpoint.rows if checkpoint is not None else 0
+        # walk files and their bytes, counted on from a resumed checkpoint
+        filesWritten = None
+        bytesWritten = None
+        if checkpoint is not None and checkpoint.files is not None:
+            filesWritten = checkpoint.files
+            bytesWritten = checkpoint.bytes
+        lastCheckpoint = time.monotonic()
+        try:
+            while True:
+                batch = self.queue.get()
+                if batch is None:
+                    break
+                if self.error is None:
+                    startTime = time.perf_counter()
+                    sink.writeRows([self._row(record, known) for record, known in batch])
+                    self.writeSeconds += time.perf_counter() - startTime
+                    rowsWritten += len(batch)
+                    if filesWritten is not None:
+                        for record, known in batch:
+                            if _pfish.MEMBER_SEPARATOR not in record.path:
+                                filesWritten += 1
+                                bytesWritten += record.stat.st_size
+                    if checkpoint is not None and time.monotonic() - lastCheckpoint >= checkpoint.interval:
+                        checkpoint.save(batch[-1][0].path, rowsWritten, sink.sync(), filesWritten, bytesWritten)
+                        lastCheckpoint = time.monotonic()
+        except Exception as err:
+            self.error = err
+            # keep draining so the scan is never left blocked on a full queue
+            while self.queue.get() is not None:
+                pass
+        finally:
+            try:
+                sink.close()
+            except Exception as err:
+                self.error = self.error or err
+
+    def _row(self, record, known):
+        values = _pfish.FormatRow(record, self.rawTimes)
+        return values[:7] + tuple(values[7]) + values[8:] + (known,)
+
+    def _checkError(self):
+        if self.error is not None:
+            raise IOError('Report writing failed for '+ self.fileName +': '+ str(self.error))
+
+    def writeRecord(self, record, known=''):
+        # known is the known set status of the file, if any
+        self.batch.append((record, known))
+        self.rowCount += 1
+        if len(self.batch) >= REPORT_BATCH_ROWS or (
+                self.checkpoint is not None and time.monotonic() - self.lastFlush >= self.checkpoint.interval):
+            # slow scans hand over partial batches so checkpoints keep up
+            self._checkError()
+            self.queue.put(self.batch)
+            self.batch = []
+            self.lastFlush = time.monotonic()
+
+    def writerClose(self):
+        if self.batch:
+            self.queue.put(self.batch)
+            self.batch = []
+        self.queue.put(None)
+        self.thread.join()
+        self._checkError()
+
+#End _ReportWriter ======================================
@@ -0,0 +1,156 @@
+
+# _schedule.py
+# Python One Way File System Hashing - physical order scheduling
+# Author: L. Konate
+
+#################################################################
+# Read scheduling for hash.py and sys_file_hashing.py, so files on
+# rotational media are read in on-disk order rather than walk order
+#
+# InodeKey() ExtentKey() FirstPhysicalOffset() class _PhysicalScheduler
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import stat #Python Standard Library - functions for interpreting os results
+import struct #Python Standard Library - Interpret bytes as packed binary data
+import collections #Python Standard Library - Container datatypes
+
+try:
+    import fcntl #Python Standard Library - The fcntl and ioctl system calls (Unix only)
+except ImportError:
+    fcntl = None
+
+# Ways of putting a batch in physical order
+PHYSICAL_ORDERS = ('inode', 'extent')
+
+# Walk entries sorted together, a larger window gives the disk longer
+# sweeps but holds more entries in memory
+SCHEDULE_BATCH_FILES = 1024
+
+# Linux FS_IOC_FIEMAP request with room for a single extent
+#   struct fiemap: start, length, flags, mapped extents, extent count,
+#                  reserved
+#   struct fiemap_extent: logical, physical, length, 2 reserved,
+#                         flags, 3 reserved
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_FORMAT = struct.Struct('=QQIIII')
+FIEMAP_EXTENT_FORMAT = struct.Struct('=QQQQQIIII')
+FIEMAP_MAX_OFFSET = 0xFFFFFFFFFFFFFFFF
+
+
+def InodeKey(entry):
+    # sort key from the walk's lstat result, inodes are mostly allocated
+    # near their data so inode order approximates disk order for free.
+    # Entries that could not be stat'ed go first
+    st = entry[2]
+    if st is None:
+        return (0, 0)
+    return (st.st_dev, st.st_ino)
+
+
+def FirstPhysicalOffset(theFile):
+    #
+    # Name: FirstPhysicalOffset() Function
+    #
+    # Desc: Asks the file system for the physical byte offset of the first
+    # extent of a file with the FIEMAP ioctl
+    #
+    # Input: theFile = full path of the file
+    #
+    # Actions:
+    # returns the offset, 0 for a file with no extents, or None where
+    # FIEMAP is not supported
+    #
+    if fcntl is None:
+        return None
+    request = bytearray(FIEMAP_FORMAT.pack(0, FIEMAP_MAX_OFFSET, 0, 0, 1, 0) + bytes(FIEMAP_EXTENT_FORMAT.size))
+    try:
+        # O_NONBLOCK so a file that became a FIFO since the walk cannot hang the open
+        fd = os.open(theFile, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_NONBLOCK', 0))
+    except OSError:
+        return None
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    mappedExtents = FIEMAP_FORMAT.unpack_from(request)[3]
+    if not mappedExtents:
+        return 0
+    return FIEMAP_EXTENT_FORMAT.unpack_from(request, FIEMAP_FORMAT.size)[1]
+
+
+def ExtentKey(entry):
+    # sort key on the physical start of the file's data, falling back
+    # to the inode number where the file system has no FIEMAP. Only
+    # regular files are opened, FIFOs, devices and sockets sort by inode
+    st = entry[2]
+    if st is None:
+        return (0, 0, 0)
+    if not stat.S_ISREG(st.st_mode):
+        return (st.st_dev, 0, st.st_ino)
+    offset = FirstPhysicalOffset(entry[0])
+    if offset is None:
+        offset = 0
+    return (st.st_dev, offset, st.st_ino)
+#End ExtentKey ==========================================
+
+
+class _PhysicalScheduler:
+    #
+    # Class: _PhysicalScheduler
+    #
+    # Desc: Reorders the walk for reading and restores it for reporting.
+    # entries() takes the walk in batches of SCHEDULE_BATCH_FILES, sorts
+    # each batch by its physical order key and yields the entries in that
+    # order. Any scan that keeps its input order (ParallelScan,
+    # ThreadedScan or SequentialScan) hashes them, and restore() puts
+    # the results back in walk order one batch at a time, so the report
+    # is the same as an unscheduled scan
+    #
+    # Methods:
+    # constructor: Takes the walk and the ordering to use
+    # entries: Yields the walk entries in physical order
+    # restore: Yields scan results in walk order
+    #
+    def __init__(self, fileList, method='inode', batchFiles=SCHEDULE_BATCH_FILES):
+        self.fileList = fileList
+        self.orderKey = ExtentKey if method == 'extent' else InodeKey
+        self.batchFiles = batchFiles
+        # the read order of each batch handed out, waiting for its results
+        self.orders = collections.deque()
+
+    def entries(self):
+        batch = []
+        for entry in self.fileList:
+            batch.append(entry)
+            if len(batch) >= self.batchFiles:
+                yield from self._ordered(batch)
+                batch = []
+        if batch:
+            yield from self._ordered(batch)
+
+    def _ordered(self, batch):
+        keys = [self.orderKey(entry) for entry in batch]
+        order = sorted(range(len(batch)), key=keys.__getitem__)
+        self.orders.append(order)
+        for index in order:
+            yield batch[index]
+
+    def restore(self, results):
+        # results arrive in read order and never before their entry was
+        # handed out, so the order of their batch is already queued
+        slots = None
+        for result in results:
+            if slots is None:
+                order = self.orders.popleft()
+                slots = [None] * len(order)
+                filled = 0
+            slots[order[filled]] = result
+            filled += 1
+            if filled == len(order):
+                yield from slots
+                slots = None
+
+#End _PhysicalScheduler =================================
@@ -0,0 +1,337 @@
+
+# _segments.py
+# Python One Way File System Hashing - segmented hashing of huge files
+# Author: L. Konate
+
+#################################################################
+# Splits files above a size threshold into segments hashed at once
+# on every core, for hash.py and sys_file_hashing.py, and combines
+# the segment digests into a tree digest
+#
+# TreeDigests() class _SegmentHasher class _SegmentWriter
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import csv #Python Standard Library - reader and writer for csv files
+import time #Python Standard Library - Time access and conversions functions
+import errno #Python Standard Library - Standard errno system symbols
+import threading #Python Standard Library - Thread-based parallelism
+import multiprocessing #Python Standard Library - Process-based parallelism
+import collections #Python Standard Library - Container datatypes
+import concurrent.futures #Python Standard Library - Launching parallel tasks
+import _pfish # p-fish shared hashing engine
+import _pieceHash # p-fish piecewise block hashing
+
+# Bytes hashed by one segment task, large enough that the task costs
+# far more than handing it to a worker
+DEFAULT_SEGMENT_SIZE = 64 * 1024 ** 2
+
+# Sidecar listing the tree and serial digests of every segmented file
+SEGMENT_SUFFIX = '.segments.csv'
+
+# How a tree digest is written in a report hash column, with the
+# segment size it depends on, e.g. tree-67108864:9f86d0...
+TREE_DIGEST_FORMAT = 'tree-%d:%s'
+
+# The digests of a segmented file: the segment size, the number of
+# segments, the hex tree digest of each hash type and, when asked
+# for, the hex serial digest of each hash type (else None)
+SegmentDigests = collections.namedtuple('SegmentDigests', 'segmentSize segments trees serial')
+
+# The pool is started from whichever scan thread first meets a large
+# file, while other scan threads, the report writer and the log
+# listener may hold locks a forked child would inherit held. A fork
+# server forks its workers from a clean single threaded process, spawn
+# is the fallback where there is none (Windows)
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# read buffer of a segment worker process, and the zeros fed for the
+# holes of a sparse file, allocated on first use
+_workerBuffer = None
+_workerZeros = None
+
+
+def TreeDigests(segmentDigests, hashTypes):
+    #
+    # Name: TreeDigests() Function
+    #
+    # Desc: Combines the raw digests of consecutive segments into one
+    # tree digest per hash type. Each tree is _pieceHash.MerkleRoot() of
+    # the segment digests of that hash type: each digest becomes a
+    # prefixed leaf, adjacent pairs are hashed together under the node
+    # prefix level by level and an odd node is carried up. So the
+    # tree of a file is fixed by its bytes, the algorithm and the
+    # segment size, and is the same however many workers made it
+    #
+    # Input: segmentDigests = per segment, a list of raw digests in
+    #                         hashTypes order
+    #        hashTypes = report names of the algorithms
+    #
+    # Actions:
+    # returns the hex tree digests in hashTypes order
+    #
+    return [_pieceHash.MerkleRoot([digests[index] for digests in segmentDigests], hashType).hex()
+            for index, hashType in enumerate(hashTypes)]
+#End TreeDigests ========================================
+
+
+def _HashSegment(theFile, identity, hashTypes, offset, length, chunkSize, blockSize=None, sparse=False):
+    # runs in a segment worker, hashes length bytes from offset with
+    # positioned reads into the worker's own buffer. Also used for the
+    # serial digest, as one segment covering the whole file. The file is
+    # opened again by name, so it must still be the (st_dev, st_ino)
+    # identity the parent opened. A sparse file's holes in the segment
+    # are found with SEEK_DATA/SEEK_HOLE and hashed as zeros, unread.
+    # Returns (raw digests, block digests or None, bytes hashed, read
+    # seconds, hash seconds)
+    global _workerBuffer
+    global _workerZeros
+    if _workerBuffer is None or len(_workerBuffer) != chunkSize:
+        _workerBuffer = memoryview(bytearray(chunkSize))
+        _workerZeros = None
+    view = _workerBuffer
+    hashList = [_pfish.NewHash(hashType) for hashType in hashTypes]
+    updates = [hash.update for hash in hashList]
+    blockHasher = None
+    if blockSize:
+        # segments start on block boundaries, so the block digests of
+        # consecutive segments join up
+        blockHasher = _pieceHash._BlockHasher(blockSize, hashTypes[0])
+        updates.append(blockHasher.feed)
+    perf = time.perf_counter
+    seconds = [0.0, 0.0]
+
+    def HashZeros(length):
+        global _workerZeros
+        if _workerZeros is None:
+            _workerZeros = memoryview(bytes(chunkSize))
+        startTime = perf()
+        while length > 0:
+            chunk = _workerZeros if length >= chunkSize else _workerZeros[:length]
+            for update in updates:
+                update(chunk)
+            length -= len(chunk)
+        seconds[1] += perf() - startTime
+
+    def HashRange(position, end):
+        # returns the position reached, short of end at end of file
+        while position < end:
+            startTime = perf()
+            want = min(chunkSize, end - position)
+            if hasattr(os, 'preadv'):
+                count = os.preadv(fd, [view[:want]], position)
+            else:
+                data = os.pread(fd, want, position)
+                count = len(data)
+                view[:count] = data
+            readTime = perf()
+            seconds[0] += readTime - startTime
+            if not count:
+                break
+            chunk = view[:count]
+            for update in updates:
+                update(chunk)
+            seconds[1] += perf() - readTime
+            position += count
+        return position
+
+    end = offset + length
+    fd = os.open(theFile, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        st = os.fstat(fd)
+        if (st.st_dev, st.st_ino) != identity:
+            raise IOError('file was replaced while being hashed: '+ theFile)
+        if not sparse:
+            position = HashRange(offset, end)
+        else:
+            position = offset
+            while position < end:
+                try:
+                    dataStart = min(os.lseek(fd, position, os.SEEK_DATA), end)
+                except OSError as err:
+                    if err.errno != errno.ENXIO:
+                        raise
+                    # no more data, the rest of the segment is a hole
+                    dataStart = end
+                HashZeros(dataStart - position)
+                position = dataStart
+                if position >= end:
+                    break
+                dataEnd = min(os.lseek(fd, dataStart, os.SEEK_HOLE), end)
+                position = HashRange(dataStart, dataEnd)
+                if position < dataEnd:
+                    break
+            # holes count as hashed, so a file that shrank is caught here
+            position = min(position, max(os.fstat(fd).st_size, offset))
+    finally:
+        os.close(fd)
+    return ([hash.digest() for hash in hashList], blockHasher.finish() if blockHasher is not None else None,
+            position - offset, seconds[0], seconds[1])
+
+
+class _SegmentHasher:
+    #
+    # Class: _SegmentHasher
+    #
+    # Desc: Hashes a file of at least threshold bytes as segments of
+    # segmentSize bytes, each hashed by a pool process with positioned
+    # reads, so one huge image is read and hashed on every core at once.
+    # The segment digests give a tree digest per hash type, see
+    # TreeDigests(). A serial digest, the one sha256sum would give,
+    # cannot be split, so when asked for it is computed by one more
+    # task reading the whole file alongside the segments.
+    # The report hash columns hold the serial digests when there are
+    # any, otherwise the tree digests written with TREE_DIGEST_FORMAT,
+    # so a tree digest is never taken for a serial one. Known sets,
+    # baselines and the hash cache only hold serial digests, so the
+    # scripts need --segment-serial to use them with segmentation. The bytes hashed
+    # are the file's size when it was stat'ed, a file that shrinks while
+    # being hashed is an IOError. Each worker opens the file again by
+    # name and checks it is the same inode as the scan's descriptor, a
+    # file renamed or replaced in between is an IOError too. The holes
+    # of a sparse file are skipped as _pfish._HashEngine skips them.
+    # Handed to _pfish._HashEngine, which ScanFile() then uses for every
+    # file wants() accepts. The pool is started on first use without
+    # forking the scan, see POOL_START_METHOD, is shared by every thread
+    # of the scan and lives in the process that owns the hasher,
+    # ParallelScan() hashes such files from the main process
+    #
+    # Methods:
+    # constructor: Sets the threshold, segment size and worker count
+    # wants: True when a file is large enough to be segmented
+    # hashFile: Hashes an open file and returns its report digests
+    # close: Stops the worker pool
+    #
+    def __init__(self, threshold, segmentSize=DEFAULT_SEGMENT_SIZE, workers=None, serial=False):
+        # an empty file has no segment to hash
+        self.threshold = max(threshold, 1)
+        self.segmentSize = segmentSize
+        self.workers = workers or os.cpu_count() or 1
+        self.serial = serial
+        self.pool = None
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytesHashed = 0
+
+    def wants(self, st):
+        return st is not None and st.st_size >= self.threshold
+
+    def _startPool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(POOL_START_METHOD))
+            return self.pool
+
+    def hashFile(self, f, st, hashEngine, blocks=None):
+        # hashEngine supplies the hash types, chunk and block sizes, and
+        # is charged with the workers' read and hash seconds. When a
+        # blocks list is given the raw block digests are appended to it.
+        # Returns (report hex digests, SegmentDigests)
+        pool = self._startPool()
+        size = st.st_size
+        hashTypes = hashEngine.hashTypes
+        blockSize = hashEngine.blockSize if blocks is not None else None
+        # the workers must hash the file this descriptor is open on
+        openSt = os.fstat(f.fileno())
+        identity = (openSt.st_dev, openSt.st_ino)
+        sparse = _pfish.SPARSE_SUPPORTED and _pfish.AllocatedSize(openSt) < openSt.st_size
+        serialFuture = None
+        if self.serial:
+            # the longest task, submitted first so it starts at once
+            serialFuture = pool.submit(_HashSegment, f.name, identity, hashTypes, 0, size, hashEngine.chunkSize,
+                                       None, sparse)
+        futures = [pool.submit(_HashSegment, f.name, identity, hashTypes, offset, min(self.segmentSize, size - offset),
+                               hashEngine.chunkSize, blockSize, sparse)
+                   for offset in range(0, size, self.segmentSize)]
+        try:
+            segmentDigests = []
+            bytesRead = 0
+            for future in futures:
+                digests, blockDigests, count, readSeconds, hashSeconds = future.result()
+                segmentDigests.append(digests)
+                if blocks is not None:
+                    blocks.extend(blockDigests)
+                bytesRead += count
+                hashEngine.readSeconds += readSeconds
+                hashEngine.hashSeconds += hashSeconds
+            if bytesRead != size:
+                raise IOError('file shrank while being hashed: '+ f.name)
+            serialValues = None
+            if serialFuture is not None:
+                digests, blockDigests, count, readSeconds, hashSeconds = serialFuture.result()
+                if count != size:
+                    raise IOError('file shrank while being hashed: '+ f.name)
+                serialValues = [digest.hex() for digest in digests]
+                hashEngine.readSeconds += readSeconds
+                hashEngine.hashSeconds += hashSeconds
+        except BaseException:
+            for future in futures + [serialFuture]:
+                if future is not None:
+                    future.cancel()
+            raise
+        trees = TreeDigests(segmentDigests, hashTypes)
+        with self.lock:
+            self.files += 1
+            self.bytesHashed += size
+        if serialValues is not None:
+            hashValues = serialValues
+        else:
+            hashValues = [TREE_DIGEST_FORMAT % (self.segmentSize, tree) for tree in trees]
+        return hashValues, SegmentDigests(self.segmentSize, len(futures), trees, serialValues)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+#End _SegmentHasher =====================================
+
+
+class _SegmentWriter:
+    #
+    # Class: _SegmentWriter
+    #
+    # Desc: Writes the segments sidecar, one row per segmented file
+    # with its segment size and count, its tree digests and, when they
+    # were computed, its serial digests. Segmented files are few and
+    # each took long to hash, so every row is flushed as it is written.
+    # A resumed scan keeps the rows up to the checkpoint's last path and
+    # drops the rest, which the scan hashes and writes again
+    #
+    # Methods:
+    # constructor: Opens the sidecar and writes the header, or reopens
+    #              it up to the checkpoint of a resumed scan
+    # writeEntry: Writes the row of one FileRecord
+    # writerClose: Closes the sidecar
+    #
+    def __init__(self, fileName, hashTypes, serial=False, resumeAfter=None):
+        header = ['Path', 'Size', 'Segment Size', 'Segments'] + [hashType +' Tree' for hashType in hashTypes]
+        if serial:
+            header += [hashType +' Serial' for hashType in hashTypes]
+        rows = []
+        if resumeAfter is not None and os.path.exists(fileName):
+            resumeKey = _pfish.WalkOrderKey(resumeAfter)
+            with open(fileName, newline='') as csvFile:
+                reader = csv.reader(csvFile)
+                if next(reader, None) == header:
+                    rows = [row for row in reader if row and _pfish.WalkOrderKey(row[0]) <= resumeKey]
+        self.csvFile = open(fileName, 'w', newline='')
+        self.writer = csv.writer(self.csvFile, delimiter=',', quoting=csv.QUOTE_ALL)
+        self.writer.writerow(header)
+        self.writer.writerows(rows)
+        self.csvFile.flush()
+        self.serial = serial
+
+    def writeEntry(self, record):
+        segments = record.segments
+        row = [record.path, record.stat.st_size, segments.segmentSize, segments.segments] + segments.trees
+        if self.serial:
+            row += segments.serial
+        self.writer.writerow(row)
+        self.csvFile.flush()
+
+    def writerClose(self):
+        self.csvFile.close()
+
+#End _SegmentWriter =====================================
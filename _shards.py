@@ -0,0 +1,336 @@
+
+# _shards.py
+# Python One Way File System Hashing - sharded scans
+# Author: L. Konate
+
+#################################################################
+# Splits one rootPath between several machines for hash.py and
+# sys_file_hashing.py, and merges their partial reports
+#
+# PlanShards() class _ShardPlan MergeShardReports() PartialSidecars() MergeShardSidecars()
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import json #Python Standard Library - JSON encoder and decoder
+import heapq #Python Standard Library - Heap queue algorithm
+import hashlib #Python Standard Library - Secure hashes and message digests
+import _pfish # p-fish shared hashing engine
+import _report # p-fish report writer
+import _pieceHash # p-fish piecewise block hashing
+import _baseline # p-fish baseline verification
+
+# Each file is weighed as its size plus this many bytes, the cost of
+# its open and metadata, so a unit of many small files is not taken
+# for a light one
+FILE_COST_BYTES = 256 * 1024
+
+# A work unit is consecutive files of one directory, closed once it
+# weighs this much (about 1000 small files), so a large directory is
+# spread over several shards
+UNIT_COST_BYTES = 256 * 1024 * 1024
+
+# Manifest of the partial reports, written next to the merged report
+MERGE_MANIFEST_NAME = 'fileSystemReport.manifest.json'
+
+# Rows handed to the report sink at once while merging
+MERGE_BATCH_ROWS = 1000
+
+# Sidecars a shard writes next to its partial report, merged with the
+# partials, and the function merging each kind
+SHARD_SIDECARS = ((_pieceHash.BLOCK_SUFFIX, _pieceHash.MergeBlockFiles),
+                  (_baseline.VERIFY_SUFFIX, _baseline.MergeVerifyReports))
+
+
+def PlanShards(rootPath, shardCount, walkFilter=None):
+    #
+    # Name: PlanShards() Function
+    #
+    # Desc: Walks rootPath, reading names and sizes only, and cuts the
+    # files into work units of consecutive files of one directory. The
+    # units are dealt out largest first, each to the shard with the least
+    # work so far, which keeps the shards within about one unit of each
+    # other. The plan depends only on the tree and the filters, so every
+    # machine planning the same tree gets the same plan
+    #
+    # Input: rootPath = directory being sharded
+    #        shardCount = number of shards
+    #        walkFilter = optional _filters._WalkFilter the scans will use
+    #
+    # Actions:
+    # returns a _ShardPlan
+    #
+    rootPrefix = os.path.join(rootPath, '')
+    # each unit: relative directory, first file name, files, bytes, cost
+    units = []
+    unit = None
+    for theFile, simpleName, st in _pfish.WalkFiles(rootPath, None, walkFilter):
+        directory = os.path.dirname(theFile[len(rootPrefix):])
+        size = st.st_size if st is not None else 0
+        if unit is None or unit[0] != directory or unit[4] >= UNIT_COST_BYTES:
+            unit = [directory, simpleName, 0, 0, 0]
+            units.append(unit)
+        unit[2] += 1
+        unit[3] += size
+        unit[4] += size + FILE_COST_BYTES
+
+    loads = [(0, shard) for shard in range(shardCount)]
+    files = [0] * shardCount
+    sizes = [0] * shardCount
+    shards = [0] * len(units)
+    for index in sorted(range(len(units)), key=lambda index: (-units[index][4], index)):
+        load, shard = heapq.heappop(loads)
+        directory, firstName, fileCount, byteCount, cost = units[index]
+        shards[index] = shard
+        files[shard] += fileCount
+        sizes[shard] += byteCount
+        heapq.heappush(loads, (load + cost, shard))
+
+    directories = {}
+    for (directory, firstName, fileCount, byteCount, cost), shard in zip(units, shards):
+        entry = directories.setdefault(directory, [[], [], []])
+        entry[0].append(firstName)
+        entry[1].append(shard)
+    # the shards found below each directory, so a scan can skip the
+    # directories holding none of its files
+    below = {}
+    for directory, (names, unitShards, subtree) in directories.items():
+        parts = directory.split(os.sep) if directory else []
+        for depth in range(len(parts), -1, -1):
+            below.setdefault(os.sep.join(parts[:depth]), set()).update(unitShards)
+    for directory, entry in directories.items():
+        entry[2] = sorted(below[directory])
+    return _ShardPlan({'rootPath': os.path.abspath(rootPath), 'shards': shardCount,
+                       'files': files, 'bytes': sizes, 'directories': directories})
+#End PlanShards =========================================
+
+
+class _ShardPlan:
+    #
+    # Class: _ShardPlan
+    #
+    # Desc: The split of a tree between shards. Each directory that held
+    # files when the tree was planned lists the first file name of each
+    # of its units and the shard of each unit, so a file's shard is found
+    # by a binary search of its name. Files that appear later follow the
+    # unit before them, and files of directories created later go to the
+    # shard of the first unit of the nearest planned directory above
+    # them, so every file belongs to exactly one shard however the tree
+    # has changed
+    #
+    # Methods:
+    # constructor: Takes the plan document
+    # load: Reads a plan saved by save(), raises ValueError
+    # save: Writes the plan as JSON
+    # shardOf: The 0 based shard a file belongs to
+    # covers: False when no file below a directory belongs to a shard
+    # summary: One line of figures per shard
+    #
+    def __init__(self, plan):
+        self.plan = plan
+        self.shardCount = plan['shards']
+        self.directories = plan['directories']
+
+    @staticmethod
+    def load(fileName):
+        try:
+            with open(fileName) as planFile:
+                plan = json.load(planFile)
+            return _ShardPlan(plan)
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            raise ValueError('not a usable shard plan: '+ fileName)
+
+    def save(self, fileName):
+        with open(fileName, 'w') as planFile:
+            json.dump(self.plan, planFile)
+
+    def _planned(self, directory):
+        # the nearest planned directory at or above directory
+        while directory not in self.directories:
+            if not directory:
+                return None
+            directory = os.path.dirname(directory)
+        return self.directories[directory]
+
+    def shardOf(self, directory, name):
+        # directory is relative to the root, '' for the root itself
+        entry = self.directories.get(directory)
+        if entry is None:
+            entry = self._planned(directory)
+            return entry[1][0] if entry is not None else 0
+        names, shards = entry[0], entry[1]
+        low = 0
+        high = len(names)
+        while low < high:
+            middle = (low + high) // 2
+            if names[middle] <= name:
+                low = middle + 1
+            else:
+                high = middle
+        return shards[max(low - 1, 0)]
+
+    def covers(self, directory, shard):
+        # only a planned directory can be ruled out, an unplanned one may
+        # hold files that follow the shard of a directory above it
+        entry = self.directories.get(directory)
+        return entry is None or shard in entry[2]
+
+    def summary(self):
+        return ['Shard %d/%d: %d files, %d bytes' % (shard + 1, self.shardCount, self.plan['files'][shard],
+                                                     self.plan['bytes'][shard])
+                for shard in range(self.shardCount)]
+
+#End _ShardPlan =========================================
+
+
+def _FileDigest(fileName):
+    # SHA256 of a report file as it is stored
+    with open(fileName, 'rb', buffering=0) as f:
+        return _pfish._HashEngine(['SHA256']).hashFile(f)[0]
+
+
+def MergeShardReports(partialFiles, mergedFile, reportFormat='csv'):
+    #
+    # Name: MergeShardReports() Function
+    #
+    # Desc: Merges the partial reports of a sharded scan into one report
+    # in walk order. Every partial is already in walk order, so they are
+    # merged as streams and never held in memory. A path found in more
+    # than one partial is written once, from the first partial given.
+    # A manifest is written next to the merged report with the SHA256 and
+    # row count of each partial and of the merged report, and a digest
+    # over the partial entries, so the set of partials that made the
+    # report can be checked later
+    #
+    # Input: partialFiles = partial reports, csv, csv.gz or SQLite
+    #        mergedFile = the report to write
+    #        reportFormat = format of the merged report
+    #
+    # Actions:
+    # returns (rows written, duplicate paths dropped, duplicate paths
+    # whose rows differed, manifest digest), raises ValueError when the partials do not
+    # share a header or one is not in walk order
+    #
+    readers = [_report.ReportRows(fileName) for fileName in partialFiles]
+    headers = [next(reader, None) for reader in readers]
+    header = headers[0]
+    for fileName, partialHeader in zip(partialFiles, headers):
+        if partialHeader is None or partialHeader != header:
+            raise ValueError('partial report has a different header: '+ fileName)
+    if 'Path' not in header:
+        raise ValueError('partial report has no Path column: '+ partialFiles[0])
+    pathColumn = header.index('Path')
+    rowCounts = [0] * len(partialFiles)
+
+    def Keyed(reader, partial):
+        lastKey = None
+        for row in reader:
+            key = _pfish.WalkOrderKey(row[pathColumn], members=True)
+            if lastKey is not None and key < lastKey:
+                raise ValueError('partial report is not in walk order: '+ partialFiles[partial])
+            lastKey = key
+            rowCounts[partial] += 1
+            yield key, partial, row
+
+    if reportFormat == 'sqlite':
+        sink = _report._SQLiteSink(mergedFile, header)
+    else:
+        sink = _report._CSVSink(mergedFile, header, compressed=reportFormat == 'csv.gz')
+    rows = 0
+    duplicates = 0
+    conflicts = 0
+    batch = []
+    lastPath = None
+    lastRow = None
+    try:
+        for key, partial, row in heapq.merge(*[Keyed(reader, partial) for partial, reader in enumerate(readers)]):
+            if row[pathColumn] == lastPath:
+                duplicates += 1
+                if row != lastRow:
+                    conflicts += 1
+                continue
+            lastPath = row[pathColumn]
+            lastRow = row
+            batch.append(row)
+            rows += 1
+            if len(batch) >= MERGE_BATCH_ROWS:
+                sink.writeRows(batch)
+                batch = []
+        if batch:
+            sink.writeRows(batch)
+    finally:
+        sink.close()
+
+    partials = sorted([{'file': os.path.basename(fileName), 'rows': count, 'sha256': _FileDigest(fileName)}
+                       for fileName, count in zip(partialFiles, rowCounts)],
+                      key=lambda entry: (entry['file'], entry['sha256']))
+    manifestDigest = hashlib.sha256(''.join('%s %d %s\n' % (entry['sha256'], entry['rows'], entry['file'])
+                                            for entry in partials).encode('utf-8')).hexdigest()
+    manifest = {'merged': {'file': os.path.basename(mergedFile), 'rows': rows, 'sha256': _FileDigest(mergedFile),
+                           'duplicates': duplicates, 'conflicts': conflicts},
+                'partials': partials, 'manifestDigest': manifestDigest}
+    with open(os.path.join(os.path.dirname(mergedFile), MERGE_MANIFEST_NAME), 'w') as manifestFile:
+        json.dump(manifest, manifestFile, indent=2)
+    return rows, duplicates, conflicts, manifestDigest
+#End MergeShardReports ==================================
+
+
+def PartialSidecars(partialFiles):
+    #
+    # Name: PartialSidecars() Function
+    #
+    # Desc: Finds the block and verification sidecars written next to
+    # each partial report, fileSystemReport.shard1of4.blocks beside
+    # fileSystemReport.shard1of4.csv. A kind is only merged when every
+    # partial has one, digests or differences merged from some of the
+    # shards would pass for those of the whole tree
+    #
+    # Input: partialFiles = partial reports, in the order given
+    #
+    # Actions:
+    # returns (suffix, [sidecar of each partial]) pairs for the kinds
+    # every partial has, raises ValueError naming a missing sidecar
+    # when only some partials have one
+    #
+    extensions = sorted(_report.REPORT_EXTENSIONS.values(), key=len, reverse=True)
+    bases = []
+    for partialFile in partialFiles:
+        base = partialFile
+        for extension in extensions:
+            if base.endswith(extension):
+                base = base[:-len(extension)]
+                break
+        bases.append(base)
+    found = []
+    for suffix, merge in SHARD_SIDECARS:
+        sidecars = [base + suffix for base in bases]
+        missing = [sidecar for sidecar in sidecars if not os.path.isfile(sidecar)]
+        if len(missing) == len(sidecars):
+            continue
+        if missing:
+            raise ValueError('only some partial reports have a '+ suffix +' sidecar, missing: '+ missing[0])
+        found.append((suffix, sidecars))
+    return found
+#End PartialSidecars ====================================
+
+
+def MergeShardSidecars(partialFiles, reportPath):
+    #
+    # Name: MergeShardSidecars() Function
+    #
+    # Desc: Merges the sidecars found by PartialSidecars() into the
+    # sidecars of the merged report in reportPath
+    #
+    # Actions:
+    # returns the merged sidecar file names, raises ValueError when
+    # the sidecars of one kind cannot be merged
+    #
+    merges = dict(SHARD_SIDECARS)
+    mergedFiles = []
+    for suffix, sidecars in PartialSidecars(partialFiles):
+        mergedFile = _report.SidecarFileName(reportPath, suffix)
+        if os.path.abspath(mergedFile) in [os.path.abspath(sidecar) for sidecar in sidecars]:
+            raise ValueError('the merged sidecar would overwrite a partial one: '+ mergedFile)
+        merges[suffix](sidecars, mergedFile)
+        mergedFiles.append(mergedFile)
+    return mergedFiles
+#End MergeShardSidecars =================================
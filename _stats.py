@@ -0,0 +1,290 @@
+
+# _stats.py
+# Python One Way File System Hashing - scan statistics
+# Author: L. Konate
+
+#################################################################
+# Phase timers, rates, latency histograms and progress display for
+# hash.py and sys_file_hashing.py
+#
+# SizeClass() class _ScanStats class _TreeEstimate class _Progress
+#################################################################
+
+import sys # Python Library system specific parameters
+import json #Python Standard Library - JSON encoder and decoder
+import time #Python Standard Library - Time access and conversions functions
+import threading #Python Standard Library - Thread-based parallelism
+import _pfish # p-fish shared hashing engine
+
+# Statistics document name suffix, written next to the report
+STATS_SUFFIX = '.stats.json'
+
+# Scan phases timed. walk and stat are the directory walk in this
+# process, open, read and hash are summed over every worker, write is
+# the report writer thread
+PHASES = ('walk', 'stat', 'open', 'read', 'hash', 'write')
+
+# File size classes of the latency histograms, by upper bound
+SIZE_CLASSES = [
+    (4 * 1024, '<4K'),
+    (64 * 1024, '4K-64K'),
+    (1024 ** 2, '64K-1M'),
+    (16 * 1024 ** 2, '1M-16M'),
+    (256 * 1024 ** 2, '16M-256M'),
+    (None, '256M+'),
+]
+
+# Upper bounds, in milliseconds, of the latency histogram buckets, a
+# last bucket holds everything slower
+LATENCY_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# Seconds between progress line updates
+PROGRESS_INTERVAL = 1.0
+
+# Progress weighs each file as its size plus this many bytes, so the
+# ETA of a tree of small files is not only driven by its bytes
+PROGRESS_FILE_BYTES = 256 * 1024
+
+
+def SizeClass(size):
+    # returns the histogram class name of a file size
+    for bound, name in SIZE_CLASSES:
+        if bound is None or size < bound:
+            return name
+
+
+class _ScanStats:
+    #
+    # Class: _ScanStats
+    #
+    # Desc: Collects the figures of one scan from the walk and from each
+    # file reported. Every file carries the open, read and hash times its
+    # worker measured, so the figures are the same whether the files were
+    # hashed in this process, on threads or on worker processes. Only
+    # the report loop calls in, so no locking is needed
+    #
+    # Methods:
+    # constructor: Starts the clock
+    # timedWalk: Wraps the walk, timing the time spent in it
+    # fileDone: Adds a reported file
+    # fileFailed: Adds a file that could not be hashed
+    # elapsed: Seconds since the scan started
+    # document: Returns the statistics as a dictionary
+    # summary: Returns the headline figures as lines of text
+    # write: Writes the statistics document as JSON
+    #
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.startedAt = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.files = 0
+        self.errors = 0
+        self.filesHashed = 0
+        self.bytesHashed = 0
+        self.bytesReported = 0
+        # per size class: files, seconds, slowest, bucket counts
+        self.classes = dict((name, [0, 0.0, 0.0, [0] * (len(LATENCY_BOUNDS_MS) + 1)]) for bound, name in SIZE_CLASSES)
+        self.progress = None
+
+    def timedWalk(self, fileList):
+        # the stat phase is counted by WalkFiles() itself and taken out
+        # of the walk phase when the document is made
+        phases = self.phases
+        perf = time.perf_counter
+        iterator = iter(fileList)
+        while True:
+            startTime = perf()
+            try:
+                entry = next(iterator)
+            except StopIteration:
+                phases['walk'] += perf() - startTime
+                return
+            phases['walk'] += perf() - startTime
+            yield entry
+
+    def fileDone(self, record):
+        self.files += 1
+        size = record.stat.st_size
+        self.bytesReported += size
+        timings = record.timings
+        if timings is not None:
+            # read from disk, not answered by the cache or a hardlink
+            openTime, readTime, hashTime, totalTime = timings
+            phases = self.phases
+            phases['open'] += openTime
+            phases['read'] += readTime
+            phases['hash'] += hashTime
+            self.filesHashed += 1
+            self.bytesHashed += size
+            entry = self.classes[SizeClass(size)]
+            entry[0] += 1
+            entry[1] += totalTime
+            entry[2] = max(entry[2], totalTime)
+            milliseconds = totalTime * 1000.0
+            bucket = 0
+            for bound in LATENCY_BOUNDS_MS:
+                if milliseconds <= bound:
+                    break
+                bucket += 1
+            entry[3][bucket] += 1
+        if self.progress is not None:
+            self.progress.update()
+
+    def fileFailed(self):
+        self.errors += 1
+        if self.progress is not None:
+            self.progress.update()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def _percentile(self, counts, fraction):
+        # upper bound of the bucket holding the fraction, in milliseconds
+        target = sum(counts) * fraction
+        seen = 0
+        for bucket, count in enumerate(counts):
+            seen += count
+            if count and seen >= target:
+                return LATENCY_BOUNDS_MS[bucket] if bucket < len(LATENCY_BOUNDS_MS) else None
+        return None
+
+    def document(self, settings=None):
+        elapsed = max(self.elapsed(), 1e-9)
+        phases = dict(self.phases)
+        phases['walk'] = max(phases['walk'] - phases['stat'], 0.0)
+        histograms = {}
+        labels = ['<=%dms' % bound for bound in LATENCY_BOUNDS_MS] + ['>%dms' % LATENCY_BOUNDS_MS[-1]]
+        for bound, name in SIZE_CLASSES:
+            files, seconds, slowest, counts = self.classes[name]
+            if not files:
+                continue
+            histograms[name] = {'files': files, 'meanMs': round(seconds / files * 1000.0, 3),
+                                'maxMs': round(slowest * 1000.0, 3),
+                                'p50Ms': self._percentile(counts, 0.5), 'p99Ms': self._percentile(counts, 0.99),
+                                'latency': dict((label, count) for label, count in zip(labels, counts) if count)}
+        return {'started': self.startedAt, 'elapsedSeconds': round(elapsed, 3), 'settings': settings or {},
+                'files': self.files, 'errors': self.errors, 'filesHashed': self.filesHashed,
+                'bytesHashed': self.bytesHashed, 'bytesReported': self.bytesReported,
+                'filesPerSecond': round(self.files / elapsed, 1),
+                'bytesPerSecond': round(self.bytesHashed / elapsed, 1),
+                'phaseSeconds': dict((name, round(seconds, 3)) for name, seconds in phases.items()),
+                'latencyBySize': histograms}
+
+    def summary(self):
+        elapsed = max(self.elapsed(), 1e-9)
+        phases = self.document()['phaseSeconds']
+        return ['Rate: %.1f files/s %.2f MB/s' % (self.files / elapsed, self.bytesHashed / elapsed / (1024.0 * 1024.0)),
+                'Phase Seconds: '+ ' '.join('%s:%.2f' % (name, phases[name]) for name in PHASES)]
+
+    def write(self, fileName, settings=None):
+        with open(fileName, 'w') as statsFile:
+            json.dump(self.document(settings), statsFile, indent=2)
+
+#End _ScanStats =========================================
+
+
+class _TreeEstimate:
+    #
+    # Class: _TreeEstimate
+    #
+    # Desc: Counts the files and bytes a scan will cover on a background
+    # thread, with the same walk and filters but without opening a file,
+    # so the progress line can give an ETA once the count is in. The
+    # scan's own walk then mostly finds the directories in the cache.
+    # A resumed scan is counted from the same path as its walk, so the
+    # totals hold only what is left to do. It is a second walk of the
+    # tree, so it is only made when asked for with --estimate
+    #
+    # Methods:
+    # constructor: Starts the counting thread
+    # totals: Returns (files, bytes), or None while still counting
+    #
+    def __init__(self, rootPath, walkFilter=None, resumeAfter=None):
+        self.rootPath = rootPath
+        self.walkFilter = walkFilter
+        self.resumeAfter = resumeAfter
+        self.result = None
+        self.thread = threading.Thread(target=self._run, name='TreeEstimate', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        files = 0
+        totalBytes = 0
+        for theFile, simpleName, st in _pfish.WalkFiles(self.rootPath, self.resumeAfter, self.walkFilter):
+            files += 1
+            if st is not None:
+                totalBytes += st.st_size
+        self.result = (files, totalBytes)
+
+    def totals(self):
+        return self.result
+
+#End _TreeEstimate ======================================
+
+
+class _Progress:
+    #
+    # Class: _Progress
+    #
+    # Desc: Redraws one progress line, at most every PROGRESS_INTERVAL
+    # seconds, with the files and bytes done, the current rates and,
+    # once the totals are known, the percentage and ETA. The totals are
+    # fixed, from a shard plan, or come from a _TreeEstimate. doneBefore
+    # is the (files, bytes) a resumed scan had reported before it was
+    # interrupted, counted as done against fixed totals but not in the
+    # rates
+    #
+    # Methods:
+    # constructor: Takes the scan statistics and where the totals come from
+    # update: Redraws the line when the interval has passed
+    # finish: Draws the last line and ends it
+    #
+    def __init__(self, stats, totals=None, estimate=None, stream=None, doneBefore=(0, 0)):
+        self.stats = stats
+        self.fixedTotals = totals
+        self.estimate = estimate
+        self.doneBefore = doneBefore
+        self.stream = stream or sys.stderr
+        self.lastDraw = 0.0
+        self.width = 0
+
+    def update(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.lastDraw < PROGRESS_INTERVAL:
+            return
+        self.lastDraw = now
+        stats = self.stats
+        elapsed = max(stats.elapsed(), 1e-9)
+        done = stats.files + stats.errors
+        line = '%d files %.1f MB  %.1f files/s %.2f MB/s' % (done, stats.bytesReported / (1024.0 * 1024.0),
+                                                              done / elapsed,
+                                                              stats.bytesHashed / elapsed / (1024.0 * 1024.0))
+        totals = self.fixedTotals
+        doneBefore = self.doneBefore
+        if totals is None and self.estimate is not None:
+            # an estimate counts only what this run walks
+            totals = self.estimate.totals()
+            doneBefore = (0, 0)
+        if totals is not None:
+            totalFiles, totalBytes = totals
+            work = totalBytes + totalFiles * PROGRESS_FILE_BYTES
+            workNow = stats.bytesReported + done * PROGRESS_FILE_BYTES
+            workDone = workNow + doneBefore[1] + doneBefore[0] * PROGRESS_FILE_BYTES
+            if work > 0 and workNow > 0:
+                fraction = min(workDone / float(work), 1.0)
+                # the rate is this run's, the work before it took no time
+                remaining = max(work - workDone, 0) * elapsed / workNow
+                line += '  %.1f%%  ETA %d:%02d:%02d' % (fraction * 100.0, remaining // 3600,
+                                                        remaining % 3600 // 60, remaining % 60)
+        elif self.estimate is not None:
+            line += '  counting files...'
+        self.stream.write('\r'+ line.ljust(self.width))
+        self.stream.flush()
+        self.width = len(line)
+
+    def finish(self):
+        self.update(force=True)
+        self.stream.write('\n')
+        self.stream.flush()
+
+#End _Progress ==========================================
@@ -17,7 +17,9 @@
 # No HASP required
 
 import os
+import time
 import _modEXIF
+import _profile
 import _csvHandler
 import _commandParser
 from classLogging import _ForensicLog
@@ -33,8 +35,15 @@ def main():
     userArgs = _commandParser.CommandLineInterface()
     # create a log object
     logPath = userArgs.logPath+"ForensicLog.txt"
-    oLog = _ForensicLog(logPath)
+    oLog = _ForensicLog(logPath, userArgs.log_format)
     oLog.writeLog("INFO", "Scan Started")
+    profiler = None
+    if userArgs.profile:
+        profiler = _profile._Profiler(userArgs.csvPath+"imageResults", userArgs.profile_top)
+        profiler.start()
+    slowFiles = None
+    if userArgs.trace_slow_files is not None:
+        slowFiles = _profile._SlowFileTracer(userArgs.trace_slow_files, lambda message: oLog.writeLog("WARNING", message))
     csvPath = userArgs.csvPath+"imageResults.csv"
     oCSV = _csvHandler._CSVWriter(csvPath)
     # define a directory to scan
@@ -49,6 +58,7 @@ def main():
     print ()
     for aFile in picts:
         targetFile = scanDir+aFile
+        startTime = time.perf_counter()
         if os.path.isfile(targetFile):
             gpsDictionary, EXIFList = _modEXIF.ExtractGPSDictionary (targetFile)
             if (gpsDictionary):
@@ -72,12 +82,20 @@ def main():
                 oLog.writeLog("WARNING", "No GPS EXIF Data for "+ targetFile)
         else:
             oLog.writeLog("WARNING", targetFile + " not a valid file")
+        if slowFiles is not None:
+            slowFiles.check(targetFile, time.perf_counter() - startTime)
+    if slowFiles is not None:
+        oLog.writeLog("INFO", slowFiles.summary())
+    if profiler is not None:
+        statsFile, summaryFile = profiler.stop()
+        oLog.writeLog("INFO", "Profile:"+ statsFile +" Summary:"+ summaryFile)
     # Clean up and Close Log and CSV File
     del oLog
     del oCSV
 
 import argparse # Python Standard Library - Parser for command-line options, arguments
 import os # Standard Library OS functions
+import _logQueue # p-fish background logging
 # Name: ParseCommand() Function
 # Desc: Process and Validate the command line arguments
 # use Python Standard Library module argparse
@@ -93,6 +111,10 @@ def CommandLineInterface():
     parser.add_argument('-l','--logPath', type= ValidateDirectory,required=True, help="specify the directory for forensic log output file")
     parser.add_argument('-c','--csvPath', type= ValidateDirectory, required=True, help="specify the output directory for the csv file")
     parser.add_argument('-d','--scanPath', type= ValidateDirectory, required=True, help="specify the directory to scan")
+    parser.add_argument('--log-format', choices=_logQueue.LOG_FORMATS, default='text', help="forensic log as time and message lines, or as one JSON object per line")
+    parser.add_argument('--profile', help="run under cProfile and write imageResults"+ _profile.PROFILE_SUFFIX +" and a summary of the hottest functions to the csv directory", action='store_true')
+    parser.add_argument('--profile-top', type=int, default=_profile.DEFAULT_PROFILE_TOP, metavar='N', help="functions listed in the profile summary")
+    parser.add_argument('--trace-slow-files', type= _profile.ValidateMilliseconds, metavar='MS', help="log every image that took longer than MS milliseconds to process")
     args = parser.parse_args()
     return args
 
@@ -111,20 +133,23 @@ def ValidateDirectory(theDir):
 #End ValidateDirectory ===================================
 
 import logging
+import _logQueue # p-fish background logging
 #
 # Class: _ForensicLog
 #
-# Desc: Handles Forensic Logging Operations
+# Desc: Handles Forensic Logging Operations. Records are queued and
+# written in batches by a background thread, see _logQueue
 #
-# Methods constructor: Initializes the Logger
+# Methods constructor: Initializes the Logger, in text or json format
 # writeLog: Writes a record to the log
 # destructor: Writes an information message and shuts down the logger
 
 class _ForensicLog:
-    def __init__(self, logName):
+    def __init__(self, logName, logFormat='text'):
         try:
             # Turn on Logging
-            logging.basicConfig(filename=logName,level=logging.DEBUG,format='%(asctime)s %(message)s')
+            self.logService = _logQueue._QueueLogging(logging.DEBUG)
+            self.logService.start(logName, logFormat)
         except:
             print ("Forensic Log Initialization Failed . . . Aborting")
             exit(0)
@@ -142,7 +167,7 @@ class _ForensicLog:
     
     def __del__(self):
         logging.info("Logging Shutdown")
-        logging.shutdown()
+        self.logService.stop()
 
 #End _ForensicLog =========================================        
 
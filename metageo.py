@@ -1,6 +1,8 @@
 
 import os
+import time
 import argparse
+import _profile
 from PIL import Image
 from PIL.ExifTags import TAGS, GPSTAGS
 
@@ -9,6 +11,9 @@ def CommandLineInterface():
     parser.add_argument('-v','--verbose', help="enables printing of additional program messages", action='store_true')
     parser.add_argument('-c','--csvPath', type= ValidateDirectory, required=True, help="specify the output directory for the csv file")
     parser.add_argument('-d','--scanPath', type= ValidateDirectory, required=True, help="specify the directory to scan")
+    parser.add_argument('--profile', help="run under cProfile and write imageResults"+ _profile.PROFILE_SUFFIX +" and a summary of the hottest functions to the csv directory", action='store_true')
+    parser.add_argument('--profile-top', type=int, default=_profile.DEFAULT_PROFILE_TOP, metavar='N', help="functions listed in the profile summary")
+    parser.add_argument('--trace-slow-files', type= _profile.ValidateMilliseconds, metavar='MS', help="report every image that took longer than MS milliseconds to process")
     args = parser.parse_args()
     return args
 
@@ -136,6 +141,13 @@ def main():
     MODEL = 2
     # Process the Command Line Arguments
     userArgs = CommandLineInterface()
+    profiler = None
+    if userArgs.profile:
+        profiler = _profile._Profiler(userArgs.csvPath+"imageResults", userArgs.profile_top)
+        profiler.start()
+    slowFiles = None
+    if userArgs.trace_slow_files is not None:
+        slowFiles = _profile._SlowFileTracer(userArgs.trace_slow_files, print)
     csvPath = userArgs.csvPath+"imageResults.csv"
     csvOut = CSVWriter(csvPath)
     # define a directory to scan
@@ -149,6 +161,7 @@ def main():
     print ("Program Start\n")
     for aFile in picList:
         targetFile = scanDir+aFile
+        startTime = time.perf_counter()
         if os.path.isfile(targetFile):
             gpsDictionary, EXIFList = ExtractGPSDictionary (targetFile)
             if (gpsDictionary):
@@ -171,6 +184,13 @@ def main():
                 print("No GPS EXIF Data for "+ targetFile)
         else:
             print(targetFile + " is not a valid file")
+        if slowFiles is not None:
+            slowFiles.check(targetFile, time.perf_counter() - startTime)
+    if slowFiles is not None:
+        print(slowFiles.summary())
+    if profiler is not None:
+        statsFile, summaryFile = profiler.stop()
+        print("Profile:"+ statsFile +" Summary:"+ summaryFile)
     # Clean up and Close Log and CSV File
     del csvOut
 
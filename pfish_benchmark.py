@@ -0,0 +1,455 @@
+# pfish_benchmark.py
+# Python One Way File System Hashing - benchmark suite
+# Author: L. Konate
+
+#################################################################
+# Runs the p-fish scan paths over a deterministic synthetic evidence
+# tree and writes files/s, MB/s and peak memory of each to JSON, so
+# a new version can be compared against the last one before it is
+# rolled onto acquisition hosts
+#
+# CommandLineInterface() ScenarioNames() PeakRSS() RunScenario() IsolatedRun()
+# WarmCache() CopySavings() RunBenchmarks() RunSpread() CompareResults() ValidateScale() ValidateDirectoryWritable()
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import sys # Python Library system specific parameters
+import json #Python Standard Library - JSON encoder and decoder
+import time #Python Standard Library - Time access and conversions functions
+import shutil #Python Standard Library - High-level file operations
+import argparse #Python Standard Library - Parser for commandline options, arguments
+import platform #Python Standard Library - Access to underlying platform's identifying data
+import tempfile #Python Standard Library - Generate temporary files and directories
+import traceback #Python Standard Library - Print or retrieve a stack traceback
+import subprocess #Python Standard Library - Subprocess management
+import multiprocessing #Python Standard Library - Process-based parallelism
+import _pfish # p-fish shared hashing engine
+import _stats # p-fish scan statistics
+import _report # p-fish report writer
+import _corpus # p-fish synthetic evidence trees
+
+try:
+    import resource #Python Standard Library - Resource usage information (Unix only)
+except ImportError:
+    resource = None
+
+# Times each scenario is run, the median run is reported
+DEFAULT_REPEAT = 3
+
+# Percentage a rate may drop, or peak memory grow, against the
+# baseline before --compare calls it a regression
+DEFAULT_TOLERANCE = 10.0
+
+# --compare only judges a rate when both results hold at least this
+# many runs of the scenario and their median runs took this long, a
+# single short run moves by more than the tolerance from one run to
+# the next. A change within the spread of the runs is noise whatever
+# the tolerance
+COMPARE_MIN_RUNS = 3
+COMPARE_MIN_SECONDS = 0.05
+
+# Verdicts of CompareResults()
+REGRESSION = 'REGRESSION'
+WITHIN_NOISE = 'within noise'
+TOO_FEW_RUNS = 'too few or too short runs to judge'
+
+# Thread count of the threads scenario, as for a network mount
+BENCHMARK_THREADS = 8
+
+# The pair of scenarios hashing the huge files with SHA256, through
+# the read buffer and from a memory map, whose difference is the cost
+# of copying the bytes out of the page cache
+COPY_SCENARIOS = ('huge-read', 'huge-mmap')
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def CommandLineInterface():
+    #
+    # Name: CommandLineInterface() Function
+    #
+    # Desc: Processes the command line and establishes the global
+    # gl_args where any of the functions can obtain argument information
+    #
+    global gl_args
+    parser = argparse.ArgumentParser('p-fish benchmark suite')
+    parser.add_argument('-c', '--corpus', type= ValidateDirectoryWritable, required=True, help="directory holding the synthetic corpora, one per seed and scale, built on first use")
+    parser.add_argument('-o', '--output', help="results file (default corpus/benchmark-<date>-<time>.json)")
+    parser.add_argument('--seed', type=int, default=_corpus.DEFAULT_SEED, help="corpus random seed (default %d)" % _corpus.DEFAULT_SEED)
+    parser.add_argument('--scale', type= ValidateScale, default=1.0, help="multiplier of the corpus file counts and sizes, 1.0 is about 300 MB (default 1.0)")
+    parser.add_argument('--scenario', action='append', choices=ScenarioNames(), help="scenario to run, may be repeated (default all)")
+    parser.add_argument('--repeat', type= _pfish.ValidateWorkers, default=DEFAULT_REPEAT, help="runs of each scenario, the median is reported (default %d)" % DEFAULT_REPEAT)
+    parser.add_argument('--chunk-size', type= _pfish.ValidateChunkSize, default=_pfish.DEFAULT_CHUNK_SIZE, help="read buffer size of the hashing scenarios (default 1M)")
+    parser.add_argument('--compare', metavar='FILE', help="results of an earlier run, exit with status 1 when a scenario regressed by more than the tolerance and the spread of its runs. Rates are judged with --repeat %d or more" % COMPARE_MIN_RUNS)
+    parser.add_argument('--tolerance', type= _pfish.ValidatePercent, default=DEFAULT_TOLERANCE, metavar='PERCENT', help="rate drop or memory growth allowed by --compare (default %g)" % DEFAULT_TOLERANCE)
+    parser.add_argument('--generate-only', help='build the corpus and exit', action='store_true')
+    gl_args = parser.parse_args()
+    if gl_args.compare and not os.path.isfile(gl_args.compare):
+        parser.error('--compare file does not exist: '+ gl_args.compare)
+#End CommandLineInterface ===============================
+
+
+def ScenarioNames():
+    # walk only, each algorithm alone, every algorithm in one read, the
+    # process and thread pools, the huge files read and memory mapped,
+    # the hash.py script end to end and the EXIF extraction of metageo.py
+    return (['walk'] + ['hash-'+ option for option, hashType in _pfish.HASH_OPTIONS]
+            + ['hash-all', 'workers', 'threads'] + list(COPY_SCENARIOS) + ['script', 'exif'])
+
+
+def PeakRSS():
+    # peak resident memory in bytes of this process or of the largest
+    # process it waited for, None where the platform does not say
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def RunScenario(name, corpusPath, chunkSize):
+    #
+    # Name: RunScenario() Function
+    #
+    # Desc: Runs one scenario over the corpus and measures it. The
+    # hashing scenarios go through the same WalkFiles() and scan
+    # functions as hash.py, with the hardlink tracker it always uses
+    #
+    # Input: name = one of ScenarioNames()
+    #        corpusPath = root of the corpus
+    #        chunkSize = read buffer size
+    #
+    # Actions:
+    # returns a dictionary of the figures, bytes is 0 for the scenarios
+    # that do not read file contents. The scenarios hashing in this
+    # process also give bytesCopied, the bytes that went through the
+    # read buffer rather than being hashed from a memory map
+    #
+    files = 0
+    errors = 0
+    totalBytes = 0
+    bytesCopied = None
+    phases = None
+    startTime = time.perf_counter()
+    if name == 'walk':
+        for theFile, simpleName, st in _pfish.WalkFiles(corpusPath):
+            files += 1
+    elif name == 'exif':
+        try:
+            import metageo # GPS extraction, needs PIL
+        except ImportError as err:
+            return {'skipped': str(err)}
+        startTime = time.perf_counter()
+        for theFile, simpleName, st in _pfish.WalkFiles(os.path.join(corpusPath, 'jpeg')):
+            try:
+                gpsDictionary, exifList = metageo.ExtractGPSDictionary(theFile)
+                if gpsDictionary:
+                    metageo.ExtractLatLon(gpsDictionary)
+                files += 1
+            except Exception:
+                # counted rather than fatal, so a regression in the
+                # error rate shows up next to the timing
+                errors += 1
+    elif name == 'script':
+        reportPath = tempfile.mkdtemp(prefix='pfish-benchmark-')
+        try:
+            subprocess.run([sys.executable, os.path.join(SCRIPT_DIRECTORY, 'hash.py'), '--sha256',
+                            '--chunk-size', str(chunkSize), '-d', corpusPath, '-r', os.path.join(reportPath, '')],
+                           cwd=reportPath, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            with open(_report.SidecarFileName(reportPath, _stats.STATS_SUFFIX)) as statsFile:
+                document = json.load(statsFile)
+        finally:
+            shutil.rmtree(reportPath)
+        files = document['files']
+        errors = document['errors']
+        totalBytes = document['bytesHashed']
+        phases = document['phaseSeconds']
+    else:
+        hashTypes = [hashType for option, hashType in _pfish.HASH_OPTIONS if name == 'hash-'+ option]
+        if not hashTypes:
+            hashTypes = [hashType for option, hashType in _pfish.HASH_OPTIONS
+                         if name == 'hash-all' or hashType == 'SHA256']
+        stats = _stats._ScanStats()
+        rootPath = os.path.join(corpusPath, 'huge') if name in COPY_SCENARIOS else corpusPath
+        fileList = stats.timedWalk(_pfish.WalkFiles(rootPath, None, None, stats.phases))
+        linkTracker = _pfish._LinkTracker()
+        engine = None
+        if name == 'workers':
+            results = _pfish.ParallelScan(fileList, max(2, os.cpu_count() or 1), hashTypes, chunkSize,
+                                          None, linkTracker)
+        elif name == 'threads':
+            results = _pfish.ThreadedScan(fileList, BENCHMARK_THREADS, hashTypes, chunkSize, None, None,
+                                          linkTracker)
+        else:
+            engine = _pfish._HashEngine(hashTypes, chunkSize, mmapThreshold=0 if name == 'huge-mmap' else None)
+            results = _pfish.SequentialScan(fileList, engine, None, linkTracker)
+        for theFile, record, message in results:
+            if record is None:
+                stats.fileFailed()
+            else:
+                stats.fileDone(record)
+        files = stats.files
+        errors = stats.errors
+        totalBytes = stats.bytesHashed
+        if engine is not None:
+            bytesCopied = totalBytes - engine.mappedBytes
+        phases = stats.document()['phaseSeconds']
+    seconds = max(time.perf_counter() - startTime, 1e-9)
+    result = {'files': files, 'errors': errors, 'bytes': totalBytes, 'seconds': round(seconds, 4),
+              'filesPerSecond': round(files / seconds, 1),
+              'MBPerSecond': round(totalBytes / seconds / (1024.0 * 1024.0), 2) if totalBytes else None,
+              'peakRSS': PeakRSS()}
+    if bytesCopied is not None:
+        result['bytesCopied'] = bytesCopied
+    if phases is not None:
+        result['phaseSeconds'] = phases
+    return result
+#End RunScenario ========================================
+
+
+def _ScenarioProcess(sender, name, corpusPath, chunkSize):
+    # body of the process IsolatedRun() starts
+    try:
+        sender.send(RunScenario(name, corpusPath, chunkSize))
+    except Exception:
+        sender.send({'error': traceback.format_exc()})
+    sender.close()
+
+
+def IsolatedRun(name, corpusPath, chunkSize):
+    #
+    # Name: IsolatedRun() Function
+    #
+    # Desc: Runs a scenario in a freshly spawned process, so its peak
+    # memory is its own and no state is carried over from the scenario
+    # before it. Not a pool process, as the workers scenario starts a
+    # pool of its own
+    #
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_ScenarioProcess, args=(sender, name, corpusPath, chunkSize))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        result = {'error': 'scenario process ended with exit code '+ str(process.exitcode)}
+    return result
+#End IsolatedRun ========================================
+
+
+def WarmCache(corpusPath):
+    # reads the corpus once so every scenario, including the first,
+    # starts with it in the page cache
+    engine = _pfish._HashEngine(['MD5'])
+    for result in _pfish.SequentialScan(_pfish.WalkFiles(corpusPath), engine):
+        pass
+
+
+def CopySavings(results):
+    #
+    # Name: CopySavings() Function
+    #
+    # Desc: Compares the huge-read and huge-mmap results, when both ran,
+    # to show what hashing from a memory map saved
+    #
+    # Input: results = scenario results by name
+    #
+    # Actions:
+    # returns a dictionary of the bytes not copied and the change in
+    # MB/s, seconds and peak memory, or None
+    #
+    read, mapped = (results.get(name) for name in COPY_SCENARIOS)
+    if not read or not mapped or 'bytesCopied' not in read or 'bytesCopied' not in mapped:
+        return None
+    savings = {'bytesNotCopied': read['bytesCopied'] - mapped['bytesCopied'],
+               'MBPerSecondChange': None, 'secondsSaved': round(read['seconds'] - mapped['seconds'], 4),
+               'peakRSSChange': None}
+    if read['MBPerSecond'] and mapped['MBPerSecond']:
+        savings['MBPerSecondChange'] = round((mapped['MBPerSecond'] - read['MBPerSecond']) * 100.0
+                                             / read['MBPerSecond'], 1)
+    if read['peakRSS'] and mapped['peakRSS']:
+        savings['peakRSSChange'] = mapped['peakRSS'] - read['peakRSS']
+    return savings
+#End CopySavings ========================================
+
+
+def RunBenchmarks(corpusPath, manifest, scenarios):
+    #
+    # Name: RunBenchmarks() Function
+    #
+    # Desc: Runs every scenario gl_args.repeat times and keeps the
+    # median run by elapsed time, printing one line per scenario
+    #
+    # Actions:
+    # returns the results document
+    #
+    print('Corpus:'+ corpusPath +' Files:'+ str(manifest['files']) +' Bytes:'+ str(manifest['bytes']))
+    WarmCache(corpusPath)
+    results = {}
+    for name in scenarios:
+        runs = [IsolatedRun(name, corpusPath, gl_args.chunk_size) for repeat in range(gl_args.repeat)]
+        failed = [run for run in runs if 'error' in run or 'skipped' in run]
+        if failed:
+            results[name] = failed[0]
+            print('%-14s %s' % (name, 'skipped: '+ failed[0]['skipped'] if 'skipped' in failed[0] else 'FAILED'))
+            if 'error' in failed[0]:
+                print(failed[0]['error'])
+            continue
+        runs.sort(key=lambda run: run['seconds'])
+        result = dict(runs[len(runs) // 2])
+        result['runs'] = [dict((key, run[key]) for key in ('seconds', 'filesPerSecond', 'MBPerSecond', 'peakRSS'))
+                          for run in runs]
+        results[name] = result
+        print('%-14s %10.1f files/s %10s MB/s %8s MB peak %s' % (
+            name, result['filesPerSecond'], '-' if result['MBPerSecond'] is None else '%.2f' % result['MBPerSecond'],
+            '-' if result['peakRSS'] is None else '%.1f' % (result['peakRSS'] / (1024.0 * 1024.0)),
+            '(%d errors)' % result['errors'] if result['errors'] else ''))
+    savings = CopySavings(results)
+    if savings is not None:
+        print('Memory Map: %.1f MB not copied, %s%% MB/s, %+.3fs, %s MB peak' % (
+            savings['bytesNotCopied'] / (1024.0 * 1024.0),
+            '-' if savings['MBPerSecondChange'] is None else '%+.1f' % savings['MBPerSecondChange'],
+            -savings['secondsSaved'],
+            '-' if savings['peakRSSChange'] is None else '%+.1f' % (savings['peakRSSChange'] / (1024.0 * 1024.0))))
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPT_DIRECTORY, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'started': time.strftime('%Y-%m-%d %H:%M:%S'), 'revision': revision,
+            'host': {'node': platform.node(), 'platform': platform.platform(), 'machine': platform.machine(),
+                     'python': platform.python_version(), 'cpus': os.cpu_count()},
+            'corpus': dict(manifest, path=corpusPath),
+            'settings': {'repeat': gl_args.repeat, 'chunkSize': gl_args.chunk_size, 'cache': 'warm'},
+            'results': results, 'copySavings': savings}
+#End RunBenchmarks ======================================
+
+
+def RunSpread(result, measure):
+    # spread of a measure over the runs of one scenario, as a percentage
+    # of their median, 0 when there is a single run
+    values = sorted(run[measure] for run in result.get('runs', []) if run.get(measure))
+    if len(values) < 2:
+        return 0.0
+    return (values[-1] - values[0]) * 100.0 / values[len(values) // 2]
+
+
+def CompareResults(baseline, current, tolerance):
+    #
+    # Name: CompareResults() Function
+    #
+    # Desc: Compares the scenarios found in both results documents. The
+    # rate compared is MB/s, or files/s for scenarios that read no file
+    # contents. A rate down by more than tolerance percent, or a peak
+    # memory up by more than it, is a regression, unless the change is
+    # within the spread of the runs of either result. Rates of results
+    # with fewer than COMPARE_MIN_RUNS runs, or runs shorter than
+    # COMPARE_MIN_SECONDS, are reported but never called regressions
+    #
+    # Input: baseline, current = results documents
+    #        tolerance = percentage allowed
+    #
+    # Actions:
+    # returns a list of (scenario, measure, baseline, current, change
+    # percent, verdict) tuples, verdict is REGRESSION, WITHIN_NOISE,
+    # TOO_FEW_RUNS or '' for a change within the tolerance
+    #
+    def Verdict(measure, change, worse, judged=True):
+        if not worse:
+            return ''
+        if not judged:
+            return TOO_FEW_RUNS
+        if abs(change) <= max(RunSpread(before, measure), RunSpread(result, measure)):
+            return WITHIN_NOISE
+        return REGRESSION
+
+    changes = []
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if before is None or 'filesPerSecond' not in before or 'filesPerSecond' not in result:
+            continue
+        judged = all(len(side.get('runs', [])) >= COMPARE_MIN_RUNS and side['seconds'] >= COMPARE_MIN_SECONDS
+                     for side in (before, result))
+        measure = 'MBPerSecond' if result['MBPerSecond'] and before['MBPerSecond'] else 'filesPerSecond'
+        if before[measure]:
+            change = (result[measure] - before[measure]) * 100.0 / before[measure]
+            changes.append((name, measure, before[measure], result[measure], change,
+                            Verdict(measure, change, change < -tolerance, judged)))
+        if before['peakRSS'] and result['peakRSS']:
+            change = (result['peakRSS'] - before['peakRSS']) * 100.0 / before['peakRSS']
+            changes.append((name, 'peakRSS', before['peakRSS'], result['peakRSS'], change,
+                            Verdict('peakRSS', change, change > tolerance)))
+    return changes
+#End CompareResults =====================================
+
+
+def ValidateScale(theScale):
+    #
+    # Name: ValidateScale Function
+    #
+    # Desc: Function that will validate a corpus scale given on the
+    # command line. Used for argument validation only
+    #
+    # Actions:
+    # if valid it will return the scale as a float
+    # if invalid it will raise an ArgumentTypeError within argparse
+    #
+    try:
+        scale = float(theScale)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Scale is not a number!')
+    if scale <= 0.0:
+        raise argparse.ArgumentTypeError('Scale must be above 0!')
+    return scale
+#End ValidateScale ======================================
+
+
+def ValidateDirectoryWritable(theDir):
+    #
+    # Name: ValidateDirectoryWritable Function
+    #
+    # Desc: Function that will validate a directory path as
+    # existing and writable. Used for argument validation only
+    #
+    # Actions:
+    # if valid it will return the Directory String
+    # if invalid it will raise an ArgumentTypeError within argparse
+    #
+    if not os.path.isdir(theDir):
+        raise argparse.ArgumentTypeError('Directory does not exist!')
+    if os.access(theDir, os.W_OK):
+        return theDir
+    else:
+        raise argparse.ArgumentTypeError('Directory is not writable!')
+#End ValidateDirectoryWritable ==========================
+
+
+if __name__ =='__main__':
+    CommandLineInterface()
+    corpusPath, manifest = _corpus.BuildCorpus(gl_args.corpus, gl_args.seed, gl_args.scale)
+    if gl_args.generate_only:
+        print('Corpus:'+ corpusPath +' Files:'+ str(manifest['files']) +' Bytes:'+ str(manifest['bytes'])
+              +' Layout:'+ manifest['layoutDigest'])
+        sys.exit(0)
+    document = RunBenchmarks(corpusPath, manifest, gl_args.scenario or ScenarioNames())
+    outputFile = gl_args.output or os.path.join(gl_args.corpus, time.strftime('benchmark-%Y%m%d-%H%M%S.json'))
+    with open(outputFile, 'w') as f:
+        json.dump(document, f, indent=2)
+    print('Results:'+ outputFile)
+    if gl_args.compare:
+        with open(gl_args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('corpus', {}).get('layoutDigest') != manifest['layoutDigest']:
+            print('Warning: the baseline was run on a different corpus')
+        if gl_args.repeat < COMPARE_MIN_RUNS:
+            print('Warning: rates are only judged with --repeat %d or more' % COMPARE_MIN_RUNS)
+        regressed = False
+        for name, measure, before, after, change, verdict in CompareResults(baseline, document, gl_args.tolerance):
+            print('%-14s %-14s %14s -> %-14s %+7.1f%% %s' % (name, measure, before, after, change, verdict))
+            regressed = regressed or verdict == REGRESSION
+        sys.exit(1 if regressed else 0)
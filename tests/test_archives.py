@@ -0,0 +1,86 @@
+
+# tests/test_archives.py
+# Python One Way File System Hashing - archive member hashing
+# Author: L. Konate
+
+#################################################################
+# Checks the archive scan of hash.py: members are hashed from the
+# decompressing stream, the read limits only count the archive's
+# bytes on disk, and --archive-max-size stops a decompression bomb.
+# Run with python -m pytest tests
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import io #Python Standard Library - Core tools for working with streams
+import csv #Python Standard Library - reader and writer for csv files
+import sys # Python Library system specific parameters
+import gzip #Python Standard Library - Support for gzip files
+import time #Python Standard Library - Time access and conversions functions
+import hashlib #Python Standard Library - Secure hashes and message digests
+import tarfile #Python Standard Library - Read and write tar archive files
+import zipfile #Python Standard Library - Work with ZIP archives
+import subprocess #Python Standard Library - Subprocess management
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HASH_SCRIPT = os.path.join(REPO_DIRECTORY, 'hash.py')
+
+# A member that compresses to a few KB, so only its expanded size
+# is large
+ZEROS_SIZE = 8 * 1024 * 1024
+
+
+def BuildArchives(rootPath):
+    # a ZIP, a gzipped tar and a gzip file, each holding ZEROS_SIZE
+    # zero bytes
+    os.makedirs(rootPath)
+    with zipfile.ZipFile(os.path.join(rootPath, 'zeros.zip'), 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('zeros.bin', bytes(ZEROS_SIZE))
+    with tarfile.open(os.path.join(rootPath, 'zeros.tar.gz'), 'w:gz') as archive:
+        info = tarfile.TarInfo('zeros.bin')
+        info.size = ZEROS_SIZE
+        archive.addfile(info, io.BytesIO(bytes(ZEROS_SIZE)))
+    with gzip.open(os.path.join(rootPath, 'zeros.gz'), 'wb') as archive:
+        archive.write(bytes(ZEROS_SIZE))
+
+
+def RunScan(workPath, arguments):
+    # runs hash.py in workPath and returns its report rows by path
+    completed = subprocess.run([sys.executable, HASH_SCRIPT] + arguments, cwd=workPath,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert completed.returncode == 0, completed.stderr
+    with open(os.path.join(workPath, 'fileSystemReport.csv'), newline='') as csvFile:
+        return dict((row['Path'], row) for row in csv.DictReader(csvFile)), completed.stdout
+
+
+def test_throttle_counts_archive_bytes_not_member_bytes(tmp_path):
+    # at 1M a second, charging the 24M of decompressed members would
+    # take about 23 seconds, the archives on disk are a few KB
+    rootPath = str(tmp_path / 'tree')
+    BuildArchives(rootPath)
+    for options in ([], ['--workers', '2'], ['--threads', '2']):
+        startTime = time.monotonic()
+        rows, output = RunScan(str(tmp_path), ['--md5', '--archives', '--max-bytes-per-sec', '1M',
+                                               '-d', rootPath, '-r', str(tmp_path)] + options)
+        assert time.monotonic() - startTime < 5.0, options
+        zeros = hashlib.md5(bytes(ZEROS_SIZE)).hexdigest()
+        for member in ('zeros.zip!/zeros.bin', 'zeros.tar.gz!/zeros.bin', 'zeros.gz!/zeros'):
+            assert rows[os.path.join(rootPath, member)]['MD5'] == zeros, options
+
+
+def test_archive_max_size_stops_decompression_bomb(tmp_path):
+    # members declaring more than the limit are skipped unread, a gzip
+    # file declares no size and is cut off once it expands past it
+    rootPath = str(tmp_path / 'tree')
+    BuildArchives(rootPath)
+    rows, output = RunScan(str(tmp_path), ['--md5', '--archives', '--archive-max-size', '1M',
+                                           '-d', rootPath, '-r', str(tmp_path)])
+    for archive in ('zeros.zip', 'zeros.tar.gz'):
+        assert ('Member Declares %d Bytes, Over The Expanded Size Limit:%s!/zeros.bin'
+                % (ZEROS_SIZE, os.path.join(rootPath, archive))) in output
+    assert 'Archive Expanded Past 1048576 Bytes, Remaining Members Skipped:'+ os.path.join(rootPath, 'zeros.gz') in output
+    # the archives themselves are still reported, their members are not
+    assert sorted(rows) == [os.path.join(rootPath, archive) for archive in ('zeros.gz', 'zeros.tar.gz', 'zeros.zip')]
+    # the same archives under the limit are opened
+    rows, output = RunScan(str(tmp_path), ['--md5', '--archives', '--archive-max-size', '16M',
+                                           '-d', rootPath, '-r', str(tmp_path)])
+    assert len(rows) == 6
@@ -0,0 +1,199 @@
+
+# tests/test_components.py
+# Python One Way File System Hashing - component checks
+# Author: L. Konate
+
+#################################################################
+# Checks the parts of a scan that the invariants do not reach: known
+# set lookups after an NSRL style import, baseline verification
+# statuses, block verification after a one byte edit, segment tree
+# digests against the worker count, and the log queue drained when
+# it was never started. Run with python -m pytest tests
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import csv #Python Standard Library - reader and writer for csv files
+import sys # Python Library system specific parameters
+import random #Python Standard Library - Generate pseudo-random numbers
+import hashlib #Python Standard Library - Secure hashes and message digests
+import logging #Python Standard Library - logging facility
+import subprocess #Python Standard Library - Subprocess management
+import pytest # third party test runner
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HASH_SCRIPT = os.path.join(REPO_DIRECTORY, 'hash.py')
+sys.path.insert(0, REPO_DIRECTORY)
+
+import _report # p-fish report writer
+import _pieceHash # p-fish piecewise block hashing
+import _segments # p-fish segmented hashing of huge files
+import _knownFiles # p-fish known file hash sets
+import _logQueue # p-fish background logging
+
+
+def RunScan(workPath, arguments):
+    # runs hash.py in workPath and returns its standard output
+    completed = subprocess.run([sys.executable, HASH_SCRIPT] + arguments, cwd=workPath,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert completed.returncode == 0, completed.stderr
+    return completed.stdout
+
+
+def ReadRows(fileName):
+    with open(fileName, newline='') as csvFile:
+        return list(csv.DictReader(csvFile))
+
+
+def WriteRandom(fileName, size, seed):
+    rng = random.Random(seed)
+    with open(fileName, 'wb') as f:
+        f.write(rng.getrandbits(8 * size).to_bytes(size, 'little'))
+
+
+def test_known_set_after_nsrl_import(tmp_path):
+    # NSRLFile.txt rows carry SHA-1, MD5 and CRC32 in that order, under
+    # a header line, and the same file may be listed more than once
+    rng = random.Random(7)
+    files = [(rng.getrandbits(160).to_bytes(20, 'big').hex().upper(),
+              rng.getrandbits(128).to_bytes(16, 'big').hex().upper()) for index in range(500)]
+    listFile = tmp_path / 'NSRLFile.txt'
+    lines = ['"SHA-1","MD5","CRC32","FileName","FileSize","ProductCode","OpSystemCode","SpecialCode"']
+    lines += ['"%s","%s","0A1B2C3D","file%d.dll",1024,1,"WIN",""' % (sha1, md5, index)
+              for index, (sha1, md5) in enumerate(files + files[:50])]
+    listFile.write_text('\n'.join(lines) + '\n')
+    misses = [rng.getrandbits(128).to_bytes(16, 'big').hex() for index in range(500)]
+    # with the Bloom filter and with the binary search alone
+    for bloomBits in (_knownFiles.DEFAULT_BLOOM_BITS, 0):
+        setFile = str(tmp_path / ('md5-%d.set' % bloomBits))
+        lineCount, digestCount = _knownFiles.ImportHashLists([str(listFile)], setFile, 'MD5', bloomBits)
+        assert (lineCount, digestCount) == (len(lines), len(files))
+        knownSet = _knownFiles._KnownSet(setFile)
+        try:
+            assert knownSet.hashType == 'MD5'
+            for sha1, md5 in files:
+                assert knownSet.contains(md5.lower())
+                # the SHA-1 column must not be taken for a digest
+                assert not knownSet.contains(sha1[:32].lower())
+            for digest in misses:
+                assert not knownSet.contains(digest)
+        finally:
+            knownSet.close()
+
+
+def test_baseline_verification_statuses(tmp_path):
+    rootPath = tmp_path / 'tree'
+    rootPath.mkdir()
+    for name in ('kept.bin', 'edited.bin', 'touched.bin', 'deleted.bin'):
+        WriteRandom(str(rootPath / name), 5000, name)
+    baselinePath = tmp_path / 'baseline'
+    baselinePath.mkdir()
+    RunScan(str(baselinePath), ['--md5', '-d', str(rootPath), '-r', str(baselinePath)])
+    # same size, one byte different, times put back
+    edited = rootPath / 'edited.bin'
+    st = os.stat(str(edited))
+    data = bytearray(edited.read_bytes())
+    data[1234] ^= 0xFF
+    edited.write_bytes(bytes(data))
+    os.utime(str(edited), ns=(st.st_atime_ns, st.st_mtime_ns))
+    touched = rootPath / 'touched.bin'
+    os.utime(str(touched), (st.st_atime - 86400, st.st_mtime - 86400))
+    (rootPath / 'deleted.bin').unlink()
+    WriteRandom(str(rootPath / 'added.bin'), 100, 'added')
+    output = RunScan(str(tmp_path), ['--md5', '--verify', str(baselinePath / 'fileSystemReport.csv'),
+                                     '-d', str(rootPath), '-r', str(tmp_path)])
+    rows = ReadRows(str(tmp_path / 'fileSystemReport.verify.csv'))
+    statuses = dict((row['Path'], row['Status']) for row in rows)
+    assert statuses == {str(rootPath / 'added.bin'): 'Added',
+                        str(rootPath / 'deleted.bin'): 'Removed',
+                        str(edited): 'Modified',
+                        str(touched): 'Metadata Changed'}, output
+    changed = dict((row['Path'], row['Changed']) for row in rows)
+    assert changed[str(edited)] == 'MD5'
+    assert changed[str(touched)] == 'Modified Time'
+
+
+def test_verify_blocks_finds_one_byte_edit(tmp_path):
+    rootPath = tmp_path / 'tree'
+    rootPath.mkdir()
+    theFile = str(rootPath / 'blocks.bin')
+    blockSize = 64 * 1024
+    WriteRandom(theFile, 10 * blockSize + 100, 'blocks')
+    RunScan(str(tmp_path), ['--sha256', '--piecewise', '--block-size', '64K', '-d', str(rootPath), '-r', str(tmp_path)])
+    output = RunScan(str(tmp_path), ['--verify-blocks', theFile, '-r', str(tmp_path)])
+    assert 'Blocks Verified: no changes found' in output
+    with open(theFile, 'r+b') as f:
+        f.seek(3 * blockSize + 17)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 1]))
+    output = RunScan(str(tmp_path), ['--verify-blocks', theFile, '-r', str(tmp_path), '--workers', '2'])
+    assert 'Block Mismatch:3 bytes %d-%d' % (3 * blockSize, 4 * blockSize) in output
+    assert 'Blocks Mismatched:1 of 11' in output
+    # a range clear of the edit finds nothing
+    output = RunScan(str(tmp_path), ['--verify-blocks', theFile, '--block-ranges', '0-192K', '-r', str(tmp_path)])
+    assert 'Blocks Checked:3 ' in output and 'Blocks Verified: no changes found' in output
+
+
+def test_verify_blocks_refuses_entry_off_its_merkle_root(tmp_path):
+    rootPath = tmp_path / 'tree'
+    rootPath.mkdir()
+    theFile = str(rootPath / 'blocks.bin')
+    WriteRandom(theFile, 5 * 64 * 1024, 'root')
+    RunScan(str(tmp_path), ['--sha256', '--piecewise', '--block-size', '64K', '-d', str(rootPath), '-r', str(tmp_path)])
+    entry = _pieceHash.ReadBlockEntry(_report.SidecarFileName(str(tmp_path), _pieceHash.BLOCK_SUFFIX), theFile)
+    hashType, blockSize, size, digests, root = entry
+    ranges = _pieceHash.ParseRanges(None, size)
+    reportedRoot = _report.ReportedValue(str(tmp_path), theFile, 'Merkle Root')
+    assert reportedRoot == root.hex()
+    assert _pieceHash.VerifyBlocks(theFile, entry, ranges, 1, reportedRoot) == (5, [])
+    # a digest edited in the sidecar, with or without its root made to match
+    forged = list(digests)
+    forged[2] = bytes(len(forged[2]))
+    with pytest.raises(ValueError, match='does not match its Merkle root'):
+        _pieceHash.VerifyBlocks(theFile, (hashType, blockSize, size, forged, root), ranges)
+    forgedRoot = _pieceHash.MerkleRoot(forged, hashType)
+    with pytest.raises(ValueError, match='does not match the Merkle root in the report'):
+        _pieceHash.VerifyBlocks(theFile, (hashType, blockSize, size, forged, forgedRoot), ranges, 1, reportedRoot)
+
+
+def test_tree_digest_does_not_depend_on_segment_workers(tmp_path):
+    rootPath = tmp_path / 'tree'
+    rootPath.mkdir()
+    theFile = str(rootPath / 'large.bin')
+    segmentSize = 256 * 1024
+    WriteRandom(theFile, 7 * segmentSize + 999, 'segments')
+    with open(theFile, 'rb') as f:
+        segments = []
+        while True:
+            data = f.read(segmentSize)
+            if not data:
+                break
+            segments.append([hashlib.md5(data).digest(), hashlib.sha256(data).digest()])
+    expected = [_segments.TREE_DIGEST_FORMAT % (segmentSize, digest)
+                for digest in _segments.TreeDigests(segments, ['MD5', 'SHA256'])]
+    for workers in ('1', '2', '3'):
+        reportPath = tmp_path / ('workers' + workers)
+        reportPath.mkdir()
+        RunScan(str(reportPath), ['--md5', '--sha256', '--segment-threshold', '1M', '--segment-size', '256K',
+                                  '--segment-workers', workers, '-d', str(rootPath), '-r', str(reportPath)])
+        row = ReadRows(str(reportPath / 'fileSystemReport.csv'))[0]
+        assert [row['MD5'], row['SHA256']] == expected, workers
+
+
+def test_queue_logging_drains_to_fallback_without_start(tmp_path):
+    fallbackFile = str(tmp_path / 'fallback.log')
+    root = logging.getLogger()
+    level = root.level
+    queueLogging = _logQueue._QueueLogging(fallbackFile=fallbackFile)
+    try:
+        logging.getLogger('pfish.test').warning('logged before the log file was known')
+    finally:
+        queueLogging.stop()
+        root.setLevel(level)
+    assert queueLogging.queueHandler not in root.handlers
+    with open(fallbackFile) as f:
+        assert 'logged before the log file was known' in f.read()
+    # a second stop, as at exit, writes nothing more
+    size = os.path.getsize(fallbackFile)
+    queueLogging.stop()
+    assert os.path.getsize(fallbackFile) == size
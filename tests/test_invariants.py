@@ -0,0 +1,192 @@
+
+# tests/test_invariants.py
+# Python One Way File System Hashing - scan invariants
+# Author: L. Konate
+
+#################################################################
+# Checks that every way of running a scan reports the same digests
+# and rows as a plain sequential scan of the same tree: worker
+# processes, threads, memory mapped reads, merged shards and a resumed
+# scan, and that the digests match md5sum on sparse and hardlinked
+# files. Run with python -m pytest tests
+#################################################################
+
+import os #Python Standard Library - Miscellaneous operating system interfaces
+import csv #Python Standard Library - reader and writer for csv files
+import sys # Python Library system specific parameters
+import json #Python Standard Library - JSON encoder and decoder
+import time #Python Standard Library - Time access and conversions functions
+import random #Python Standard Library - Generate pseudo-random numbers
+import shutil #Python Standard Library - High-level file operations
+import hashlib #Python Standard Library - Secure hashes and message digests
+import subprocess #Python Standard Library - Subprocess management
+import pytest # third party test runner
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HASH_SCRIPT = os.path.join(REPO_DIRECTORY, 'hash.py')
+SYS_SCRIPT = os.path.join(REPO_DIRECTORY, 'sys_file_hashing.py')
+
+# Columns that may differ between two scans of an unchanged tree,
+# reading a file can move its access time
+VOLATILE_COLUMNS = ('Access Time',)
+
+# A hardlink whose first path was hashed by another shard, or before
+# the scan was interrupted, is read again rather than reusing those
+# digests, so only the path it was hashed as may differ
+SPLIT_SCAN_COLUMNS = VOLATILE_COLUMNS + ('Hashed As',)
+
+# Scan options that must not change a single report row
+SCAN_VARIANTS = [
+    ['--workers', '3'],
+    ['--threads', '4'],
+    ['--mmap-threshold', '64K'],
+    ['--workers', '2', '--mmap-threshold', '64K'],
+    ['--chunk-size', '4K'],
+]
+
+
+def BuildTree(rootPath, seed=2019):
+    # a small tree holding the cases the scan treats specially: empty
+    # files, files around the read buffer size, a sparse file, hardlinks
+    # and several directories so a shard plan has units to split
+    rng = random.Random(seed)
+    for directory in range(6):
+        path = os.path.join(rootPath, 'dir%d' % directory, 'sub')
+        os.makedirs(path)
+        for index in range(8):
+            size = rng.choice([0, 1, 4095, 4096, 65537, 300000, 1024 * 1024 + 7])
+            with open(os.path.join(path if index % 2 else os.path.dirname(path), 'f%d.bin' % index), 'wb') as f:
+                f.write(rng.getrandbits(8 * size).to_bytes(size, 'little') if size else b'')
+    sparse = os.path.join(rootPath, 'dir0', 'sparse.img')
+    with open(sparse, 'wb') as f:
+        f.write(b'head')
+        f.seek(3 * 1024 * 1024)
+        f.write(b'middle')
+        f.truncate(8 * 1024 * 1024)
+    os.link(os.path.join(rootPath, 'dir1', 'f0.bin'), os.path.join(rootPath, 'dir2', 'link-to-f0.bin'))
+    os.link(sparse, os.path.join(rootPath, 'dir3', 'link-to-sparse.img'))
+
+
+@pytest.fixture(scope='module')
+def tree(tmp_path_factory):
+    rootPath = str(tmp_path_factory.mktemp('tree'))
+    BuildTree(rootPath)
+    return rootPath
+
+
+def RunScan(workPath, arguments, script=HASH_SCRIPT, check=True):
+    # runs a scan script in workPath, its log and reports land there
+    completed = subprocess.run([sys.executable, script] + arguments, cwd=workPath,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if check:
+        assert completed.returncode == 0, completed.stderr
+    return completed
+
+
+def ReadReport(fileName, ignore=VOLATILE_COLUMNS):
+    # report rows in report order, without the columns that may differ
+    with open(fileName, newline='') as csvFile:
+        rows = list(csv.reader(csvFile))
+    header = rows[0]
+    keep = [index for index, name in enumerate(header) if name not in ignore]
+    return [[row[index] for index in keep] for row in rows]
+
+
+def Scan(tree, reportPath, options=(), script=HASH_SCRIPT, ignore=VOLATILE_COLUMNS):
+    os.makedirs(reportPath, exist_ok=True)
+    RunScan(reportPath, ['--md5', '--sha256', '-d', tree, '-r', reportPath] + list(options), script)
+    return ReadReport(os.path.join(reportPath, 'fileSystemReport.csv'), ignore)
+
+
+@pytest.fixture(scope='module')
+def sequentialReport(tree, tmp_path_factory):
+    reportPath = str(tmp_path_factory.mktemp('sequential'))
+    Scan(tree, reportPath)
+    return os.path.join(reportPath, 'fileSystemReport.csv')
+
+
+@pytest.fixture(scope='module')
+def sequential(sequentialReport):
+    return ReadReport(sequentialReport)
+
+
+@pytest.fixture(scope='module')
+def sequentialSplit(sequentialReport):
+    return ReadReport(sequentialReport, SPLIT_SCAN_COLUMNS)
+
+
+@pytest.mark.parametrize('options', SCAN_VARIANTS, ids=[' '.join(options) for options in SCAN_VARIANTS])
+def test_scan_options_match_sequential(tree, sequential, tmp_path, options):
+    assert Scan(tree, str(tmp_path), options) == sequential
+
+
+def test_sys_file_hashing_matches_hash(tree, sequential, tmp_path):
+    assert Scan(tree, str(tmp_path), ['--workers', '2'], SYS_SCRIPT) == sequential
+
+
+def test_merged_shards_match_single_scan(tree, sequentialSplit, tmp_path):
+    planFile = str(tmp_path / 'plan.json')
+    RunScan(str(tmp_path), ['--plan-shards', '3', '--shard-plan', planFile, '-d', tree])
+    with open(planFile) as f:
+        plan = json.load(f)
+    # every shard has work, or the merge would not be tested
+    assert all(plan['files'])
+    partials = []
+    for shard in (1, 2, 3):
+        RunScan(str(tmp_path), ['--md5', '--sha256', '--shard', '%d/3' % shard, '--shard-plan', planFile,
+                                '-d', tree, '-r', str(tmp_path)])
+        partials += ['--merge-shards', str(tmp_path / ('fileSystemReport.shard%dof3.csv' % shard))]
+    mergedPath = tmp_path / 'merged'
+    mergedPath.mkdir()
+    # shards given out of order still merge in walk order
+    RunScan(str(tmp_path), partials[4:] + partials[:4] + ['-r', str(mergedPath)])
+    assert ReadReport(str(mergedPath / 'fileSystemReport.csv'), SPLIT_SCAN_COLUMNS) == sequentialSplit
+
+
+def test_resumed_scan_matches_full_run(tree, sequentialSplit, tmp_path):
+    # a throttled scan is killed once it has saved a checkpoint part way
+    # through, then resumed to the end
+    arguments = ['--md5', '--sha256', '--checkpoint', '0.05', '-d', tree, '-r', str(tmp_path)]
+    checkpointFile = tmp_path / 'fileSystemReport.checkpoint'
+    process = subprocess.Popen([sys.executable, HASH_SCRIPT, '--max-bytes-per-sec', '4M'] + arguments,
+                               cwd=str(tmp_path), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 60
+        rows = 0
+        while rows == 0 and process.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.02)
+            try:
+                rows = json.loads(checkpointFile.read_text())['rows']
+            except (OSError, ValueError):
+                rows = 0
+        process.kill()
+    finally:
+        process.wait()
+    assert rows > 0 and rows < len(sequentialSplit) - 1, 'the scan was not interrupted part way through'
+    completed = RunScan(str(tmp_path), arguments + ['--resume'])
+    assert 'Resuming After:' in completed.stdout
+    assert ReadReport(str(tmp_path / 'fileSystemReport.csv'), SPLIT_SCAN_COLUMNS) == sequentialSplit
+    assert not checkpointFile.exists()
+
+
+@pytest.mark.parametrize('options', [[], ['--workers', '2'], ['--mmap-threshold', '64K']], ids=['sequential', 'workers', 'mmap'])
+def test_md5_matches_md5sum_on_sparse_and_hardlinked_files(tree, tmp_path, options):
+    rows = Scan(tree, str(tmp_path), options)
+    header = rows[0]
+    digests = dict((row[header.index('Path')], row[header.index('MD5')]) for row in rows[1:])
+    special = ['dir0/sparse.img', 'dir3/link-to-sparse.img', 'dir1/f0.bin', 'dir2/link-to-f0.bin']
+    md5sum = shutil.which('md5sum')
+    for name in special:
+        path = os.path.join(tree, name)
+        with open(path, 'rb') as f:
+            assert digests[path] == hashlib.md5(f.read()).hexdigest(), name
+        if md5sum is not None:
+            output = subprocess.run([md5sum, path], stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+            assert digests[path] == output.split()[0], name
+
+
+def test_sparse_file_is_sparse(tree):
+    # the sparse cases above only test the hole walk if the file system kept the holes
+    st = os.stat(os.path.join(tree, 'dir0', 'sparse.img'))
+    if st.st_blocks * 512 >= st.st_size:
+        pytest.skip('the file system does not keep sparse files')